@@ -0,0 +1,90 @@
+"""Micro-benchmark: build + serialize one pressure Observation.
+
+Compares the hand-built nested dict that every component used before
+with common.fhir_resources templates, each serialized with stdlib json
+and, when installed, orjson.
+
+    python benchmarks/bench_fhir_resources.py [iterations]
+"""
+import json
+import os
+import sys
+import timeit
+import uuid
+from datetime import datetime, timezone
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from common import fhir_resources
+
+
+def legacy_build(patient_id, value):
+    return {
+        "resourceType": "Observation",
+        "id": str(uuid.uuid4()),
+        "status": "final",
+        "category": [{
+            "coding": [{
+                "system": "http://terminology.hl7.org/CodeSystem/observation-category",
+                "code": "vital-signs",
+                "display": "Vital Signs"
+            }]
+        }],
+        "code": {
+            "coding": [{
+                "system": "http://loinc.org",
+                "code": "31209-0",
+                "display": "Pressure in wound therapy device"
+            }],
+            "text": "Wound pressure"
+        },
+        "subject": {
+            "reference": f"Patient/{patient_id}"
+        },
+        "effectiveDateTime": datetime.now(timezone.utc).isoformat(timespec='milliseconds'),
+        "valueQuantity": {
+            "value": value,
+            "unit": "mmHg",
+            "system": "http://unitsofmeasure.org",
+            "code": "mm[Hg]"
+        }
+    }
+
+
+def legacy():
+    # What requests does for json=: stdlib dumps, then encode.
+    return json.dumps(legacy_build("patient-1", -80.5), allow_nan=False).encode("utf-8")
+
+
+def legacy_fast():
+    return fhir_resources.dumps(legacy_build("patient-1", -80.5))
+
+
+def template_stdlib():
+    observation = fhir_resources.WOUND_PRESSURE.build("Patient/patient-1", -80.5)
+    return json.dumps(observation, separators=(",", ":")).encode("utf-8")
+
+
+def template_fast():
+    return fhir_resources.dumps(fhir_resources.WOUND_PRESSURE.build("Patient/patient-1", -80.5))
+
+
+def main():
+    iterations = int(sys.argv[1]) if len(sys.argv) > 1 else 100000
+    cases = [("legacy dict + json", legacy), ("template + json", template_stdlib)]
+    if fhir_resources.orjson is not None:
+        cases += [("legacy dict + orjson", legacy_fast), ("template + orjson", template_fast)]
+    else:
+        print("orjson not installed, skipping the fast backend")
+
+    assert json.loads(legacy())["code"] == json.loads(template_fast())["code"] == json.loads(legacy_fast())["code"]
+
+    baseline = None
+    for name, fn in cases:
+        best = min(timeit.repeat(fn, number=iterations, repeat=5)) / iterations
+        baseline = baseline or best
+        print(f"{name:<24} {best * 1e6:7.2f} µs/resource  ({baseline / best:4.2f}x)")
+
+
+if __name__ == "__main__":
+    main()
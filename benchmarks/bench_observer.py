@@ -0,0 +1,196 @@
+"""Read-path benchmark for web_sockets/observer.py.
+
+Seeds a fake FHIR server (benchmarks/fake_fhir.py, in a child process) with
+`--observations` pressure readings spread over `--patients` patients, plus
+device errors, warnings and DiagnosticReports. Then it times the observer's
+endpoints in-process under `--clients` concurrent clients and reports per
+endpoint: latency distribution, FHIR calls per request and peak Python
+memory (tracemalloc) as JSON:
+
+    python benchmarks/bench_observer.py --observations 1000 10000 100000 --output read.json
+
+Each size gets a fresh backend and fresh observer caches. `--cache-ttl 0`
+measures the uncached path.
+"""
+import argparse
+import json
+import multiprocessing
+import os
+import random
+import shutil
+import sys
+import tempfile
+import time
+import tracemalloc
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta, timezone
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "web_sockets"))
+
+from common import fhir_resources
+from fake_fhir import FakeFhirServer, FakeFhirStore, STATS_PATH
+
+ENDPOINTS = [
+    "/api/patients",
+    "/api/heart?patient={patient}",
+    "/api/errors?patient={patient}",
+    "/api/reports?patient={patient}",
+    "/api/dashboard?patient={patient}",
+    "/api/report/pdf?patient={patient}",
+]
+
+
+def seed(store, observations, patients, issue_every, report_size):
+    """Fill `store` with one reading per second per patient, ending now."""
+    per_patient = observations // patients
+    start = datetime.now(timezone.utc) - timedelta(seconds=per_patient)
+    for p in range(patients):
+        patient_id = f"bench-patient-{p}"
+        subject = f"Patient/{patient_id}"
+        store.put({"resourceType": "Patient", "id": patient_id, "name": [{"given": ["Bench"], "family": f"Patient {p}"}]})
+        recent = []
+        for i in range(per_patient):
+            effective = (start + timedelta(seconds=i)).isoformat(timespec="milliseconds")
+            status = "paused" if i % 600 < 30 else "running"
+            obs = fhir_resources.WOUND_PRESSURE.build(subject, -random.uniform(50, 150), effective)
+            obs["component"] = fhir_resources.device_state_components("continuous", status)
+            recent.append(f"Observation/{store.put(obs)['id']}")
+            if i % issue_every == issue_every - 1:
+                template = fhir_resources.DEVICE_ERROR if i % (2 * issue_every) else fhir_resources.DEVICE_WARNING
+                store.put(template.build(subject, "Simulated issue", effective))
+            if len(recent) == report_size:
+                store.put({
+                    "resourceType": "DiagnosticReport",
+                    "status": "final",
+                    "code": {"text": "Therapy report"},
+                    "subject": {"reference": subject},
+                    "issued": effective,
+                    "result": [{"reference": ref} for ref in recent],
+                    "conclusion": f"Report of {len(recent)} readings.",
+                })
+                recent = []
+
+
+def serve_fake_fhir(args, observations, ready):
+    store = FakeFhirStore()
+    started = time.time()
+    seed(store, observations, args.patients, args.issue_every, args.report_size)
+    server = FakeFhirServer(store, latency=args.fhir_latency).start()
+    ready.put((server.url, time.time() - started))
+    server.thread.join()
+
+
+def take_counters(fhir_url):
+    with urllib.request.urlopen(f"{fhir_url}/{STATS_PATH}") as response:
+        return json.load(response)
+
+
+def latency_summary(values):
+    values = sorted(values)
+    pick = lambda p: values[min(len(values) - 1, int(p / 100 * len(values)))] * 1000
+    return {
+        "mean_ms": sum(values) / len(values) * 1000,
+        "p50_ms": pick(50),
+        "p95_ms": pick(95),
+        "p99_ms": pick(99),
+        "max_ms": values[-1] * 1000,
+    }
+
+
+def reset_observer(observer, args, workdir):
+    observer.cache = observer.TTLCache(ttl=args.cache_ttl, max_entries=observer.CACHE_MAX_ENTRIES)
+    observer.pressure_buffers = observer.PressureBuffers(observer.PRESSURE_BUFFER_CAPACITY, observer.PRESSURE_BUFFER_PATIENTS)
+    observer.pdf_cache = observer.PdfCache(os.path.join(workdir, f"pdf-{time.monotonic_ns()}"), observer.PDF_CACHE_MAX_BYTES)
+
+
+def bench_endpoint(observer, path, args):
+    patients = [f"bench-patient-{p}" for p in range(args.patients)]
+
+    def one_request(_):
+        client = observer.app.test_client()
+        url = path.format(patient=random.choice(patients))
+        started = time.perf_counter()
+        response = client.get(url)
+        response.get_data()
+        return time.perf_counter() - started, response.status_code
+
+    tracemalloc.reset_peak()
+    before, _ = tracemalloc.get_traced_memory()
+    with ThreadPoolExecutor(max_workers=args.clients) as pool:
+        results = list(pool.map(one_request, range(args.requests)))
+    _, peak = tracemalloc.get_traced_memory()
+
+    latencies = [seconds for seconds, _ in results]
+    return {
+        "requests": len(results),
+        "errors": sum(1 for _, status in results if status >= 400),
+        "latency": latency_summary(latencies),
+        "peak_memory_mb": (peak - before) / 2**20,
+    }
+
+
+def run_size(observer, args, observations, workdir):
+    ready = multiprocessing.Queue()
+    backend = multiprocessing.Process(target=serve_fake_fhir, args=(args, observations, ready), daemon=True)
+    backend.start()
+    try:
+        fhir_url, seed_seconds = ready.get(timeout=args.seed_timeout)
+        observer.FHIR_URL = fhir_url
+        observer.fhir = observer.FhirClient(fhir_url, pool_size=observer.DASHBOARD_WORKERS + observer.REPORT_FETCH_WORKERS)
+        reset_observer(observer, args, workdir)
+
+        endpoints = {}
+        for path in ENDPOINTS:
+            take_counters(fhir_url)
+            result = bench_endpoint(observer, path, args)
+            counters = take_counters(fhir_url)
+            result["fhir_calls"] = counters["calls"]
+            result["fhir_calls_per_request"] = counters["requests"] / result["requests"]
+            endpoints[path.split("?")[0]] = result
+            print(f"  {observations:>8} obs  {path.split('?')[0]:<18} p50 {result['latency']['p50_ms']:8.1f} ms  "
+                  f"p99 {result['latency']['p99_ms']:8.1f} ms  {result['fhir_calls_per_request']:5.2f} FHIR calls/req  "
+                  f"peak {result['peak_memory_mb']:6.1f} MB", file=sys.stderr)
+        return {"observations": observations, "seed_seconds": seed_seconds, "endpoints": endpoints}
+    finally:
+        backend.terminate()
+        backend.join()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--observations", type=int, nargs="+", default=[1000, 10000, 100000])
+    parser.add_argument("--patients", type=int, default=10)
+    parser.add_argument("--issue-every", type=int, default=50, help="one error or warning per this many readings")
+    parser.add_argument("--report-size", type=int, default=300, help="readings per DiagnosticReport")
+    parser.add_argument("--clients", type=int, default=8, help="concurrent clients")
+    parser.add_argument("--requests", type=int, default=200, help="requests per endpoint")
+    parser.add_argument("--cache-ttl", type=float, default=5.0, help="observer cache TTL, 0 disables it")
+    parser.add_argument("--fhir-latency", type=float, default=0.0, help="seconds added to every FHIR response")
+    parser.add_argument("--seed-timeout", type=float, default=1800)
+    parser.add_argument("--output", help="write the JSON result to this file instead of stdout")
+    args = parser.parse_args()
+
+    # The observer keeps its PDF cache in the working directory
+    workdir = tempfile.mkdtemp(prefix="observer-bench-")
+    os.chdir(workdir)
+    import observer
+
+    tracemalloc.start()
+    try:
+        runs = [run_size(observer, args, n, workdir) for n in args.observations]
+    finally:
+        tracemalloc.stop()
+        shutil.rmtree(workdir, ignore_errors=True)
+
+    text = json.dumps({"config": vars(args), "runs": runs}, indent=2)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(text + "\n")
+    else:
+        print(text)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,294 @@
+"""In-process fake FHIR server for the benchmarks.
+
+Implements just enough of the FHIR REST API for the ingest and observer
+code paths: transaction Bundles with PUT and conditional-create entries,
+plain POST/PUT/GET by id, and Observation/DiagnosticReport/Patient/Device
+searches with the parameters the observer uses, `_count` paging and
+`next` links. Latency and 503 failures can be injected per request.
+`GET <base>/$bench-stats` returns and resets the request counters.
+
+Every stored Observation gets a commit timestamp so a harness can measure
+end-to-end latency without instrumenting the server under test.
+"""
+import json
+import random
+import threading
+import time
+import uuid
+from bisect import bisect_left, insort
+from datetime import datetime, timezone
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlencode, urlsplit
+
+FHIR_JSON = "application/fhir+json"
+DEFAULT_PAGE_SIZE = 20
+STATS_PATH = "$bench-stats"
+
+
+def now_iso():
+    return datetime.now(timezone.utc).isoformat(timespec="milliseconds")
+
+
+def parse_time(value):
+    return datetime.fromisoformat(value.replace("Z", "+00:00")).timestamp()
+
+
+class FakeFhirStore:
+    """Resources by type and id, plus the indexes the searches need.
+
+    Observations are indexed by (patient, LOINC code) and kept sorted by
+    effective time, so seeding a million of them stays searchable.
+    """
+
+    def __init__(self):
+        self.lock = threading.RLock()
+        self.resources: dict[str, dict[str, dict]] = {}
+        self.identifiers: dict[str, str] = {}
+        self.by_subject_code: dict[tuple, list] = {}
+        self.reports_by_subject: dict[str, list] = {}
+        self.commits: list[tuple[float, str, str]] = []
+
+    def put(self, resource, resource_id=None):
+        resource_type = resource["resourceType"]
+        resource_id = resource_id or resource.get("id") or str(uuid.uuid4())
+        resource["id"] = resource_id
+        with self.lock:
+            resource["meta"] = {"versionId": "1", "lastUpdated": now_iso()}
+            existing = self.resources.setdefault(resource_type, {}).get(resource_id)
+            if existing is not None:
+                resource["meta"]["versionId"] = str(int(existing["meta"]["versionId"]) + 1)
+            self.resources[resource_type][resource_id] = resource
+            if existing is None:
+                self._index(resource)
+        return resource
+
+    def create(self, resource, if_none_exist=None):
+        """Conditional create; returns (resource, created)."""
+        with self.lock:
+            if if_none_exist:
+                existing_id = self.identifiers.get(if_none_exist.split("=", 1)[1])
+                if existing_id is not None:
+                    return self.resources[resource["resourceType"]][existing_id], False
+            return self.put(resource, str(uuid.uuid4())), True
+
+    def _index(self, resource):
+        resource_type = resource["resourceType"]
+        for identifier in resource.get("identifier", []):
+            self.identifiers[f"{identifier.get('system')}|{identifier.get('value')}"] = resource["id"]
+        subject = resource.get("subject", {}).get("reference")
+        if resource_type == "Observation":
+            code = resource["code"]["coding"][0]["code"]
+            effective = parse_time(resource.get("effectiveDateTime", now_iso()))
+            insort(self.by_subject_code.setdefault((subject, code), []), (effective, resource["id"]))
+            value = resource.get("identifier", [{}])[0].get("value", "")
+            self.commits.append((time.time(), value, resource.get("effectiveDateTime", "")))
+        elif resource_type == "DiagnosticReport":
+            insort(self.reports_by_subject.setdefault(subject, []), (resource.get("issued", ""), resource["id"]))
+
+    def get(self, resource_type, resource_id):
+        return self.resources.get(resource_type, {}).get(resource_id)
+
+    def count(self, resource_type):
+        return len(self.resources.get(resource_type, {}))
+
+
+class FakeFhirServer:
+    """Runs a `FakeFhirStore` behind HTTP on a background thread.
+
+    `latency` (+/- `jitter`) seconds are slept before every response, and
+    `failure_rate` of requests are answered with 503 without being applied.
+    """
+
+    def __init__(self, store=None, latency=0.0, jitter=0.0, failure_rate=0.0, host="127.0.0.1", port=0):
+        self.store = store or FakeFhirStore()
+        self.latency = latency
+        self.jitter = jitter
+        self.failure_rate = failure_rate
+        self.requests = 0
+        self.failures = 0
+        self.calls: dict[str, int] = {}
+        self.counter_lock = threading.Lock()
+        self.httpd = ThreadingHTTPServer((host, port), self._handler_class())
+        self.httpd.daemon_threads = True
+        self.thread = None
+
+    @property
+    def url(self):
+        host, port = self.httpd.server_address[:2]
+        return f"http://{host}:{port}/fhir"
+
+    def start(self):
+        self.thread = threading.Thread(target=self.httpd.serve_forever, daemon=True)
+        self.thread.start()
+        return self
+
+    def stop(self):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+    def take_counters(self):
+        with self.counter_lock:
+            counters = {"requests": self.requests, "failures": self.failures, "calls": self.calls}
+            self.requests = 0
+            self.failures = 0
+            self.calls = {}
+        return counters
+
+    def _handler_class(self):
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def log_message(self, *args):
+                pass
+
+            def do_GET(self):
+                self._dispatch("GET")
+
+            def do_POST(self):
+                self._dispatch("POST")
+
+            def do_PUT(self):
+                self._dispatch("PUT")
+
+            def _dispatch(self, method):
+                body = self.rfile.read(int(self.headers.get("Content-Length") or 0))
+                split = urlsplit(self.path)
+                parts = [p for p in split.path.split("/") if p][1:]
+                query = parse_qs(split.query)
+                if parts == [STATS_PATH]:
+                    # Lets a harness in another process read and reset the counters
+                    return self._send(200, server.take_counters())
+                key = f"{method} {parts[0] if parts else 'transaction'}"
+                with server.counter_lock:
+                    server.requests += 1
+                    server.calls[key] = server.calls.get(key, 0) + 1
+                    fail = random.random() < server.failure_rate
+                    if fail:
+                        server.failures += 1
+
+                if server.latency or server.jitter:
+                    time.sleep(max(0.0, server.latency + random.uniform(-server.jitter, server.jitter)))
+                if fail:
+                    return self._send(503, {"resourceType": "OperationOutcome", "issue": [{"severity": "error", "code": "transient"}]})
+
+                try:
+                    status, payload, headers = server._handle(method, parts, query, body, self.headers.get("If-None-Exist"))
+                except Exception as e:
+                    status, payload, headers = 500, {"resourceType": "OperationOutcome", "issue": [{"diagnostics": str(e)}]}, {}
+                self._send(status, payload, headers)
+
+            def _send(self, status, payload, headers=None):
+                data = json.dumps(payload).encode()
+                self.send_response(status)
+                self.send_header("Content-Type", FHIR_JSON)
+                self.send_header("Content-Length", str(len(data)))
+                for name, value in (headers or {}).items():
+                    self.send_header(name, value)
+                self.end_headers()
+                self.wfile.write(data)
+
+        return Handler
+
+    def _handle(self, method, parts, query, body, if_none_exist=None):
+        store = self.store
+        if method == "POST" and not parts:
+            return 200, self._transaction(json.loads(body)), {}
+        if method == "POST":
+            resource, created = store.create(json.loads(body), if_none_exist)
+            return 201 if created else 200, resource, {"Location": self._location(resource)}
+        if method == "PUT":
+            resource = store.put(json.loads(body), parts[1])
+            return 200, resource, {"Location": self._location(resource)}
+        if len(parts) == 2:
+            resource = store.get(parts[0], parts[1])
+            return (200, resource, {}) if resource else (404, {"resourceType": "OperationOutcome"}, {})
+        return 200, self._search(parts[0], query), {}
+
+    def _location(self, resource):
+        return f"{self.url}/{resource['resourceType']}/{resource['id']}/_history/{resource['meta']['versionId']}"
+
+    def _transaction(self, bundle):
+        entries = []
+        for entry in bundle.get("entry", []):
+            request, resource = entry["request"], entry["resource"]
+            if request["method"] == "PUT":
+                resource = self.store.put(resource, request["url"].split("/")[1])
+                status = "200 OK"
+            else:
+                resource, created = self.store.create(resource, request.get("ifNoneExist"))
+                status = "201 Created" if created else "200 OK"
+            location = f"{resource['resourceType']}/{resource['id']}/_history/{resource['meta']['versionId']}"
+            entries.append({"response": {"status": status, "location": location}})
+        return {"resourceType": "Bundle", "type": "transaction-response", "entry": entries}
+
+    def _search(self, resource_type, query):
+        store = self.store
+        count = int(query.get("_count", [DEFAULT_PAGE_SIZE])[0])
+        offset = int(query.get("_getpagesoffset", ["0"])[0])
+        with store.lock:
+            if "_id" in query:
+                ids = [i for value in query["_id"] for i in value.split(",")]
+                matches = [store.get(resource_type, i) for i in ids]
+                matches = [m for m in matches if m is not None]
+            elif resource_type == "Observation":
+                matches = self._search_observations(query)
+            elif resource_type == "DiagnosticReport":
+                subject = query.get("subject", [None])[0]
+                refs = store.reports_by_subject.get(subject, [])
+                ordered = reversed(refs) if query.get("_sort", [""])[0].startswith("-") else refs
+                matches = [store.get("DiagnosticReport", i) for _, i in ordered]
+            else:
+                matches = list(store.resources.get(resource_type, {}).values())
+
+        page = matches[offset:offset + count]
+        entries = [{"resource": r, "search": {"mode": "match"}} for r in page]
+        if resource_type == "DiagnosticReport" and "_include" in query:
+            for report in page:
+                for ref in report.get("result", []):
+                    included = store.get(*ref["reference"].split("/"))
+                    if included is not None:
+                        entries.append({"resource": included, "search": {"mode": "include"}})
+
+        bundle = {"resourceType": "Bundle", "type": "searchset", "total": len(matches), "entry": entries, "link": []}
+        if offset + count < len(matches):
+            next_query = {k: v for k, v in query.items() if k != "_getpagesoffset"}
+            next_query["_getpagesoffset"] = [str(offset + count)]
+            bundle["link"].append({"relation": "next", "url": f"{self.url}/{resource_type}?{urlencode(next_query, doseq=True)}"})
+        return bundle
+
+    def _search_observations(self, query):
+        store = self.store
+        subject = query.get("subject", [None])[0]
+        codes = query.get("code", [""])[0].split(",")
+        low = (float("-inf"),)
+        high = (float("inf"),)
+        for value in query.get("date", []):
+            prefix, moment = value[:2], parse_time(value[2:])
+            # Index entries are (time, id); "\uffff" sorts after every id
+            if prefix == "gt":
+                low = max(low, (moment, "\uffff"))
+            elif prefix == "ge":
+                low = max(low, (moment,))
+            elif prefix == "lt":
+                high = min(high, (moment,))
+            elif prefix == "le":
+                high = min(high, (moment, "\uffff"))
+
+        refs = []
+        for code in codes:
+            index = store.by_subject_code.get((subject, code), [])
+            refs.extend(index[bisect_left(index, low):bisect_left(index, high)])
+        refs.sort()
+        matches = [store.get("Observation", i) for _, i in refs]
+
+        for value in query.get("_lastUpdated", []):
+            moment = value[2:]
+            matches = [m for m in matches if m["meta"]["lastUpdated"] > moment]
+        sort = query.get("_sort", ["date"])[0]
+        if sort.lstrip("-") == "_lastUpdated":
+            matches.sort(key=lambda m: m["meta"]["lastUpdated"])
+        if sort.startswith("-"):
+            matches.reverse()
+        return matches
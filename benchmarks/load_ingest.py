@@ -0,0 +1,317 @@
+"""End-to-end ingest benchmark for web_sockets/socket_server.py.
+
+Starts an in-process fake FHIR server, runs socket_server.py against it in
+a subprocess, and connects N headless websocket devices. Reports message
+throughput, latency from device send (and from server receive) to FHIR
+commit, and the server's resident memory, as JSON:
+
+    python benchmarks/load_ingest.py --devices 500 --rate 1 --duration 60 \\
+        --fhir-latency 0.2 --output results.json
+
+Profiles: "steady" sends at `rate` per device; "burst" adds `burst-size`
+back-to-back messages from every device every `burst-interval` seconds;
+"ramp" connects devices gradually over the first half of the run.
+`--invalid-rate` mixes in malformed messages, and also leaves one in the
+server's write-ahead log as if from an earlier run; none of them may hold
+up the valid ones ("drained" stays true).
+"""
+import argparse
+import asyncio
+import json
+import os
+import random
+import shutil
+import socket
+import sqlite3
+import subprocess
+import sys
+import tempfile
+import time
+import uuid
+
+import websockets
+
+from fake_fhir import FakeFhirServer, parse_time
+
+SERVER_SCRIPT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "web_sockets", "socket_server.py")
+
+# Messages the server must reject without blocking anything behind them
+INVALID_MESSAGES = [
+    {"error": True, "severity": "info"},
+    {"device_id": "load-device-invalid", "error": True, "severity": "info", "message": "Unknown severity"},
+    {"device_id": "load-device-invalid", "value": "high", "status": "running"},
+    {"value": -80, "status": "running"},
+    ["not", "an", "object"],
+]
+
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def percentile(sorted_values, p):
+    if not sorted_values:
+        return None
+    return sorted_values[min(len(sorted_values) - 1, int(p / 100 * len(sorted_values)))]
+
+
+def latency_summary(values):
+    values = sorted(values)
+    return {
+        "count": len(values),
+        "p50_ms": percentile(values, 50) * 1000 if values else None,
+        "p95_ms": percentile(values, 95) * 1000 if values else None,
+        "p99_ms": percentile(values, 99) * 1000 if values else None,
+        "max_ms": values[-1] * 1000 if values else None,
+    }
+
+
+def rss_bytes(pid):
+    try:
+        with open(f"/proc/{pid}/status") as f:
+            for line in f:
+                if line.startswith("VmRSS:"):
+                    return int(line.split()[1]) * 1024
+    except OSError:
+        pass
+    return None
+
+
+class LoadGenerator:
+    def __init__(self, args, url):
+        self.args = args
+        self.url = url
+        self.sent: dict[str, float] = {}
+        self.connect_failures = 0
+        self.send_failures = 0
+        self.ended = 0
+        self.invalid_sent = 0
+        self.invalid_rejected = 0
+
+    def payload(self, device_id, status):
+        args = self.args
+        msg_id = str(uuid.uuid4())
+        payload = {
+            "device_id": device_id,
+            "msg_id": msg_id,
+            "value": -random.uniform(50, 150),
+            "mode": "continuous",
+            "status": status,
+            "error": False,
+            "message": "",
+        }
+        if status != "ended" and random.random() < args.error_rate:
+            payload["error"] = True
+            payload["severity"] = random.choice(["warning", "error"])
+            payload["message"] = "Simulated load error"
+        return msg_id, payload
+
+    async def read_replies(self, ws):
+        try:
+            async for reply in ws:
+                if "error" in json.loads(reply):
+                    self.invalid_rejected += 1
+        except websockets.WebSocketException:
+            pass
+
+    async def send(self, ws, device_id, status):
+        if random.random() < self.args.invalid_rate:
+            self.invalid_sent += 1
+            await ws.send(json.dumps(random.choice(INVALID_MESSAGES)))
+        msg_id, payload = self.payload(device_id, status)
+        self.sent[msg_id] = time.time()
+        await ws.send(json.dumps(payload))
+
+    async def run_device(self, index, stop_at):
+        args = self.args
+        device_id = f"load-device-{index}"
+        if args.profile == "ramp":
+            await asyncio.sleep(index / args.devices * args.duration / 2)
+        try:
+            ws = await websockets.connect(self.url)
+        except (OSError, websockets.WebSocketException):
+            self.connect_failures += 1
+            return
+
+        replies = asyncio.create_task(self.read_replies(ws))
+        loop = asyncio.get_running_loop()
+        period = 1.0 / args.rate
+        next_at = loop.time() + random.uniform(0, period)
+        next_burst = loop.time() + args.burst_interval
+        try:
+            while time.time() < stop_at:
+                await asyncio.sleep(max(0.0, next_at - loop.time()))
+                next_at += period
+                status = "paused" if random.random() < args.pause_rate else "running"
+                await self.send(ws, device_id, status)
+                if args.profile == "burst" and loop.time() >= next_burst:
+                    next_burst += args.burst_interval
+                    for _ in range(args.burst_size):
+                        await self.send(ws, device_id, "running")
+            if args.end_sessions:
+                await self.send(ws, device_id, "ended")
+                self.ended += 1
+        except websockets.WebSocketException:
+            self.send_failures += 1
+        finally:
+            await ws.close()
+            await replies
+
+    async def run(self):
+        stop_at = time.time() + self.args.duration
+        await asyncio.gather(*(self.run_device(i, stop_at) for i in range(self.args.devices)))
+
+
+def seed_wal(path, records):
+    # The table as an older web_sockets/write_ahead_log.py created it, left
+    # over from a "previous run"
+    db = sqlite3.connect(path)
+    db.execute("CREATE TABLE IF NOT EXISTS records (seq INTEGER PRIMARY KEY AUTOINCREMENT, "
+               "received_at REAL NOT NULL, payload TEXT NOT NULL)")
+    db.executemany("INSERT INTO records (received_at, payload) VALUES (?, ?)",
+                   [(time.time(), json.dumps(record)) for record in records])
+    db.commit()
+    db.close()
+
+
+def wait_for_port(port, process, timeout=30):
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        if process.poll() is not None:
+            raise RuntimeError(f"socket_server.py exited with {process.returncode}")
+        try:
+            with socket.create_connection(("127.0.0.1", port), timeout=0.5):
+                return
+        except OSError:
+            time.sleep(0.2)
+    raise RuntimeError("socket_server.py did not start listening")
+
+
+async def sample_rss(pid, samples, stop):
+    while not stop.is_set():
+        rss = rss_bytes(pid)
+        if rss is not None:
+            samples.append(rss)
+        try:
+            await asyncio.wait_for(stop.wait(), 1.0)
+        except asyncio.TimeoutError:
+            pass
+
+
+async def wait_for_commits(store, generator, expected_reports, timeout):
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        committed = {value.removeprefix("urn:uuid:") for _, value, _ in store.commits}
+        if all(msg_id in committed for msg_id in generator.sent) and store.count("DiagnosticReport") >= expected_reports:
+            return True
+        await asyncio.sleep(0.5)
+    return False
+
+
+async def run_benchmark(args):
+    fhir = FakeFhirServer(latency=args.fhir_latency, jitter=args.fhir_jitter, failure_rate=args.fhir_failure_rate).start()
+    port = free_port()
+    workdir = tempfile.mkdtemp(prefix="ingest-bench-")
+    if args.invalid_rate:
+        seed_wal(os.path.join(workdir, "ingest_wal.sqlite3"), INVALID_MESSAGES[:1])
+    env = {**os.environ, "FHIR_URL": fhir.url, "WS_PORT": str(port), "OBSERVER_URL": "", "METRICS_PORT": "0"}
+    process = subprocess.Popen([sys.executable, os.path.abspath(SERVER_SCRIPT)], cwd=workdir, env=env,
+                               stdout=subprocess.DEVNULL if not args.server_output else None,
+                               stderr=subprocess.STDOUT if not args.server_output else None)
+    try:
+        wait_for_port(port, process)
+        idle_rss = rss_bytes(process.pid)
+        generator = LoadGenerator(args, f"ws://127.0.0.1:{port}")
+        rss_samples = []
+        stop_sampling = asyncio.Event()
+        sampler = asyncio.create_task(sample_rss(process.pid, rss_samples, stop_sampling))
+
+        started = time.time()
+        await generator.run()
+        send_seconds = time.time() - started
+        expected_reports = generator.ended if args.end_sessions else 0
+        drained = await wait_for_commits(fhir.store, generator, expected_reports, args.drain_timeout)
+        total_seconds = time.time() - started
+        stop_sampling.set()
+        await sampler
+    finally:
+        process.terminate()
+        process.wait(timeout=10)
+        fhir.stop()
+        shutil.rmtree(workdir, ignore_errors=True)
+
+    send_latency, receive_latency = [], []
+    for committed_at, value, effective in list(fhir.store.commits):
+        sent_at = generator.sent.get(value.removeprefix("urn:uuid:"))
+        if sent_at is None:
+            continue
+        send_latency.append(committed_at - sent_at)
+        if effective:
+            receive_latency.append(committed_at - parse_time(effective))
+
+    return {
+        "config": vars(args),
+        "messages_sent": len(generator.sent),
+        "messages_committed": len(send_latency),
+        "drained": drained,
+        "send_seconds": send_seconds,
+        "total_seconds": total_seconds,
+        "sent_per_second": len(generator.sent) / send_seconds if send_seconds else 0.0,
+        "committed_per_second": len(send_latency) / total_seconds if total_seconds else 0.0,
+        "connect_failures": generator.connect_failures,
+        "send_failures": generator.send_failures,
+        "invalid_sent": generator.invalid_sent,
+        "invalid_rejected": generator.invalid_rejected,
+        "send_to_commit": latency_summary(send_latency),
+        "receive_to_commit": latency_summary(receive_latency),
+        "server_rss_mb": {
+            "idle": idle_rss / 2**20 if idle_rss else None,
+            "peak": max(rss_samples) / 2**20 if rss_samples else None,
+            "final": rss_samples[-1] / 2**20 if rss_samples else None,
+        },
+        "fhir": {
+            "requests": fhir.requests,
+            "injected_failures": fhir.failures,
+            "calls": fhir.calls,
+            "reports": fhir.store.count("DiagnosticReport"),
+        },
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--devices", type=int, default=100)
+    parser.add_argument("--rate", type=float, default=1.0, help="messages per second per device")
+    parser.add_argument("--duration", type=float, default=30.0, help="seconds of sending")
+    parser.add_argument("--profile", choices=["steady", "burst", "ramp"], default="steady")
+    parser.add_argument("--burst-size", type=int, default=10)
+    parser.add_argument("--burst-interval", type=float, default=10.0)
+    parser.add_argument("--error-rate", type=float, default=0.05)
+    parser.add_argument("--pause-rate", type=float, default=0.02)
+    parser.add_argument("--invalid-rate", type=float, default=0.0,
+                        help="fraction of messages preceded by a malformed one the server must reject")
+    parser.add_argument("--no-end-sessions", dest="end_sessions", action="store_false",
+                        help="do not send a final 'ended' message (no DiagnosticReports)")
+    parser.add_argument("--fhir-latency", type=float, default=0.05, help="seconds added to every FHIR response")
+    parser.add_argument("--fhir-jitter", type=float, default=0.0)
+    parser.add_argument("--fhir-failure-rate", type=float, default=0.0, help="fraction of FHIR requests answered with 503")
+    parser.add_argument("--drain-timeout", type=float, default=60.0, help="seconds to wait for the backlog to reach FHIR")
+    parser.add_argument("--server-output", action="store_true", help="show socket_server.py output")
+    parser.add_argument("--output", help="write the JSON result to this file instead of stdout")
+    args = parser.parse_args()
+
+    result = asyncio.run(run_benchmark(args))
+    text = json.dumps(result, indent=2)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(text + "\n")
+        print(f"{result['messages_committed']}/{result['messages_sent']} committed, "
+              f"p99 send->commit {result['send_to_commit']['p99_ms']} ms -> {args.output}")
+    else:
+        print(text)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,68 @@
+"""In-process fan-out of ingest events to dashboard streams."""
+import json
+import queue
+import threading
+
+SUBSCRIBER_QUEUE_SIZE = 256
+STREAM_KEEPALIVE = 15
+
+
+class EventBroker:
+    """Per-patient publish/subscribe for Server-Sent Events.
+
+    Every subscriber has a bounded queue. One that falls behind has its
+    queue replaced by a single "resync" event, telling the page to reload
+    its state with a normal fetch instead of replaying the backlog.
+    """
+
+    def __init__(self, queue_size=SUBSCRIBER_QUEUE_SIZE):
+        self.queue_size = queue_size
+        self.subscribers: dict[str, set[queue.Queue]] = {}
+        self.lock = threading.Lock()
+
+    def subscribe(self, patient_id):
+        subscriber = queue.Queue(maxsize=self.queue_size)
+        with self.lock:
+            self.subscribers.setdefault(patient_id, set()).add(subscriber)
+        return subscriber
+
+    def unsubscribe(self, patient_id, subscriber):
+        with self.lock:
+            subscribers = self.subscribers.get(patient_id)
+            if subscribers is not None:
+                subscribers.discard(subscriber)
+                if not subscribers:
+                    del self.subscribers[patient_id]
+
+    def publish(self, patient_id, event):
+        with self.lock:
+            subscribers = list(self.subscribers.get(patient_id, ()))
+        for subscriber in subscribers:
+            try:
+                subscriber.put_nowait(event)
+            except queue.Full:
+                with subscriber.mutex:
+                    subscriber.queue.clear()
+                try:
+                    subscriber.put_nowait({"type": "resync"})
+                except queue.Full:
+                    pass
+
+    def stream(self, patient_id, keepalive=STREAM_KEEPALIVE):
+        """Generate `text/event-stream` chunks for one patient until the client leaves."""
+        subscriber = self.subscribe(patient_id)
+        try:
+            yield "retry: 3000\n\n"
+            while True:
+                try:
+                    event = subscriber.get(timeout=keepalive)
+                except queue.Empty:
+                    yield ": keepalive\n\n"
+                    continue
+                yield f"event: {event['type']}\ndata: {json.dumps(event)}\n\n"
+        finally:
+            self.unsubscribe(patient_id, subscriber)
+
+    def subscriber_count(self):
+        with self.lock:
+            return sum(len(subscribers) for subscribers in self.subscribers.values())
@@ -0,0 +1,171 @@
+"""Pooled HTTP client for the FHIR server, shared by every component.
+
+One keep-alive `requests.Session` per process with a connection pool sized
+for the component's concurrency, connect/read timeouts on every call,
+bounded jittered retries for overload and outages, and per-call latency
+counters and histograms.
+"""
+import random
+import threading
+import time
+from urllib.parse import urlsplit
+
+import requests
+from requests.adapters import HTTPAdapter
+
+from common.fhir_resources import FHIR_JSON, dumps
+from common.metrics import REGISTRY
+
+FHIR_CONNECT_TIMEOUT = 3.05
+FHIR_READ_TIMEOUT = 10
+FHIR_POOL_SIZE = 10
+FHIR_MAX_RETRIES = 3
+FHIR_RETRY_BASE_DELAY = 0.2
+FHIR_RETRY_MAX_DELAY = 5.0
+
+RETRY_STATUSES = {429, 500, 502, 503, 504}
+IDEMPOTENT_METHODS = {"GET", "HEAD", "PUT", "DELETE", "OPTIONS"}
+
+FHIR_REQUEST_SECONDS = REGISTRY.histogram(
+    "fhir_request_duration_seconds", "FHIR request latency, per attempt",
+    ["method", "resource", "status"])
+
+
+class CallStats:
+    __slots__ = ("calls", "errors", "retries", "total_seconds", "max_seconds")
+
+    def __init__(self):
+        self.calls = 0
+        self.errors = 0
+        self.retries = 0
+        self.total_seconds = 0.0
+        self.max_seconds = 0.0
+
+
+class FhirClient:
+    """Keep-alive client for one FHIR base URL.
+
+    Paths are relative to `base_url` ("Observation?code=..."); absolute
+    URLs such as `next` links are used as they are.
+
+    429 is always retried. Other 5xx statuses and connection errors are
+    only retried for idempotent requests, because a POST may already have
+    been applied. Callers that know a POST is safe to repeat (conditional
+    creates) pass `idempotent=True`.
+    """
+
+    def __init__(self, base_url, pool_size=FHIR_POOL_SIZE,
+                 timeout=(FHIR_CONNECT_TIMEOUT, FHIR_READ_TIMEOUT), max_retries=FHIR_MAX_RETRIES):
+        self.base_url = base_url.rstrip("/")
+        self.timeout = timeout
+        self.max_retries = max_retries
+
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_size)
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
+        self.session.headers.update({
+            "Accept": FHIR_JSON,
+            "Accept-Encoding": "gzip, deflate",
+        })
+
+        self.lock = threading.Lock()
+        self.calls: dict[str, CallStats] = {}
+
+    def url(self, path):
+        if path.startswith(("http://", "https://")):
+            return path
+        return f"{self.base_url}/{path.lstrip('/')}" if path else self.base_url
+
+    def request(self, method, path, idempotent=None, **kwargs):
+        url = self.url(path)
+        if "resource" in kwargs:
+            kwargs["data"] = dumps(kwargs.pop("resource"))
+            kwargs["headers"] = {"Content-Type": f"{FHIR_JSON}; charset=UTF-8", **kwargs.get("headers", {})}
+        kwargs.setdefault("timeout", self.timeout)
+        if idempotent is None:
+            idempotent = method in IDEMPOTENT_METHODS
+
+        resource_type = self._resource_type(url)
+        key = f"{method} {resource_type}"
+        attempt = 0
+        while True:
+            started = time.perf_counter()
+            try:
+                response = self.session.request(method, url, **kwargs)
+            except requests.RequestException as e:
+                self._record(key, time.perf_counter() - started, method, resource_type, "error")
+                retry = idempotent and isinstance(e, requests.ConnectionError)
+                if not retry or attempt >= self.max_retries:
+                    raise
+                delay = self._backoff(attempt)
+            else:
+                status = response.status_code
+                self._record(key, time.perf_counter() - started, method, resource_type, status)
+                retry = status == 429 or (idempotent and status in RETRY_STATUSES)
+                if not retry or attempt >= self.max_retries:
+                    return response
+                delay = self._retry_after(response) or self._backoff(attempt)
+
+            attempt += 1
+            with self.lock:
+                self.calls[key].retries += 1
+            time.sleep(delay)
+
+    def get(self, path, **kwargs):
+        return self.request("GET", path, **kwargs)
+
+    def post(self, path, **kwargs):
+        return self.request("POST", path, **kwargs)
+
+    def put(self, path, **kwargs):
+        return self.request("PUT", path, **kwargs)
+
+    def stats(self):
+        """Per "<METHOD> <resource type>" call counts and latencies in ms."""
+        with self.lock:
+            return {
+                key: {
+                    "calls": stats.calls,
+                    "errors": stats.errors,
+                    "retries": stats.retries,
+                    "mean_ms": stats.total_seconds / stats.calls * 1000 if stats.calls else 0.0,
+                    "max_ms": stats.max_seconds * 1000,
+                }
+                for key, stats in self.calls.items()
+            }
+
+    def close(self):
+        self.session.close()
+
+    def _resource_type(self, url):
+        path = urlsplit(url).path
+        base = urlsplit(self.base_url).path
+        if path.startswith(base):
+            path = path[len(base):]
+        return path.strip("/").split("/")[0] or "transaction"
+
+    def _record(self, key, seconds, method, resource_type, status):
+        FHIR_REQUEST_SECONDS.labels(method, resource_type, str(status)).observe(seconds)
+        error = status == "error" or status >= 400
+        with self.lock:
+            stats = self.calls.get(key)
+            if stats is None:
+                stats = self.calls[key] = CallStats()
+            stats.calls += 1
+            stats.total_seconds += seconds
+            if seconds > stats.max_seconds:
+                stats.max_seconds = seconds
+            if error:
+                stats.errors += 1
+
+    @staticmethod
+    def _backoff(attempt):
+        return random.uniform(0, min(FHIR_RETRY_MAX_DELAY, FHIR_RETRY_BASE_DELAY * 2 ** attempt))
+
+    @staticmethod
+    def _retry_after(response):
+        value = response.headers.get("Retry-After", "")
+        if value.isdigit():
+            return min(float(value), FHIR_RETRY_MAX_DELAY)
+        return None
@@ -0,0 +1,158 @@
+"""Prebuilt FHIR resource templates shared by the devices and servers.
+
+Every Observation of one kind has the same category and code, so those
+parts are built once here and shared by reference between all resources.
+Only the per-message fields are filled in. The shared parts are frozen
+(`FrozenDict` and tuples), so a caller that tries to modify them in place
+gets a TypeError instead of changing every later Observation; replace the
+whole field instead.
+
+`dumps` uses orjson when it is installed and falls back to the standard
+library otherwise. Any speedup comes from orjson; a template costs about
+the same as a hand-built dict with either library.
+"""
+import json
+import uuid
+from datetime import datetime, timezone
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+FHIR_JSON = "application/fhir+json"
+
+OBSERVATION_CATEGORY = "http://terminology.hl7.org/CodeSystem/observation-category"
+LOINC = "http://loinc.org"
+UCUM = "http://unitsofmeasure.org"
+
+
+if orjson is not None:
+    def dumps(resource) -> bytes:
+        return orjson.dumps(resource)
+
+    loads = orjson.loads
+else:
+    def dumps(resource) -> bytes:
+        return json.dumps(resource, separators=(",", ":"), ensure_ascii=False).encode("utf-8")
+
+    loads = json.loads
+
+
+def now_iso():
+    return datetime.now(timezone.utc).isoformat(timespec='milliseconds')
+
+
+def new_id():
+    return str(uuid.uuid4())
+
+
+class FrozenDict(dict):
+    """A dict that refuses changes. Serializes like a plain dict."""
+
+    __slots__ = ()
+
+    def _readonly(self, *args, **kwargs):
+        raise TypeError("shared FHIR template parts are read-only; replace the field instead")
+
+    __setitem__ = __delitem__ = __ior__ = _readonly
+    clear = pop = popitem = setdefault = update = _readonly
+
+    def __reduce__(self):
+        return FrozenDict, (dict(self),)
+
+
+def _coding(system, code, display=None):
+    coding = {"system": system, "code": code}
+    if display is not None:
+        coding["display"] = display
+    return FrozenDict(coding)
+
+
+def _concept(coding, text=None):
+    concept = {"coding": (coding,)}
+    if text is not None:
+        concept["text"] = text
+    return FrozenDict(concept)
+
+
+class ObservationTemplate:
+    """An Observation kind with its category, code and unit built once."""
+
+    __slots__ = ("category", "code", "quantity")
+
+    def __init__(self, category, code, quantity=None):
+        self.category = (category,)
+        self.code = code
+        self.quantity = quantity
+
+    def build(self, subject, value, effective=None, device=None, resource_id=None):
+        """Return a new Observation for `subject` ("Patient/<id>").
+
+        `value` becomes `valueQuantity` for templates with a unit and
+        `valueString` otherwise.
+        """
+        observation = {
+            "resourceType": "Observation",
+            "id": resource_id or new_id(),
+            "status": "final",
+            "category": self.category,
+            "code": self.code,
+            "subject": {"reference": subject},
+            "effectiveDateTime": effective or now_iso(),
+        }
+        if device is not None:
+            observation["device"] = {"reference": device}
+        if self.quantity is not None:
+            quantity = {"value": value}
+            quantity.update(self.quantity)
+            observation["valueQuantity"] = quantity
+        else:
+            observation["valueString"] = value
+        return observation
+
+
+VITAL_SIGNS = _concept(_coding(OBSERVATION_CATEGORY, "vital-signs", "Vital Signs"))
+VITAL_SIGNS_CODE_ONLY = _concept(_coding(OBSERVATION_CATEGORY, "vital-signs"))
+DEVICE = _concept(_coding(OBSERVATION_CATEGORY, "device", "Device"))
+
+MMHG = FrozenDict({"unit": "mmHg", "system": UCUM, "code": "mm[Hg]"})
+CMH2O = FrozenDict({"unit": "cmH2O", "system": UCUM, "code": "cmH2O"})
+
+WOUND_PRESSURE = ObservationTemplate(
+    VITAL_SIGNS,
+    _concept(_coding(LOINC, "31209-0", "Pressure in wound therapy device"), "Wound pressure"),
+    MMHG,
+)
+DEVICE_WARNING = ObservationTemplate(
+    DEVICE,
+    _concept(_coding(LOINC, "69758-7", "Device warning message"), "Device warning"),
+)
+DEVICE_ERROR = ObservationTemplate(
+    DEVICE,
+    _concept(_coding(LOINC, "70325-2", "Device connectivity status"), "Device error"),
+)
+DEVICE_CONNECTION_ISSUE = ObservationTemplate(
+    DEVICE,
+    _concept(_coding(LOINC, "70325-2", "Device connectivity status"), "Device connection issue"),
+)
+NEGATIVE_PRESSURE = ObservationTemplate(
+    VITAL_SIGNS_CODE_ONLY,
+    _concept(_coding(LOINC, "14147-5", "Negative Pressure"), "Negative Pressure"),
+    CMH2O,
+)
+SUCTION_ERROR = ObservationTemplate(
+    VITAL_SIGNS_CODE_ONLY,
+    _concept(_coding("http://example.org/fhir/CodeSystem/device-error", "DEVICE_ERROR", "Device Error"), "Device Error"),
+)
+
+_MODE_CODE = _concept(_coding("http://example.org/device-mode", "mode"), "Device mode")
+_STATUS_CODE = _concept(_coding("http://example.org/device-status", "status"), "Device status")
+
+
+def device_state_components(mode, status):
+    """The "Device mode" and "Device status" components of a device reading."""
+    return [
+        {"code": _MODE_CODE, "valueString": mode},
+        {"code": _STATUS_CODE, "valueString": status},
+    ]
@@ -0,0 +1,214 @@
+"""Prometheus text-format metrics, cheap enough to leave on in production.
+
+Counters and histograms are sharded per thread: each thread only adds to
+its own cell, so recording takes no lock, and a scrape sums the cells.
+Histogram buckets are fixed when the metric is created. Values that a
+component already tracks (queue sizes, cache stats) are read by callbacks
+at scrape time instead of being recorded twice.
+
+    MESSAGES = REGISTRY.counter("ingest_messages_received_total", "Device messages", ["type"])
+    MESSAGES.labels("reading").inc()
+    REGISTRY.callback("ingest_wal_depth", "Records waiting in the WAL", lambda: wal.depth)
+"""
+import threading
+from bisect import bisect_left
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+
+def _format_value(value):
+    value = float(value)
+    return str(int(value)) if value.is_integer() else repr(value)
+
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_labels(names, values, extra=""):
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+class _Cells:
+    """One list of `size` floats per thread id, summed on read.
+
+    Thread ids are reused, so the number of cells stays bounded by the
+    number of threads alive at once even when threads come and go.
+    """
+
+    __slots__ = ("size", "cells")
+
+    def __init__(self, size):
+        self.size = size
+        self.cells = {}
+
+    def cell(self):
+        ident = threading.get_ident()
+        cell = self.cells.get(ident)
+        if cell is None:
+            cell = self.cells.setdefault(ident, [0.0] * self.size)
+        return cell
+
+    def totals(self):
+        totals = [0.0] * self.size
+        for cell in list(self.cells.values()):
+            for i, value in enumerate(cell):
+                totals[i] += value
+        return totals
+
+
+class _Metric:
+    kind = None
+
+    def __init__(self, name, help, labels=()):
+        self.name = name
+        self.help = help
+        self.label_names = tuple(labels)
+        self.children = {}
+        self.lock = threading.Lock()
+
+    def labels(self, *values):
+        child = self.children.get(values)
+        if child is None:
+            if len(values) != len(self.label_names):
+                raise ValueError(f"{self.name} expects labels {self.label_names}, got {values}")
+            with self.lock:
+                child = self.children.setdefault(values, self._new_child())
+        return child
+
+    def _new_child(self):
+        raise NotImplementedError
+
+    def samples(self):
+        raise NotImplementedError
+
+
+class _CounterChild:
+    __slots__ = ("cells",)
+
+    def __init__(self):
+        self.cells = _Cells(1)
+
+    def inc(self, amount=1):
+        self.cells.cell()[0] += amount
+
+    def value(self):
+        return self.cells.totals()[0]
+
+
+class Counter(_Metric):
+    kind = "counter"
+
+    def _new_child(self):
+        return _CounterChild()
+
+    def inc(self, amount=1):
+        self.labels().inc(amount)
+
+    def samples(self):
+        for values, child in list(self.children.items()):
+            yield f"{self.name}{_format_labels(self.label_names, values)} {_format_value(child.value())}"
+
+
+class _HistogramChild:
+    __slots__ = ("bounds", "cells")
+
+    def __init__(self, bounds):
+        self.bounds = bounds
+        # One count per bucket, one for +Inf, then the sum
+        self.cells = _Cells(len(bounds) + 2)
+
+    def observe(self, value):
+        cell = self.cells.cell()
+        cell[bisect_left(self.bounds, value)] += 1
+        cell[-1] += value
+
+
+class Histogram(_Metric):
+    kind = "histogram"
+
+    def __init__(self, name, help, labels=(), buckets=DEFAULT_BUCKETS):
+        super().__init__(name, help, labels)
+        self.bounds = tuple(sorted(buckets))
+
+    def _new_child(self):
+        return _HistogramChild(self.bounds)
+
+    def observe(self, value):
+        self.labels().observe(value)
+
+    def samples(self):
+        for values, child in list(self.children.items()):
+            totals = child.cells.totals()
+            cumulative = 0.0
+            for bound, count in zip(self.bounds + (float("inf"),), totals):
+                cumulative += count
+                le = "+Inf" if bound == float("inf") else _format_value(bound)
+                bucket_labels = _format_labels(self.label_names, values, f'le="{le}"')
+                yield f"{self.name}_bucket{bucket_labels} {_format_value(cumulative)}"
+            labels = _format_labels(self.label_names, values)
+            yield f"{self.name}_sum{labels} {_format_value(totals[-1])}"
+            yield f"{self.name}_count{labels} {_format_value(cumulative)}"
+
+
+class Callback(_Metric):
+    """A gauge or counter whose value is read from `fn` at scrape time.
+
+    Without labels `fn` returns a number; with labels it returns a dict of
+    label-value tuples to numbers.
+    """
+
+    def __init__(self, name, help, fn, kind="gauge", labels=()):
+        super().__init__(name, help, labels)
+        self.fn = fn
+        self.kind = kind
+
+    def samples(self):
+        values = self.fn()
+        if not self.label_names:
+            values = {(): values}
+        for label_values, value in values.items():
+            yield f"{self.name}{_format_labels(self.label_names, label_values)} {_format_value(value)}"
+
+
+class Registry:
+    def __init__(self):
+        self.metrics: dict[str, _Metric] = {}
+        self.lock = threading.Lock()
+
+    def register(self, metric):
+        with self.lock:
+            if metric.name in self.metrics:
+                raise ValueError(f"Metric {metric.name} is already registered")
+            self.metrics[metric.name] = metric
+        return metric
+
+    def counter(self, name, help, labels=()):
+        return self.register(Counter(name, help, labels))
+
+    def histogram(self, name, help, labels=(), buckets=DEFAULT_BUCKETS):
+        return self.register(Histogram(name, help, labels, buckets))
+
+    def callback(self, name, help, fn, kind="gauge", labels=()):
+        return self.register(Callback(name, help, fn, kind, labels))
+
+    def render(self):
+        """All metrics in the Prometheus text exposition format."""
+        lines = []
+        for metric in list(self.metrics.values()):
+            try:
+                samples = list(metric.samples())
+            except Exception as e:
+                print(f"[METRICS] Skipping {metric.name}: {e}")
+                continue
+            lines.append(f"# HELP {metric.name} {metric.help}")
+            lines.append(f"# TYPE {metric.name} {metric.kind}")
+            lines.extend(samples)
+        return "\n".join(lines) + "\n"
+
+
+REGISTRY = Registry()
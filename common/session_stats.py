@@ -0,0 +1,154 @@
+"""Constant-memory statistics for a stream of pressure readings."""
+import math
+from bisect import insort
+
+PRESSURE_TARGET_RANGE = (-125.0, -75.0)
+
+
+class P2Quantile:
+    """Streaming quantile estimate with the P² algorithm (Jain & Chlamtac, 1985).
+
+    Keeps five markers no matter how many values are added.
+    """
+
+    __slots__ = ("p", "heights", "positions", "desired", "increments")
+
+    def __init__(self, p):
+        self.p = p
+        self.heights = []
+        self.positions = [0, 1, 2, 3, 4]
+        self.desired = [0, 2 * p, 4 * p, 2 + 2 * p, 4]
+        self.increments = [0, p / 2, p, (1 + p) / 2, 1]
+
+    def add(self, x):
+        q = self.heights
+        if len(q) < 5:
+            insort(q, x)
+            return
+
+        n = self.positions
+        if x < q[0]:
+            q[0] = x
+            k = 0
+        elif x >= q[4]:
+            q[4] = x
+            k = 3
+        else:
+            k = 0
+            while x >= q[k + 1]:
+                k += 1
+
+        for i in range(k + 1, 5):
+            n[i] += 1
+        for i in range(5):
+            self.desired[i] += self.increments[i]
+
+        for i in (1, 2, 3):
+            d = self.desired[i] - n[i]
+            if (d >= 1 and n[i + 1] - n[i] > 1) or (d <= -1 and n[i - 1] - n[i] < -1):
+                d = 1 if d > 0 else -1
+                height = self._parabolic(i, d)
+                if not q[i - 1] < height < q[i + 1]:
+                    height = q[i] + d * (q[i + d] - q[i]) / (n[i + d] - n[i])
+                q[i] = height
+                n[i] += d
+
+    def _parabolic(self, i, d):
+        q, n = self.heights, self.positions
+        return q[i] + d / (n[i + 1] - n[i - 1]) * (
+            (n[i] - n[i - 1] + d) * (q[i + 1] - q[i]) / (n[i + 1] - n[i])
+            + (n[i + 1] - n[i] - d) * (q[i] - q[i - 1]) / (n[i] - n[i - 1])
+        )
+
+    def value(self):
+        q = self.heights
+        if not q:
+            return None
+        if self.positions[4] == 4:
+            return q[min(len(q) - 1, round(self.p * (len(q) - 1)))]
+        return q[2]
+
+
+class PressureStats:
+    """Running summary of one therapy session's pressure readings.
+
+    Count, min, max, Welford mean/variance, a time-weighted mean (each
+    reading holds until the next one), time spent inside `target_range`
+    and P² estimates of the 5th, 50th and 95th percentiles.
+    """
+
+    __slots__ = (
+        "count", "min", "max", "mean", "m2",
+        "last_value", "last_time", "weighted_sum", "elapsed", "in_range",
+        "target_range", "p05", "p50", "p95",
+    )
+
+    def __init__(self, target_range=PRESSURE_TARGET_RANGE):
+        self.count = 0
+        self.min = math.inf
+        self.max = -math.inf
+        self.mean = 0.0
+        self.m2 = 0.0
+        self.last_value = None
+        self.last_time = None
+        self.weighted_sum = 0.0
+        self.elapsed = 0.0
+        self.in_range = 0.0
+        self.target_range = target_range
+        self.p05 = P2Quantile(0.05)
+        self.p50 = P2Quantile(0.50)
+        self.p95 = P2Quantile(0.95)
+
+    def add(self, value, timestamp):
+        """Add a reading taken at `timestamp` (seconds since the epoch)."""
+        self.count += 1
+        if value < self.min:
+            self.min = value
+        if value > self.max:
+            self.max = value
+        delta = value - self.mean
+        self.mean += delta / self.count
+        self.m2 += delta * (value - self.mean)
+
+        if self.last_time is not None and timestamp > self.last_time:
+            span = timestamp - self.last_time
+            self.weighted_sum += self.last_value * span
+            self.elapsed += span
+            low, high = self.target_range
+            if low <= self.last_value <= high:
+                self.in_range += span
+        self.last_value = value
+        self.last_time = timestamp
+
+        self.p05.add(value)
+        self.p50.add(value)
+        self.p95.add(value)
+
+    @property
+    def variance(self):
+        return self.m2 / (self.count - 1) if self.count > 1 else 0.0
+
+    @property
+    def stddev(self):
+        return math.sqrt(self.variance)
+
+    @property
+    def time_weighted_mean(self):
+        return self.weighted_sum / self.elapsed if self.elapsed else self.mean
+
+    @property
+    def in_range_fraction(self):
+        return self.in_range / self.elapsed if self.elapsed else 0.0
+
+    def summary(self, unit="mmHg"):
+        if not self.count:
+            return "No pressure data available."
+        low, high = self.target_range
+        return (
+            f"Pressure stats — min: {self.min:.1f} {unit}, max: {self.max:.1f} {unit}, "
+            f"avg: {self.mean:.2f} {unit}, sd: {self.stddev:.2f} {unit}, "
+            f"time-weighted avg: {self.time_weighted_mean:.2f} {unit}, "
+            f"p5/p50/p95: {self.p05.value():.1f}/{self.p50.value():.1f}/{self.p95.value():.1f} {unit}. "
+            f"Time in target range ({low:g} to {high:g} {unit}): "
+            f"{self.in_range:.1f} s ({self.in_range_fraction * 100:.1f}%)."
+        )
@@ -0,0 +1,72 @@
+"""Correlation ids and per-hop timestamps from device to dashboard.
+
+A device puts a `correlation_id` and its `sent_at` time in every message.
+The socket server stores both, with its receive time, on the Observation:
+the id as a second identifier and the times in the `TRACE_EXTENSION`
+extension. HAPI adds `meta.lastUpdated`. Each component also prints one
+`[TRACE] {...}` JSON line per hop (epoch seconds), which
+`tools/trace_latency.py` joins by correlation id into per-stage latencies.
+The log lines are off unless `TRACE_LOG=1` is set in the environment; the
+trace stored on the Observation is always kept.
+"""
+import json
+import os
+import time
+from datetime import datetime, timezone
+
+CORRELATION_ID_SYSTEM = "http://example.org/fhir/correlation-id"
+TRACE_EXTENSION = "http://example.org/fhir/StructureDefinition/latency-trace"
+TRACE_LOG = os.environ.get("TRACE_LOG", "0") == "1"
+
+# In hop order
+STAGES = ("sent", "received", "logged", "stored", "notified", "fetched", "displayed")
+
+
+def parse_instant(value):
+    try:
+        return datetime.fromisoformat(value.replace("Z", "+00:00")).timestamp()
+    except (AttributeError, ValueError):
+        return None
+
+
+def format_instant(timestamp):
+    return datetime.fromtimestamp(timestamp, timezone.utc).isoformat(timespec="milliseconds")
+
+
+def log_stage(correlation_id, **stages):
+    """Print when `correlation_id` passed the given stages (epoch seconds)."""
+    if TRACE_LOG and correlation_id:
+        print(f"[TRACE] {json.dumps({'correlation_id': correlation_id, **stages})}")
+
+
+def trace_fields(correlation_id, sent, received):
+    """The correlation identifier and trace extension for an Observation."""
+    times = [{"url": name, "valueInstant": value} for name, value in (("sent", sent), ("received", received)) if value]
+    return (
+        {"system": CORRELATION_ID_SYSTEM, "value": correlation_id},
+        {"url": TRACE_EXTENSION, "extension": times},
+    )
+
+
+def read_trace(obs):
+    """The trace stored on an Observation as {"correlation_id", "sent",
+    "received", "stored"} ISO times, or None for untraced resources."""
+    correlation_id = next((i.get("value") for i in obs.get("identifier", []) if i.get("system") == CORRELATION_ID_SYSTEM), None)
+    if correlation_id is None:
+        return None
+    trace = {"correlation_id": correlation_id}
+    for extension in obs.get("extension", []):
+        if extension.get("url") == TRACE_EXTENSION:
+            for part in extension.get("extension", []):
+                trace[part["url"]] = part.get("valueInstant")
+    if obs.get("meta", {}).get("lastUpdated"):
+        trace["stored"] = obs["meta"]["lastUpdated"]
+    return trace
+
+
+def mark_fetched(trace):
+    """Stamp a trace read back from FHIR with the time the observer got it."""
+    now = time.time()
+    trace["fetched"] = format_instant(now)
+    log_stage(trace["correlation_id"], fetched=now)
+    return trace
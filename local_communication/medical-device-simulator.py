@@ -1,3 +1,4 @@
+import os
 import requests
 import uuid
 import random
@@ -5,13 +6,22 @@ from datetime import datetime, timezone
 import sys
 import time
 
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from common import fhir_resources
+from common.fhir_client import FhirClient
+from common.session_stats import PressureStats
+
 FHIR_URL = "http://localhost:8080/fhir"
+OBSERVER_URL = "http://127.0.0.1:5000"
+
+fhir = FhirClient(FHIR_URL, pool_size=1)
 PATIENT_ID = -1
 ERROR_PROBABILITY = 0.1 
 
 observations_in_last_minute = []
 device_issues_in_last_minute = []
-pressure_values_in_last_minute = [] 
+pressure_stats = PressureStats()
 
 def get_precise_time():
     return datetime.utcnow().replace(tzinfo=timezone.utc).isoformat(timespec='milliseconds')
@@ -19,40 +29,18 @@ def get_precise_time():
 def now_dt():
     return datetime.now(timezone.utc)
 
+def notify_observer(event_type, **details):
+    # Best effort: the dashboard falls back to polling if the observer is down
+    try:
+        requests.post(f"{OBSERVER_URL}/api/events",
+                      json={"events": [{"patient": f"p{PATIENT_ID}", "type": event_type, **details}]}, timeout=0.5)
+    except requests.RequestException:
+        pass
+
 def create_pressure_observation(pressure: int):
-    observation_id = str(uuid.uuid4())
-    observation = {
-        "resourceType": "Observation",
-        "id": observation_id,
-        "status": "final",
-        "category": [{
-            "coding": [{
-                "system": "http://terminology.hl7.org/CodeSystem/observation-category",
-                "code": "vital-signs",
-                "display": "Vital Signs"
-            }]
-        }],
-        "code": {
-            "coding": [{
-                "system": "http://loinc.org",
-                "code": "31209-0",
-                "display": "Pressure in wound therapy device"
-            }],
-            "text": "Wound pressure"
-        },
-        "subject": {
-            "reference": f"Patient/p{PATIENT_ID}"
-        },
-        "effectiveDateTime": get_precise_time(),
-        "valueQuantity": {
-            "value": pressure,
-            "unit": "mmHg",
-            "system": "http://unitsofmeasure.org",
-            "code": "mm[Hg]"
-        }
-    }
+    observation = fhir_resources.WOUND_PRESSURE.build(f"Patient/p{PATIENT_ID}", pressure)
 
-    response = requests.post(f"{FHIR_URL}/Observation", json=observation)
+    response = fhir.post("Observation", resource=observation)
     print(f"Sent {pressure} mmHg at {observation['effectiveDateTime']} -> {response.status_code}")
     if response.status_code == 201:
         location = response.headers.get("Location")
@@ -62,46 +50,26 @@ def create_pressure_observation(pressure: int):
                 idx = parts.index("Observation")
                 obs_id = parts[idx + 1]
                 observations_in_last_minute.append(obs_id)
-                pressure_values_in_last_minute.append(pressure)
+                pressure_stats.add(pressure, time.time())
+                notify_observer("reading", value=pressure, time=observation["effectiveDateTime"])
         else:
             print("Warning: No Location header in response")
 
 def create_device_issue(issue_message: str):
-    observation = {
-        "resourceType": "Observation",
-        "id": str(uuid.uuid4()),
-        "status": "final",
-        "category": [{
-            "coding": [{
-                "system": "http://terminology.hl7.org/CodeSystem/observation-category",
-                "code": "device",
-                "display": "Device"
-            }]
-        }],
-        "code": {
-            "coding": [{
-                "system": "http://loinc.org",
-                "code": "70325-2",
-                "display": "Device connectivity status"
-            }],
-            "text": "Device connection issue"
-        },
-        "subject": {
-            "reference": f"Patient/p{PATIENT_ID}"
-        },
-        "effectiveDateTime": get_precise_time(),
-        "valueString": issue_message
-    }
+    observation = fhir_resources.DEVICE_CONNECTION_ISSUE.build(f"Patient/p{PATIENT_ID}", issue_message)
 
-    response = requests.post(f"{FHIR_URL}/Observation", json=observation)
+    response = fhir.post("Observation", resource=observation)
     print(f"Sent DEVICE CONNECTION ISSUE '{issue_message}' at {observation['effectiveDateTime']} -> {response.status_code}")
     if response.status_code == 201:
         location = response.headers.get("Location")
         if location:
             obs_id = location.split("/Observation/")[1].split("/")[0]
             device_issues_in_last_minute.append(obs_id)
+            notify_observer("issue", message=issue_message, time=observation["effectiveDateTime"])
 
 def create_diagnostic_report():
+    global pressure_stats
+
     if not observations_in_last_minute and not device_issues_in_last_minute:
         print("[INFO] No observations to include in report.")
         return
@@ -114,13 +82,7 @@ def create_diagnostic_report():
         [{"reference": f"Observation/{oid}"} for oid in device_issues_in_last_minute]
     )
 
-    if pressure_values_in_last_minute:
-        min_val = min(pressure_values_in_last_minute)
-        max_val = max(pressure_values_in_last_minute)
-        avg_val = sum(pressure_values_in_last_minute) / len(pressure_values_in_last_minute)
-        stats_text = f"Pressure stats — min: {min_val} mmHg, max: {max_val} mmHg, avg: {avg_val:.2f} mmHg."
-    else:
-        stats_text = "No pressure data available."
+    stats_text = pressure_stats.summary()
 
     report = {
         "resourceType": "DiagnosticReport",
@@ -146,12 +108,16 @@ def create_diagnostic_report():
             f"{stats_text}"
         )}
 
-    response = requests.post(f"{FHIR_URL}/DiagnosticReport", json=report)
+    response = fhir.post("DiagnosticReport", resource=report)
     print(f"[REPORT] DiagnosticReport submitted ({len(observations_in_last_minute)} observations) -> {response.status_code}")
     if response.status_code != 201:
         print("Response content:")
         print(response.text) 
+    else:
+        notify_observer("report", issued=report["issued"], text=report["conclusion"])
     observations_in_last_minute.clear()
+    device_issues_in_last_minute.clear()
+    pressure_stats = PressureStats()
 
 
 def ensure_patient():
@@ -163,7 +129,7 @@ def ensure_patient():
             "family": "User"
         }]
     }
-    requests.put(f"{FHIR_URL}/Patient/p{PATIENT_ID}", json=patient)
+    fhir.put(f"Patient/p{PATIENT_ID}", resource=patient)
 
 if __name__ == "__main__":
     if len(sys.argv) != 2:
@@ -1,11 +1,20 @@
-from flask import Flask, render_template, jsonify, request
-import requests
+from flask import Flask, Response, render_template, jsonify, request, stream_with_context
+import os
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from common.event_broker import EventBroker
+from common.fhir_client import FhirClient
 
 app = Flask(__name__)
 
 FHIR_URL = "http://localhost:8080/fhir"
 PATIENT_ID = "test-patient"
 
+fhir = FhirClient(FHIR_URL)
+broker = EventBroker()
+
 def get_latest_pressure_data(patient_id):
     search_url = (
         f"{FHIR_URL}/Observation?"
@@ -13,7 +22,7 @@ def get_latest_pressure_data(patient_id):
         f"code=31209-0&_sort=-date&_count=10"
     )
 
-    response = requests.get(search_url)
+    response = fhir.get(search_url)
     bundle = response.json()
     values = []
 
@@ -33,7 +42,7 @@ def get_latest_device_issue(patient_id):
         f"code=70325-2&_sort=-date&_count=1"
     )
 
-    response = requests.get(search_url)
+    response = fhir.get(search_url)
     bundle = response.json()
     issues = []
 
@@ -53,7 +62,7 @@ def get_latest_reports(patient_id):
         f"_sort=-issued&_count=5"
     )
 
-    response = requests.get(search_url)
+    response = fhir.get(search_url)
     bundle = response.json()
     reports = []
 
@@ -73,7 +82,7 @@ def index():
 
 @app.route("/api/patients")
 def get_patients():
-    response = requests.get(f"{FHIR_URL}/Patient?_count=100")
+    response = fhir.get(f"{FHIR_URL}/Patient?_count=100")
     bundle = response.json()
     patients = []
 
@@ -105,5 +114,17 @@ def reports_api():
     reports = get_latest_reports(patient_id)
     return jsonify(reports)
 
+@app.route("/api/events", methods=["POST"])
+def events_api():
+    for event in request.get_json(force=True).get("events", []):
+        broker.publish(event.get("patient"), event)
+    return "", 204
+
+@app.route("/api/stream")
+def stream_api():
+    patient_id = request.args.get("patient", "test-patient")
+    return Response(stream_with_context(broker.stream(patient_id)), mimetype="text/event-stream",
+                    headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
+
 if __name__ == "__main__":
     app.run(debug=True)
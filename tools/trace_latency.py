@@ -0,0 +1,105 @@
+"""Per-stage latency breakdown from the `[TRACE]` lines in component logs.
+
+socket_server.py and observer.py print one `[TRACE] {...}` JSON line per
+hop a message passes (see common/tracing.py). This joins them by
+correlation id and prints percentiles for each hop:
+
+    TRACE_LOG=1 python web_sockets/socket_server.py > ingest.log
+    TRACE_LOG=1 python web_sockets/observer.py > observer.log
+    python tools/trace_latency.py ingest.log observer.log
+
+"sent" is the device's clock and "displayed" the browser's, so those hops
+include any clock offset from the servers.
+"""
+import argparse
+import fileinput
+import json
+import re
+
+TRACE_LINE = re.compile(r"\[TRACE\] (\{.*\})")
+
+# (name, from stage, to stage, only for dashboards that got it via)
+HOPS = [
+    ("device -> server", "sent", "received", None),
+    ("write-ahead log", "received", "logged", None),
+    ("FHIR write", "logged", "stored", None),
+    ("observer notify", "stored", "notified", None),
+    ("observer fetch", "stored", "fetched", None),
+    ("dashboard stream", "notified", "displayed", "stream"),
+    ("dashboard poll", "fetched", "displayed", "poll"),
+    ("server -> dashboard", "received", "displayed", None),
+    ("end to end", "sent", "displayed", None),
+]
+
+
+def read_traces(lines):
+    """{correlation_id: {stage: earliest time}} plus how it was displayed."""
+    traces = {}
+    for line in lines:
+        match = TRACE_LINE.search(line)
+        if not match:
+            continue
+        try:
+            record = json.loads(match.group(1))
+        except ValueError:
+            continue
+        correlation_id = record.pop("correlation_id", None)
+        if not correlation_id:
+            continue
+        trace = traces.setdefault(correlation_id, {})
+        via = record.pop("via", None)
+        for stage, at in record.items():
+            if not isinstance(at, (int, float)):
+                continue
+            if stage not in trace or at < trace[stage]:
+                trace[stage] = at
+                if stage == "displayed":
+                    trace["via"] = via
+    return traces
+
+
+def percentile(sorted_values, p):
+    return sorted_values[min(len(sorted_values) - 1, int(p / 100 * len(sorted_values)))]
+
+
+def breakdown(traces):
+    result = {}
+    for name, start, end, via in HOPS:
+        values = sorted(
+            trace[end] - trace[start] for trace in traces.values()
+            if start in trace and end in trace and (via is None or trace.get("via") == via)
+        )
+        if not values:
+            continue
+        result[name] = {
+            "count": len(values),
+            "p50_ms": percentile(values, 50) * 1000,
+            "p95_ms": percentile(values, 95) * 1000,
+            "p99_ms": percentile(values, 99) * 1000,
+            "max_ms": values[-1] * 1000,
+        }
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("logs", nargs="*", help="log files (default: stdin)")
+    parser.add_argument("--json", action="store_true", help="print the breakdown as JSON")
+    args = parser.parse_args()
+
+    with fileinput.input(args.logs, errors="replace") as lines:
+        traces = read_traces(lines)
+    result = breakdown(traces)
+
+    if args.json:
+        print(json.dumps({"messages": len(traces), "hops": result}, indent=2))
+        return
+    print(f"{len(traces)} traced messages")
+    print(f"{'hop':<20} {'count':>7} {'p50 ms':>9} {'p95 ms':>9} {'p99 ms':>9} {'max ms':>9}")
+    for name, stats in result.items():
+        print(f"{name:<20} {stats['count']:>7} {stats['p50_ms']:>9.1f} {stats['p95_ms']:>9.1f} "
+              f"{stats['p99_ms']:>9.1f} {stats['max_ms']:>9.1f}")
+
+
+if __name__ == "__main__":
+    main()
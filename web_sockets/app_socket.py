@@ -34,9 +34,18 @@ HTML = '''<!DOCTYPE html>
     // Store merged entries
     const merged = [];
 
-    ws.addEventListener('open', () => console.log('WS connected'));
+    const devices = ['neg-pressure-device-1','neg-pressure-device-2'];
+
+    // Only receive the devices shown here
+    ws.addEventListener('open', () => {
+      console.log('WS connected');
+      for (const device of devices) {
+        ws.send(JSON.stringify({action: 'subscribe', device: device}));
+      }
+    });
     ws.addEventListener('message', e => {
       const msg = JSON.parse(e.data);
+      if (msg.subscribed) return;
       const errorBanner = document.getElementById('error-banner');
       // Display error banner if needed
       if (msg.error) {
@@ -46,7 +55,7 @@ HTML = '''<!DOCTYPE html>
       }
       // Plot chart value or null gap
       const yVal = msg.error ? null : msg.value;
-      const idx = ['neg-pressure-device-1','neg-pressure-device-2'].indexOf(msg.device);
+      const idx = devices.indexOf(msg.device);
       Plotly.extendTraces('chart', { x: [[new Date(msg.time)]], y: [[yVal]] }, [idx]);
       const gd = document.getElementById('chart');
       gd.data[idx].x = gd.data[idx].x.slice(-maxPoints);
@@ -0,0 +1,160 @@
+import asyncio
+import json
+import time
+
+import websockets
+
+CLIENT_QUEUE_SIZE = 100
+SLOW_CLIENT_POLICY = "drop_oldest"
+CLIENT_SEND_TIMEOUT = 10
+WILDCARD = "*"
+
+
+class ClientChannel:
+    """Outbound queue and send task of one websocket client."""
+
+    __slots__ = ("ws", "queue", "sender", "closing", "topics", "sent", "dropped", "last_lag", "max_lag")
+
+    def __init__(self, ws, queue_size):
+        self.ws = ws
+        self.queue = asyncio.Queue(maxsize=queue_size)
+        self.sender = None
+        self.closing = False
+        self.topics = set()
+        self.sent = 0
+        self.dropped = 0
+        self.last_lag = 0.0
+        self.max_lag = 0.0
+
+
+class Broadcaster:
+    """Fan-out of messages to websocket clients without waiting for any of them.
+
+    A message is serialized once and put on every client's bounded queue;
+    each client has its own task that drains its queue. When a client falls
+    `queue_size` messages behind, `policy` decides what happens: with
+    "drop_oldest" its oldest queued message is dropped, with "disconnect"
+    the client is closed. A send that takes longer than `send_timeout` also
+    closes the client. One stalled tab therefore never delays the producer
+    or the other clients.
+
+    Clients only get messages for topics they subscribed to, by sending
+    {"action": "subscribe", "device": "<id>"} or "patient": "<id>" ("*"
+    for all), and the same with "unsubscribe". Each broadcast looks up its
+    topics in an index, so its cost grows with the number of interested
+    clients, not with all connected ones.
+    """
+
+    def __init__(self, queue_size=CLIENT_QUEUE_SIZE, policy=SLOW_CLIENT_POLICY, send_timeout=CLIENT_SEND_TIMEOUT):
+        self.queue_size = queue_size
+        self.policy = policy
+        self.send_timeout = send_timeout
+        self.clients: dict[object, ClientChannel] = {}
+        self.topics: dict[str, set[ClientChannel]] = {}
+        self.dropped = 0
+        self.disconnected_slow = 0
+
+    async def serve(self, ws):
+        """Handle subscriptions from `ws` and send it broadcasts until it disconnects."""
+        channel = ClientChannel(ws, self.queue_size)
+        channel.sender = asyncio.create_task(self._send_loop(channel))
+        self.clients[ws] = channel
+        try:
+            async for message in ws:
+                self._handle_request(channel, message)
+        except websockets.ConnectionClosed:
+            pass
+        finally:
+            for topic in list(channel.topics):
+                self.unsubscribe(channel, topic)
+            del self.clients[ws]
+            channel.sender.cancel()
+
+    def subscribe(self, channel, topic):
+        channel.topics.add(topic)
+        self.topics.setdefault(topic, set()).add(channel)
+
+    def unsubscribe(self, channel, topic):
+        channel.topics.discard(topic)
+        subscribers = self.topics.get(topic)
+        if subscribers is not None:
+            subscribers.discard(channel)
+            if not subscribers:
+                del self.topics[topic]
+
+    def broadcast(self, message, topics=()):
+        """Queue `message` (a str) for every client subscribed to one of
+        `topics` or to everything. Never blocks."""
+        channels = set(self.topics.get(WILDCARD, ()))
+        for topic in topics:
+            channels.update(self.topics.get(topic, ()))
+        now = time.monotonic()
+        for channel in channels:
+            self._offer(channel, now, message)
+
+    def _handle_request(self, channel, message):
+        try:
+            request = json.loads(message)
+            action = request["action"]
+            topics = [WILDCARD if request[kind] == WILDCARD else f"{kind}:{request[kind]}"
+                      for kind in ("device", "patient") if kind in request]
+        except (ValueError, KeyError, TypeError):
+            print(f"[WS] Ignoring malformed request from {channel.ws.remote_address}: {message!r}")
+            return
+        for topic in topics:
+            if action == "subscribe":
+                self.subscribe(channel, topic)
+            elif action == "unsubscribe":
+                self.unsubscribe(channel, topic)
+        self._offer(channel, time.monotonic(), json.dumps({"subscribed": sorted(channel.topics)}))
+
+    def _offer(self, channel, now, message):
+        if channel.closing:
+            return
+        if channel.queue.full():
+            if self.policy == "disconnect":
+                self._disconnect_slow(channel)
+                return
+            channel.queue.get_nowait()
+            channel.dropped += 1
+            self.dropped += 1
+        channel.queue.put_nowait((now, message))
+
+    def _disconnect_slow(self, channel):
+        channel.closing = True
+        self.disconnected_slow += 1
+        if channel.sender is not asyncio.current_task():
+            channel.sender.cancel()
+        asyncio.ensure_future(channel.ws.close(code=1008, reason="Client too slow"))
+
+    async def _send_loop(self, channel):
+        while True:
+            queued_at, message = await channel.queue.get()
+            try:
+                await asyncio.wait_for(channel.ws.send(message), self.send_timeout)
+            except websockets.ConnectionClosed:
+                return
+            except asyncio.TimeoutError:
+                self._disconnect_slow(channel)
+                return
+            channel.sent += 1
+            channel.last_lag = time.monotonic() - queued_at
+            if channel.last_lag > channel.max_lag:
+                channel.max_lag = channel.last_lag
+
+    def stats(self):
+        channels = list(self.clients.values())
+        return {
+            "clients": len(channels),
+            "topics": len(self.topics),
+            "queued": sum(c.queue.qsize() for c in channels),
+            "sent": sum(c.sent for c in channels),
+            "dropped": self.dropped,
+            "disconnected_slow": self.disconnected_slow,
+            "max_lag_seconds": max((c.max_lag for c in channels), default=0.0),
+            "per_client": [
+                {"client": str(c.ws.remote_address), "queued": c.queue.qsize(), "sent": c.sent,
+                 "dropped": c.dropped, "last_lag_seconds": c.last_lag, "max_lag_seconds": c.max_lag}
+                for c in channels
+            ],
+        }
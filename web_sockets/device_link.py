@@ -0,0 +1,183 @@
+import asyncio
+import json
+import random
+import threading
+import uuid
+import zlib
+from collections import OrderedDict
+
+import websockets
+
+OUTBOUND_QUEUE_SIZE = 10000
+RECONNECT_BASE_DELAY = 0.5
+RECONNECT_MAX_DELAY = 30
+BACKFILL_ACK_TIMEOUT = 30
+
+
+class DeviceLink:
+    """One long-lived websocket from a device to the ingest server.
+
+    The connection is owned by a single asyncio loop on a background
+    thread. `send` can be called from any thread (e.g. the Tk UI) and puts
+    the message on one ordered outbound queue, so alarms go out on the open
+    connection in the order they were raised, without a new handshake. The
+    server acks each message by `msg_id` once it is logged, and a sent
+    message is kept in `unacked` until then. When the connection drops,
+    the unacked messages go back in front of the queue and the link
+    reconnects with jittered exponential backoff. The server remembers the
+    last few `msg_id`s of each device and drops a resent message it
+    already has. If the queue, or `unacked`, holds `queue_size` messages,
+    the oldest one is dropped.
+
+    With a `buffer` (a `SegmentBuffer`), messages are written to disk
+    while the server is unreachable instead of being held in memory. After
+    reconnecting, the link uploads the buffer one zlib-compressed segment
+    at a time, each one removed only when the server acks it, and only then
+    sends new messages. The device's messages therefore still arrive in
+    order.
+    """
+
+    def __init__(self, url, queue_size=OUTBOUND_QUEUE_SIZE,
+                 base_delay=RECONNECT_BASE_DELAY, max_delay=RECONNECT_MAX_DELAY, buffer=None):
+        self.url = url
+        self.buffer = buffer
+        self.queue_size = queue_size
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.loop = None
+        self.queue = None
+        self.unacked = OrderedDict()
+        self.thread = None
+        self.connected = False
+        self.sent = 0
+        self.dropped = 0
+        self.reconnects = 0
+        self.backfilled = 0
+
+    def start(self):
+        ready = threading.Event()
+        self.thread = threading.Thread(target=self._run_loop, args=(ready,), daemon=True, name="device-link")
+        self.thread.start()
+        ready.wait()
+        return self
+
+    def send(self, payload):
+        """Queue `payload` (a dict) for the server. Thread-safe, never blocks."""
+        if "msg_id" not in payload:
+            payload = {**payload, "msg_id": str(uuid.uuid4())}
+        self.loop.call_soon_threadsafe(self._enqueue, payload["msg_id"], json.dumps(payload))
+
+    def run_coroutine(self, coro):
+        """Run `coro` on the link's loop, e.g. a periodic telemetry task."""
+        return asyncio.run_coroutine_threadsafe(coro, self.loop)
+
+    def _run_loop(self, ready):
+        self.loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(self.loop)
+        self.queue = asyncio.Queue()
+        self.loop.create_task(self._connection_loop())
+        ready.set()
+        self.loop.run_forever()
+
+    def _enqueue(self, msg_id, message):
+        if self.buffer is not None and not self.connected:
+            self.buffer.append(message)
+            return
+        if self.queue.qsize() >= self.queue_size:
+            self.queue.get_nowait()
+            self.dropped += 1
+        self.queue.put_nowait((msg_id, message))
+
+    async def _connection_loop(self):
+        delay = self.base_delay
+        while True:
+            reason = "closed by server"
+            try:
+                async with websockets.connect(self.url) as ws:
+                    print(f"[LINK] Connected to {self.url}")
+                    delay = self.base_delay
+                    if self.buffer is not None:
+                        await self._upload_backlog(ws)
+                    self.connected = True
+                    await self._exchange(ws)
+            except (OSError, ValueError, asyncio.TimeoutError, websockets.WebSocketException) as e:
+                reason = e
+            self.connected = False
+            wait = random.uniform(delay / 2, delay)
+            print(f"[LINK] Connection to {self.url} lost ({reason}), "
+                  f"{len(self.unacked) + self.queue.qsize()} unacked or queued, retrying in {wait:.1f}s")
+            self._requeue_unacked()
+            self.reconnects += 1
+            await asyncio.sleep(wait)
+            delay = min(delay * 2, self.max_delay)
+
+    async def _exchange(self, ws):
+        # The reader starts after the backlog upload, which reads its own acks
+        reader = asyncio.create_task(self._read_acks(ws))
+        sender = asyncio.create_task(self._send_queued(ws))
+        try:
+            done, _ = await asyncio.wait({reader, sender}, return_when=asyncio.FIRST_COMPLETED)
+        finally:
+            reader.cancel()
+            sender.cancel()
+        for task in done:
+            task.result()
+
+    async def _send_queued(self, ws):
+        while True:
+            msg_id, message = await self.queue.get()
+            # Kept before the send, so a send cut off midway is requeued too
+            self.unacked[msg_id] = message
+            if len(self.unacked) > self.queue_size:
+                self.unacked.popitem(last=False)
+                self.dropped += 1
+            await ws.send(message)
+            self.sent += 1
+
+    async def _read_acks(self, ws):
+        async for reply in ws:
+            reply = json.loads(reply)
+            if "error" in reply:
+                # Resending a message the server refused would not help
+                print(f"[LINK] Server rejected message {reply.get('msg_id')}: {reply['error']}")
+            self.unacked.pop(reply.get("ack", reply.get("msg_id")), None)
+
+    def _requeue_unacked(self):
+        """Put unacked messages back in front of the queued ones, or on disk
+        behind what is already buffered."""
+        pending = list(self.unacked.items())
+        self.unacked.clear()
+        while not self.queue.empty():
+            pending.append(self.queue.get_nowait())
+        if self.buffer is not None:
+            for _, message in pending:
+                self.buffer.append(message)
+            return
+        self.dropped += max(0, len(pending) - self.queue_size)
+        for item in pending[-self.queue_size:]:
+            self.queue.put_nowait(item)
+
+    async def _upload_backlog(self, ws):
+        while True:
+            segment = self.buffer.oldest()
+            if segment is None:
+                if self.buffer.current is None:
+                    return
+                self.buffer.seal()
+                continue
+            number, lines = segment
+            if lines:
+                frame = f'{{"batch": {number}, "messages": [{",".join(lines)}]}}'
+                await ws.send(zlib.compress(frame.encode()))
+                reply = json.loads(await asyncio.wait_for(ws.recv(), BACKFILL_ACK_TIMEOUT))
+                if "retry_after" in reply:
+                    await asyncio.sleep(reply["retry_after"])
+                    continue
+                if reply.get("ack") != number:
+                    # Kept on disk, but out of the way of newer segments
+                    print(f"[LINK] Server rejected buffered segment {number}: {reply.get('error', reply)}")
+                    self.buffer.set_aside(number)
+                    continue
+                self.backfilled += len(lines)
+                print(f"[LINK] Uploaded {len(lines)} buffered messages (segment {number})")
+            self.buffer.remove(number)
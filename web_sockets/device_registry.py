@@ -0,0 +1,39 @@
+import os
+
+REGISTRY_PATH = "registered_devices.txt"
+
+
+class DeviceRegistry:
+    """Set of device ids whose Patient and Device already exist in FHIR.
+
+    Persisted as an append-only file with one id per line, so a restart
+    starts from the ids seen last time instead of an empty set.
+    """
+
+    def __init__(self, path=REGISTRY_PATH):
+        self.path = path
+        self.ids: set[str] = set()
+
+    def load(self):
+        if os.path.exists(self.path):
+            with open(self.path, encoding="utf-8") as f:
+                self.ids.update(line.strip() for line in f if line.strip())
+        return len(self.ids)
+
+    def add(self, device_id):
+        self.update([device_id])
+
+    def update(self, device_ids):
+        new_ids = [device_id for device_id in dict.fromkeys(device_ids) if device_id not in self.ids]
+        if not new_ids:
+            return 0
+        self.ids.update(new_ids)
+        with open(self.path, "a", encoding="utf-8") as f:
+            f.writelines(f"{device_id}\n" for device_id in new_ids)
+        return len(new_ids)
+
+    def __contains__(self, device_id):
+        return device_id in self.ids
+
+    def __len__(self):
+        return len(self.ids)
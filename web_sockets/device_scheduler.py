@@ -0,0 +1,69 @@
+import asyncio
+
+DEVICE_PERIOD = 5.0
+DEADLINE_TOLERANCE = 0.5
+
+
+class FixedRateScheduler:
+    """Calls `tick(device_id)` for every device once per `period` seconds.
+
+    Each device runs in its own task, on ticks at `start + k * period`
+    rather than sleeping `period` after the previous tick, so slow ticks do
+    not make the schedule drift. Devices are spread evenly over the period
+    instead of all firing together. A tick that starts more than
+    `tolerance` seconds late is counted as missed; ticks that would be a
+    whole period late are skipped rather than run in a burst.
+    """
+
+    def __init__(self, tick, period=DEVICE_PERIOD, tolerance=DEADLINE_TOLERANCE):
+        self.tick = tick
+        self.period = period
+        self.tolerance = tolerance
+        self.ticks = 0
+        self.missed = 0
+        self.skipped = 0
+        self.max_lateness = 0.0
+        self.failed = 0
+
+    async def run(self, device_ids):
+        loop = asyncio.get_running_loop()
+        start = loop.time()
+        await asyncio.gather(*(
+            self._run_device(device_id, start + self.period * i / len(device_ids))
+            for i, device_id in enumerate(device_ids)
+        ))
+
+    async def _run_device(self, device_id, next_at):
+        loop = asyncio.get_running_loop()
+        while True:
+            await asyncio.sleep(max(0.0, next_at - loop.time()))
+            lateness = loop.time() - next_at
+            if lateness > self.tolerance:
+                self.missed += 1
+            if lateness > self.max_lateness:
+                self.max_lateness = lateness
+
+            try:
+                await self.tick(device_id)
+            except Exception as e:
+                self.failed += 1
+                print(f"[{device_id}] Tick failed: {e}")
+            self.ticks += 1
+
+            next_at += self.period
+            behind = loop.time() - next_at
+            if behind >= self.period:
+                skip = int(behind // self.period)
+                self.skipped += skip
+                next_at += skip * self.period
+
+    def stats(self):
+        stats = {
+            "ticks": self.ticks,
+            "missed": self.missed,
+            "skipped": self.skipped,
+            "failed": self.failed,
+            "max_lateness_seconds": self.max_lateness,
+        }
+        self.max_lateness = 0.0
+        return stats
@@ -0,0 +1,64 @@
+"""Reduce long pressure series to a chart's pixel budget.
+
+Both functions take NumPy arrays of times and values and return the
+indices of the points to keep, always including the first and last.
+"""
+import numpy as np
+
+
+def lttb(x, y, points):
+    """Largest-Triangle-Three-Buckets (Steinarsson, 2013).
+
+    Keeps the point of each bucket that forms the largest triangle with the
+    point kept before it and the average of the next bucket, which preserves
+    the visual shape of the series. Work inside each bucket is vectorized.
+    """
+    n = len(x)
+    if points >= n or points < 3:
+        return np.arange(n)
+
+    edges = np.linspace(1, n - 1, points - 1).astype(np.int64)
+    # Average of every bucket, used as the third triangle corner
+    sums_x = np.add.reduceat(x[1:n - 1], edges[:-1] - 1)
+    sums_y = np.add.reduceat(y[1:n - 1], edges[:-1] - 1)
+    counts = np.diff(edges)
+    avg_x = np.append(sums_x / counts, x[-1])
+    avg_y = np.append(sums_y / counts, y[-1])
+
+    keep = np.empty(points, dtype=np.int64)
+    keep[0] = 0
+    a = 0
+    for bucket in range(points - 2):
+        start, end = edges[bucket], edges[bucket + 1]
+        cx, cy = avg_x[bucket + 1], avg_y[bucket + 1]
+        area = np.abs((x[a] - cx) * (y[start:end] - y[a]) - (x[a] - x[start:end]) * (cy - y[a]))
+        a = start + int(np.argmax(area))
+        keep[bucket + 1] = a
+    keep[-1] = n - 1
+    return keep
+
+
+def minmax(y, points):
+    """Keep the lowest and highest value of each of `points // 2` buckets.
+
+    Fully vectorized and guaranteed to show every spike, at the cost of a
+    less faithful line than LTTB.
+    """
+    n = len(y)
+    if points >= n or points < 4:
+        return np.arange(n)
+
+    buckets = points // 2
+    bucket_of = np.arange(n) * buckets // n
+    # Sort by (bucket, value); the first and last of each bucket are its min and max
+    order = np.lexsort((y, bucket_of))
+    starts = np.searchsorted(bucket_of[order], np.arange(buckets))
+    ends = np.append(starts[1:], n) - 1
+    keep = np.concatenate(([0], order[starts], order[ends], [n - 1]))
+    return np.unique(keep)
+
+
+def with_changes(keep, codes):
+    """Add the points where `codes` (e.g. device status) changes to `keep`."""
+    changes = np.flatnonzero(codes[1:] != codes[:-1]) + 1
+    return np.union1d(keep, np.concatenate((changes - 1, changes)))
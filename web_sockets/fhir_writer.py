@@ -0,0 +1,216 @@
+import asyncio
+import os
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+
+from common.fhir_resources import loads
+
+FHIR_CONCURRENCY = int(os.environ.get("FHIR_CONCURRENCY", 16))
+FHIR_QUEUE_SIZE = int(os.environ.get("FHIR_QUEUE_SIZE", 10000))
+
+
+class FhirError(Exception):
+    def __init__(self, status_code, text):
+        super().__init__(f"FHIR request failed ({status_code}): {text}")
+        self.status_code = status_code
+
+    @property
+    def retryable(self):
+        return self.status_code >= 500 or self.status_code in (408, 429)
+
+
+def is_retryable(error):
+    """True for outages and overload, False for requests HAPI will never accept."""
+    if isinstance(error, FhirError):
+        return error.retryable
+    return isinstance(error, (requests.RequestException, OSError))
+
+
+class FhirWriter:
+    """Bounded worker pool for blocking FHIR calls.
+
+    Handlers put work on an asyncio queue and get a future back, so a slow
+    HAPI response only occupies one of `concurrency` workers instead of the
+    whole event loop.
+    """
+
+    def __init__(self, concurrency=FHIR_CONCURRENCY, queue_size=FHIR_QUEUE_SIZE):
+        self.concurrency = concurrency
+        self.queue_size = queue_size
+        self.queue = None
+        self.workers = []
+        self.executor = ThreadPoolExecutor(max_workers=concurrency, thread_name_prefix="fhir-writer")
+        self.in_flight = 0
+        self.completed = 0
+        self.failed = 0
+
+    async def start(self):
+        self.queue = asyncio.Queue(maxsize=self.queue_size)
+        self.workers = [asyncio.create_task(self._worker()) for _ in range(self.concurrency)]
+
+    async def stop(self):
+        await self.queue.join()
+        for worker in self.workers:
+            worker.cancel()
+        await asyncio.gather(*self.workers, return_exceptions=True)
+        self.executor.shutdown(wait=False)
+
+    async def submit(self, fn, *args):
+        """Queue `fn(*args)` for the pool and return a future for its result.
+
+        Only waits when the queue is full, which is the backpressure point
+        if FHIR falls behind for longer than `queue_size` requests.
+        """
+        future = asyncio.get_running_loop().create_future()
+        await self.queue.put((fn, args, future))
+        return future
+
+    async def run(self, fn, *args):
+        future = await self.submit(fn, *args)
+        return await future
+
+    def stats(self):
+        return {
+            "queued": self.queue.qsize() if self.queue else 0,
+            "in_flight": self.in_flight,
+            "completed": self.completed,
+            "failed": self.failed,
+        }
+
+    async def _worker(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            fn, args, future = await self.queue.get()
+            self.in_flight += 1
+            try:
+                result = await loop.run_in_executor(self.executor, fn, *args)
+            except Exception as e:
+                self.failed += 1
+                if not future.cancelled():
+                    future.set_exception(e)
+            else:
+                self.completed += 1
+                if not future.cancelled():
+                    future.set_result(result)
+            finally:
+                self.in_flight -= 1
+                self.queue.task_done()
+
+
+BATCH_SIZE = 50
+BATCH_MAX_DELAY = 0.2
+# Statuses meaning HAPI refused the content itself, not the request rate
+VALIDATION_STATUSES = (400, 422)
+
+
+class BundleBatcher:
+    """Coalesces resources into FHIR `transaction` Bundles.
+
+    A batch is sent when it reaches `batch_size` resources or when its oldest
+    resource has waited `max_delay` seconds. Each `add` returns a future that
+    resolves to the server-assigned id of that resource.
+    """
+
+    def __init__(self, writer, client, batch_size=BATCH_SIZE, max_delay=BATCH_MAX_DELAY):
+        self.writer = writer
+        self.client = client
+        self.batch_size = batch_size
+        self.max_delay = max_delay
+        self.pending = []
+        self.timer = None
+        self.flush_tasks = set()
+        self.bundles_sent = 0
+
+    async def add(self, resource, if_none_exist=None, method="POST", url=None):
+        """Queue `resource` for the next Bundle.
+
+        With `if_none_exist` (a search query such as
+        `identifier=system|value`) the entry is a conditional create, so
+        replaying the same resource does not create a duplicate. `method`
+        and `url` allow other entries, e.g. `PUT Patient/<id>`.
+        """
+        request = {"method": method, "url": url or resource["resourceType"]}
+        if if_none_exist:
+            request["ifNoneExist"] = if_none_exist
+        future = asyncio.get_running_loop().create_future()
+        self.pending.append(((resource, request), future))
+        if len(self.pending) >= self.batch_size:
+            await self.flush()
+        elif self.timer is None:
+            self.timer = asyncio.get_running_loop().call_later(self.max_delay, self._flush_on_deadline)
+        return future
+
+    async def flush(self):
+        if self.timer is not None:
+            self.timer.cancel()
+            self.timer = None
+        if not self.pending:
+            return
+
+        batch, self.pending = self.pending, []
+        resources = [resource for resource, _ in batch]
+        bundle_future = await self.writer.submit(self._post_bundle, resources)
+        bundle_future.add_done_callback(lambda f: self._resolve(batch, f))
+        self.bundles_sent += 1
+
+    def _flush_on_deadline(self):
+        self.timer = None
+        task = asyncio.ensure_future(self.flush())
+        self.flush_tasks.add(task)
+        task.add_done_callback(self.flush_tasks.discard)
+
+    def _resolve(self, batch, bundle_future):
+        if bundle_future.cancelled():
+            results = [asyncio.CancelledError()] * len(batch)
+        elif bundle_future.exception() is not None:
+            results = [bundle_future.exception()] * len(batch)
+        else:
+            results = bundle_future.result()
+
+        for (_, future), result in zip(batch, results):
+            if future.cancelled():
+                continue
+            if isinstance(result, BaseException):
+                future.set_exception(result)
+            else:
+                future.set_result(result)
+
+    def _post_bundle(self, resources):
+        # Runs on a writer thread. Returns one id or exception per resource.
+        response = self._post_transaction(resources)
+        if response.status_code >= 400:
+            if len(resources) > 1 and response.status_code in VALIDATION_STATUSES:
+                # A transaction is all-or-nothing, so one invalid resource
+                # would reject the whole batch. Retry them one by one so only
+                # the bad resource is lost. Throttling (429, 408) is not split:
+                # the whole batch fails as retryable and is resent later.
+                print(f"[BUNDLE] Transaction rejected ({response.status_code}), retrying {len(resources)} entries individually")
+                return [self._post_bundle([resource])[0] for resource in resources]
+            return [FhirError(response.status_code, response.text)] * len(resources)
+
+        entries = loads(response.content).get("entry", [])
+        results = []
+        for (resource, _), entry in zip(resources, entries):
+            location = entry.get("response", {}).get("location", "")
+            parts = location.split('/')
+            if resource["resourceType"] in parts:
+                idx = parts.index(resource["resourceType"])
+                results.append(parts[idx + 1])
+            else:
+                results.append(RuntimeError(f"No location for {resource['resourceType']} in transaction response"))
+        results.extend(RuntimeError("Missing transaction response entry") for _ in range(len(resources) - len(entries)))
+        return results
+
+    def _post_transaction(self, resources):
+        entries = []
+        for resource, request in resources:
+            entry = {"resource": resource, "request": request}
+            if request["method"] == "POST":
+                entry["fullUrl"] = f"urn:uuid:{resource['id']}"
+            entries.append(entry)
+
+        # Safe to resend when every create is conditional
+        idempotent = all(request["method"] != "POST" or "ifNoneExist" in request for _, request in resources)
+        bundle = {"resourceType": "Bundle", "type": "transaction", "entry": entries}
+        return self.client.post("", resource=bundle, idempotent=idempotent)
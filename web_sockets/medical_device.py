@@ -1,9 +1,11 @@
 import tkinter as tk
 import asyncio
-import threading
-import json
 import random
-import websockets
+import uuid
+from datetime import datetime, timezone
+
+from device_link import DeviceLink
+from segment_buffer import SegmentBuffer
 
 SERVER_WS_URL = "ws://127.0.0.1:6789"
 DEVICE_ID = "neg-pressure-device-2"
@@ -29,46 +31,52 @@ current_status = OPERATION_STATUS['running']
 is_running = False
 last_value = -80
 
+# One connection and one ordered outbound queue for telemetry and alarms;
+# while the server is unreachable, messages are kept on disk
+link = DeviceLink(SERVER_WS_URL, buffer=SegmentBuffer(f"device_buffer_{DEVICE_ID}")).start()
+
+def stamp(payload):
+    """Add the message id the server deduplicates on, and the correlation
+    id and send time used to trace the message's latency."""
+    payload["msg_id"] = str(uuid.uuid4())
+    payload["correlation_id"] = str(uuid.uuid4())
+    payload["sent_at"] = datetime.now(timezone.utc).isoformat(timespec="milliseconds")
+    return payload
+
+def send(payload):
+    link.send(stamp(payload))
+
 async def send_data():
-    async with websockets.connect(SERVER_WS_URL) as ws:
-        while True:
-            if is_running:
-                val = -random.uniform(50, 100)
-                global last_value
-                last_value = val
-                payload = {
-                    "device_id": DEVICE_ID,
-                    "value": val,
-                    "mode": current_mode,
-                    "status": current_status,
-                    "error": False,
-                    "message": "",
-                }
-                await ws.send(json.dumps(payload))
-            await asyncio.sleep(5)
+    while True:
+        if is_running:
+            val = -random.uniform(50, 100)
+            global last_value
+            last_value = val
+            payload = {
+                "device_id": DEVICE_ID,
+                "value": val,
+                "mode": current_mode,
+                "status": current_status,
+                "error": False,
+                "message": "",
+            }
+            send(payload)
+        await asyncio.sleep(5)
 
 def end_therapy():
     global is_running, current_status
     is_running = False
     current_status = OPERATION_STATUS["ended"]
 
-    async def send_end():
-        try:
-            async with websockets.connect(SERVER_WS_URL) as ws:
-                payload = {
-                    "device_id": DEVICE_ID,
-                    "mode": current_mode,
-                    "value": last_value,
-                    "status": current_status,
-                    "error": False,
-                    "message": "Therapy ended by user"
-                }
-                await ws.send(json.dumps(payload))
-                print("Sent: Therapy ended")
-        except Exception as e:
-            print(f"Failed to send end payload: {e}")
-
-    threading.Thread(target=lambda: asyncio.run(send_end()), daemon=True).start()
+    send({
+        "device_id": DEVICE_ID,
+        "mode": current_mode,
+        "value": last_value,
+        "status": current_status,
+        "error": False,
+        "message": "Therapy ended by user"
+    })
+    print("Queued: Therapy ended")
 
     for w in [main_frame, header_label, mode_label, pressure_frame, pressure_value, pressure_unit,
               intensity_label, button_frame, footer_frame]:
@@ -78,44 +86,28 @@ def end_therapy():
     stop_button.config(state="disabled")
 
 def send_manual_pause_observation():
-    async def send_pause():
-        try:
-            async with websockets.connect(SERVER_WS_URL) as ws:
-                payload = {
-                    "device_id": DEVICE_ID,
-                    "mode": current_mode,
-                    "value": last_value,
-                    "status": OPERATION_STATUS["paused"],
-                    "error": False,
-                    "message": "Paused by user"
-                }
-                await ws.send(json.dumps(payload))
-                print("Sent: Pause observation")
-        except Exception as e:
-            print(f"Failed to send pause observation: {e}")
-
-    threading.Thread(target=lambda: asyncio.run(send_pause()), daemon=True).start()
+    send({
+        "device_id": DEVICE_ID,
+        "mode": current_mode,
+        "value": last_value,
+        "status": OPERATION_STATUS["paused"],
+        "error": False,
+        "message": "Paused by user"
+    })
+    print("Queued: Pause observation")
 
 
 def send_manual_error(message, severity="error"):
-    async def send_error():
-        try:
-            async with websockets.connect(SERVER_WS_URL) as ws:
-                payload = {
-                    "device_id": DEVICE_ID,
-                    "mode": current_mode,
-                    "value": last_value,
-                    "status": current_status,
-                    "error": True,
-                    "severity": severity,
-                    "message": message
-                }
-                await ws.send(json.dumps(payload))
-                print(f"Sent manual error: {message}")
-        except Exception as e:
-            print(f"Failed to send manual error: {e}")
-
-    threading.Thread(target=lambda: asyncio.run(send_error()), daemon=True).start()
+    send({
+        "device_id": DEVICE_ID,
+        "mode": current_mode,
+        "value": last_value,
+        "status": current_status,
+        "error": True,
+        "severity": severity,
+        "message": message
+    })
+    print(f"Queued manual error: {message}")
 
 def trigger_critical_error():
     global is_running, current_status
@@ -140,9 +132,6 @@ def trigger_non_critical_error():
     message = random.choice(list(NON_CRITICAL_ERRORS))
     send_manual_error(f"NON-CRITICAL: {message}", severity="warning")
 
-def start_loop():
-    asyncio.run(send_data())
-
 def toggle_state():
     global is_running, current_status 
 
@@ -231,5 +220,5 @@ footer_frame.pack(side="bottom", fill="x", pady=10)
 tk.Button(footer_frame, text="🔒", font=("Helvetica", 12), bg="#dcdcdc", relief="flat").pack(side="left", padx=30)
 tk.Button(footer_frame, text="🛠", font=("Helvetica", 12), bg="#dcdcdc", relief="flat").pack(side="right", padx=30)
 
-threading.Thread(target=start_loop, daemon=True).start()
+link.run_coroutine(send_data())
 root.mainloop()
@@ -1,85 +1,261 @@
-from flask import Flask, render_template, jsonify, request, send_file
-import requests
+from flask import Flask, Response, g, render_template, jsonify, request, send_file, stream_with_context
 import io
-from reportlab.lib.pagesizes import letter
-from reportlab.pdfgen import canvas
-
+import math
+import numpy as np
+import os
+import sys
+import threading
+import time
+from itertools import islice
+from urllib.parse import urlencode
+from concurrent.futures import Future, ProcessPoolExecutor, ThreadPoolExecutor
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from common.event_broker import EventBroker
+from common.fhir_client import FhirClient
+from common.metrics import REGISTRY, CONTENT_TYPE
+from common.tracing import log_stage, mark_fetched, read_trace, format_instant
+from ttl_cache import TTLCache, CACHE_TTL, CACHE_MAX_ENTRIES
+from pressure_buffer import PressureBuffers, PRESSURE_BUFFER_CAPACITY, PRESSURE_BUFFER_PATIENTS, parse_time, format_time
+from downsample import lttb, minmax, with_changes
+from pdf_cache import PdfCache, PDF_CACHE_DIR, PDF_CACHE_MAX_BYTES, FHIR_ID
+from report_pdf import render_report_pdf
 
 app = Flask(__name__)
 
-FHIR_URL = "http://localhost:8080/fhir"
+FHIR_URL = os.environ.get("FHIR_URL", "http://localhost:8080/fhir")
 PATIENT_ID = "test-patient"
 
-def get_latest_pressure_data(patient_id):
-    search_url = (
-        f"{FHIR_URL}/Observation?"
-        f"subject=Patient/{patient_id}&"
-        f"code=31209-0&_sort=-date&_count=10"
-    )
+REPORT_PAGE_SIZE = 100
+REPORT_FETCH_WORKERS = 4
+PDF_RENDER_WORKERS = 2
+DASHBOARD_WORKERS = 16
+ISSUE_PAGE_SIZE = 20
+ISSUE_MAX_PAGE_SIZE = 200
+HEART_WINDOW = 10
+PRESSURE_PAGE_SIZE = 500
+PRESSURE_REFRESH_MARGIN = 60
+HEART_RANGE_PAGE_SIZE = 1000
+HEART_RANGE_DEFAULT = 8 * 3600
+HEART_RANGE_POINTS = 1000
+HEART_RANGE_MAX_POINTS = 10000
+HEART_RANGE_METHODS = ("lttb", "minmax")
+TRACE_MAX_BATCH = 500
+
+fhir = FhirClient(FHIR_URL, pool_size=DASHBOARD_WORKERS + REPORT_FETCH_WORKERS)
+pdf_cache = PdfCache(PDF_CACHE_DIR, PDF_CACHE_MAX_BYTES)
+render_pool = None
+prerender_pool = ThreadPoolExecutor(max_workers=2, thread_name_prefix="prerender")
+dashboard_pool = ThreadPoolExecutor(max_workers=DASHBOARD_WORKERS, thread_name_prefix="dashboard")
+renders: dict[str, Future] = {}
+renders_lock = threading.Lock()
+
+cache = TTLCache(ttl=CACHE_TTL, max_entries=CACHE_MAX_ENTRIES)
+pressure_buffers = PressureBuffers(PRESSURE_BUFFER_CAPACITY, PRESSURE_BUFFER_PATIENTS)
+broker = EventBroker()
+
+REQUEST_SECONDS = REGISTRY.histogram("observer_request_duration_seconds", "Observer request latency", ["endpoint", "status"])
+PDF_RENDER_SECONDS = REGISTRY.histogram("observer_pdf_render_seconds", "Time to fetch and render one report PDF",
+                                        buckets=(0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60))
+PDF_CACHE_LOOKUPS = REGISTRY.counter("observer_pdf_cache_lookups_total", "Report PDF cache lookups", ["result"])
+REGISTRY.callback("observer_cache_lookups_total", "Response cache lookups; coalesced ones waited for another request's load",
+                  lambda: {(result,): cache.stats()[result] for result in ("hits", "misses", "coalesced")},
+                  kind="counter", labels=["result"])
+REGISTRY.callback("observer_cache_hit_ratio", "Share of response cache lookups not loaded from FHIR", lambda: cache.stats()["hit_ratio"])
+REGISTRY.callback("observer_cache_entries", "Entries in the response cache", lambda: cache.stats()["entries"])
+REGISTRY.callback("observer_stream_subscribers", "Open dashboard event streams", lambda: broker.subscriber_count())
+REGISTRY.callback("observer_dashboard_queue_depth", "Dashboard loads waiting for a worker", lambda: dashboard_pool._work_queue.qsize())
+REGISTRY.callback("observer_prerender_queue_depth", "Report PDFs waiting to be pre-rendered", lambda: prerender_pool._work_queue.qsize())
+
+# Which cached endpoints an ingest event makes stale
+EVENT_CACHE_KEYS = {
+    "reading": ["heart"],
+    "error": ["errors"],
+    "warning": ["warnings"],
+    "report": ["reports"],
+}
+
+PRESSURE_CODE = "31209-0"
+
+def pressure_reading(obs):
+    status = "unknown"
+    for component in obs.get("component", []):
+        if "code" in component and component["code"]["text"] == "Device status":
+            status = component.get("valueString", "unknown")
+            break
+    return parse_time(obs["effectiveDateTime"]), obs["valueQuantity"]["value"], status
+
+def fetch_pressure_updates(patient_id, capacity, high_water, seen=None):
+    """Readings stored after `high_water`, or the newest `capacity` ones if it is None.
+
+    Bundles do not always commit in `lastUpdated` order, so the query
+    starts `PRESSURE_REFRESH_MARGIN` seconds before `high_water`, and
+    Observations whose id is in `seen` are skipped.
+
+    Returns (readings, {timestamp: trace}, {id: lastUpdated timestamp},
+    new high water, complete), where `complete` is False if more than
+    `capacity` readings were stored since `high_water` and paging stopped
+    early.
+    """
+    seen = seen or {}
+    params = {"subject": f"Patient/{patient_id}", "code": PRESSURE_CODE,
+              "_elements": "effectiveDateTime,valueQuantity,component,meta,identifier,extension"}
+    if high_water is None:
+        # First load: the newest readings, up to the buffer's capacity
+        params.update({"_sort": "-_lastUpdated", "_count": min(capacity, PRESSURE_PAGE_SIZE)})
+    else:
+        since = format_time(parse_time(high_water) - PRESSURE_REFRESH_MARGIN)
+        params.update({"_sort": "_lastUpdated", "_lastUpdated": f"gt{since}", "_count": PRESSURE_PAGE_SIZE})
+
+    url = f"{FHIR_URL}/Observation?{urlencode(params)}"
+    readings = []
+    traces = {}
+    ids = {}
+    newest = high_water
+    while url and len(readings) < capacity:
+        bundle = fhir.get(url).json()
+        for entry in bundle.get("entry", []):
+            obs = entry["resource"]
+            updated = obs.get("meta", {}).get("lastUpdated")
+            if obs["id"] in seen or obs["id"] in ids:
+                continue
+            ids[obs["id"]] = parse_time(updated) if updated else time.time()
+            readings.append(pressure_reading(obs))
+            trace = read_trace(obs)
+            if trace is not None:
+                # Only new readings count as fetched; a first load is mostly history
+                traces[readings[-1][0]] = mark_fetched(trace) if high_water is not None else trace
+            if updated and (newest is None or parse_time(updated) > parse_time(newest)):
+                newest = updated
+        url = next_link(bundle)
+    return readings, traces, ids, newest, url is None
+
+def refresh_pressure_buffer(patient_id):
+    """Merge readings FHIR stored since the last refresh into the patient's ring buffer."""
+    ring = pressure_buffers.get(patient_id)
+    with ring.lock:
+        readings, traces, ids, high_water, complete = fetch_pressure_updates(
+            patient_id, ring.capacity, ring.high_water, ring.recent_ids)
+        if not complete:
+            # More new readings than the ring holds (e.g. a dashboard idle
+            # for hours): they would replace all of it anyway, so load the
+            # newest ones instead of paging through the whole gap.
+            ring.clear()
+            readings, traces, ids, high_water, _ = fetch_pressure_updates(patient_id, ring.capacity, None)
+        ring.merge(readings)
+        ring.add_traces(traces)
+        ring.high_water = high_water
+        if high_water is not None:
+            ring.remember(ids, parse_time(high_water) - PRESSURE_REFRESH_MARGIN)
+    return ring
+
+def get_latest_pressure_data(patient_id, count=HEART_WINDOW):
+    return refresh_pressure_buffer(patient_id).latest(count)
+
+def fetch_pressure_range(patient_id, start, end):
+    params = {"subject": f"Patient/{patient_id}", "code": PRESSURE_CODE, "date": [f"ge{start}", f"lt{end}"],
+              "_sort": "date", "_count": HEART_RANGE_PAGE_SIZE,
+              "_elements": "effectiveDateTime,valueQuantity,component"}
+    url = f"{FHIR_URL}/Observation?{urlencode(params, doseq=True)}"
+    readings = []
+    while url:
+        response = fhir.get(url)
+        # An error page must not turn into a silently empty chart
+        response.raise_for_status()
+        bundle = response.json()
+        readings.extend(pressure_reading(entry["resource"]) for entry in bundle.get("entry", []))
+        url = next_link(bundle)
+    return readings
+
+def get_pressure_history(patient_id, start, end, points, method="lttb"):
+    """Readings between `start` and `end` reduced to about `points`, keeping every status change."""
+    readings = fetch_pressure_range(patient_id, start, end)
+    if not readings:
+        return []
+    times = np.fromiter((r[0] for r in readings), float, len(readings))
+    values = np.fromiter((r[1] for r in readings), float, len(readings))
+    keep = minmax(values, points) if method == "minmax" else lttb(times, values, points)
+    _, status_codes = np.unique([r[2] for r in readings], return_inverse=True)
+    keep = with_changes(keep, status_codes)
+    return [{"value": readings[i][1], "time": format_time(readings[i][0]), "status": readings[i][2]} for i in keep]
+
+ERROR_CODE = "70325-2"
+WARNING_CODE = "69758-7"
+
+def parse_issue_cursor(before):
+    """Split a `before` cursor into (time, ids already returned at that time).
+
+    The ids are None for a plain time, which means strictly older issues.
+    Raises ValueError for a cursor that is not a valid time.
+    """
+    if not before:
+        return None, None
+    time_part, _, ids = before.partition("|")
+    parse_time(time_part)
+    return time_part, set(ids.split(",")) if ids else None
 
-    response = requests.get(search_url)
-    bundle = response.json()
-    values = []
+def iter_device_issues(patient_id, code, before=None, since=None, page_size=ISSUE_PAGE_SIZE, seen_ids=None):
+    """Yield a patient's issues newest first, fetching `next` pages only as they are consumed.
 
-    if "entry" in bundle:
-        for entry in reversed(bundle["entry"]):
+    With `seen_ids`, issues at exactly `before` are included except those ids.
+    """
+    params = {"subject": f"Patient/{patient_id}", "code": code, "_sort": "-date", "_count": page_size,
+              "_elements": "effectiveDateTime,valueString,meta,identifier,extension"}
+    dates = [f"{'le' if seen_ids else 'lt'}{before}"] if before else []
+    if since:
+        dates.append(f"gt{since}")
+    url = f"{FHIR_URL}/Observation?{urlencode({**params, 'date': dates}, doseq=True)}"
+    while url:
+        bundle = fhir.get(url).json()
+        for entry in bundle.get("entry", []):
             obs = entry["resource"]
-            value = obs["valueQuantity"]["value"]
-            time = obs["effectiveDateTime"]
-
-            status = "unknown"
-            for component in obs.get("component", []):
-                if "code" in component and component["code"]["text"] == "Device status":
-                    status = component.get("valueString", "unknown")
-                    break
-
-            values.append({
-                "value": value,
-                "time": time,
-                "status": status
-            })
+            if seen_ids and obs.get("id") in seen_ids and parse_time(obs.get("effectiveDateTime", before)) == parse_time(before):
+                continue
+            yield obs
+        url = next_link(bundle)
 
-    return values
+def get_device_issue_page(patient_id, code, default_message, limit=ISSUE_PAGE_SIZE, before=None, since=None):
+    """One page of at most `limit` issues, and the `before` cursor of the next page (or None).
 
-def get_latest_device_error(patient_id):
-    search_url = (
-        f"{FHIR_URL}/Observation?"
-        f"subject=Patient/{patient_id}&"
-        f"code=70325-2&_sort=-date"
-    )
-
-    response = requests.get(search_url)
-    bundle = response.json()
+    The cursor is the time of the page's oldest issue plus the ids of the
+    issues at that time already returned, so issues sharing a timestamp
+    across a page boundary are neither skipped nor repeated.
+    """
+    before, seen_ids = parse_issue_cursor(before)
     issues = []
+    boundary = None
+    for obs in islice(iter_device_issues(patient_id, code, before, since, limit + 1, seen_ids), limit + 1):
+        if len(issues) == limit:
+            break
+        issue = {
+            "message": obs.get("valueString", default_message),
+            "time": obs.get("effectiveDateTime", "Unknown time"),
+        }
+        trace = read_trace(obs)
+        if trace is not None:
+            issue["trace"] = trace
+        issues.append(issue)
+        if "effectiveDateTime" in obs:
+            at = parse_time(obs["effectiveDateTime"])
+            if boundary is None or at != boundary[1]:
+                boundary = (obs["effectiveDateTime"], at, set())
+            boundary[2].add(obs["id"])
+    else:
+        return issues, None
+    if boundary is None:
+        # Nothing on the page has a time to continue from
+        return issues, None
+    cursor_time, at, ids = boundary
+    if before and seen_ids and at == parse_time(before):
+        ids |= seen_ids
+    return issues, f"{cursor_time}|{','.join(sorted(ids))}"
 
-    if "entry" in bundle:
-        for entry in bundle["entry"]:
-            obs = entry["resource"]
-            issue_msg = obs.get("valueString", "Unknown error")
-            time = obs.get("effectiveDateTime", "Unknown time")
-            issues.append({"message": issue_msg, "time": time})
-    
-    return issues
+def get_latest_device_error(patient_id):
+    return get_device_issue_page(patient_id, ERROR_CODE, "Unknown error")
 
 def get_latest_device_warning(patient_id):
-    search_url = (
-        f"{FHIR_URL}/Observation?"
-        f"subject=Patient/{patient_id}&"
-        f"code=69758-7&_sort=-date"
-    )
-
-    response = requests.get(search_url)
-    bundle = response.json()
-    issues = []
-
-    if "entry" in bundle:
-        for entry in bundle["entry"]:
-            obs = entry["resource"]
-            issue_msg = obs.get("valueString", "Unknown warning")
-            time = obs.get("effectiveDateTime", "Unknown time")
-            issues.append({"message": issue_msg, "time": time})
-    
-    return issues
+    return get_device_issue_page(patient_id, WARNING_CODE, "Unknown warning")
 
 def get_latest_reports(patient_id):
     search_url = (
@@ -88,7 +264,7 @@ def get_latest_reports(patient_id):
         f"_sort=-issued&_count=5"
     )
 
-    response = requests.get(search_url)
+    response = fhir.get(search_url)
     bundle = response.json()
     reports = []
 
@@ -102,51 +278,174 @@ def get_latest_reports(patient_id):
 
     return reports
 
-def fetch_observations_for_latest_report(patient_id):
+DASHBOARD_LOADERS = {
+    "heart": get_latest_pressure_data,
+    "errors": get_latest_device_error,
+    "warnings": get_latest_device_warning,
+    "reports": get_latest_reports,
+}
+
+def next_link(bundle):
+    return next((link["url"] for link in bundle.get("link", []) if link.get("relation") == "next"), None)
+
+def fetch_observation_page(ids):
+    """Fetch one chunk of Observations by id, following `next` links."""
+    found = {}
+    url = f"{FHIR_URL}/Observation?_id={','.join(ids)}&_count={len(ids)}"
+    while url:
+        bundle = fhir.get(url).json()
+        for entry in bundle.get("entry", []):
+            obs = entry["resource"]
+            found[f"Observation/{obs['id']}"] = obs
+        url = next_link(bundle)
+    return found
+
+def fetch_observations_by_id(ids):
+    chunks = [ids[i:i + REPORT_PAGE_SIZE] for i in range(0, len(ids), REPORT_PAGE_SIZE)]
+    found = {}
+    with ThreadPoolExecutor(max_workers=REPORT_FETCH_WORKERS) as pool:
+        for page in pool.map(fetch_observation_page, chunks):
+            found.update(page)
+    return found
+
+def summarize_observation(obs):
+    time = obs.get("effectiveDateTime", "N/A")
+    status = obs.get("status", "N/A")
+    code = obs.get("code", {}).get("text", "Unknown Code")
+    value = "-"
+    if "valueQuantity" in obs:
+        value = f"{obs['valueQuantity']['value']} {obs['valueQuantity'].get('unit', '')}"
+    elif "valueString" in obs:
+        value = obs["valueString"]
+
+    return {
+        "time": time,
+        "code": code,
+        "value": value,
+        "status": status
+    }
+
+def latest_report_ref(patient_id):
+    """Id and versionId of the patient's latest DiagnosticReport, or None."""
     report_url = (
         f"{FHIR_URL}/DiagnosticReport?"
         f"subject=Patient/{patient_id}&"
-        f"_sort=-issued&_count=1"
+        f"_sort=-issued&_count=1&_elements=id,meta"
     )
-    report_response = requests.get(report_url).json()
-    
-    if "entry" not in report_response or len(report_response["entry"]) == 0:
-        return None, []
+    bundle = fhir.get(report_url).json()
+    if not bundle.get("entry"):
+        return None
+    report = bundle["entry"][0]["resource"]
+    return report["id"], report.get("meta", {}).get("versionId", "1")
+
+def fetch_report_observations(report_id):
+    # _include returns the report's Observations in the same response; any
+    # the server left out are fetched in chunks of REPORT_PAGE_SIZE ids.
+    report_url = (
+        f"{FHIR_URL}/DiagnosticReport?"
+        f"_id={report_id}&_include=DiagnosticReport:result"
+    )
+    response = fhir.get(report_url)
+    response.raise_for_status()
+    report_response = response.json()
+
+    entries = report_response.get("entry", [])
+    reports = [e["resource"] for e in entries if e["resource"]["resourceType"] == "DiagnosticReport"]
+    if not reports:
+        # Raised rather than rendered, so no empty PDF is cached for the id
+        raise LookupError(f"DiagnosticReport/{report_id} not found")
 
-    report = report_response["entry"][0]["resource"]
+    report = reports[0]
     report_time = report.get("issued", "Unknown")
     obs_refs = [ref["reference"] for ref in report.get("result", []) if "reference" in ref]
-    
-    observations = []
-    for ref in obs_refs:
-        obs_url = f"{FHIR_URL}/{ref}"
-        obs = requests.get(obs_url).json()
-        
-        time = obs.get("effectiveDateTime", "N/A")
-        status = obs.get("status", "N/A")
-        code = obs.get("code", {}).get("text", "Unknown Code")
-        value = "-"
-        if "valueQuantity" in obs:
-            value = f"{obs['valueQuantity']['value']} {obs['valueQuantity'].get('unit', '')}"
-        elif "valueString" in obs:
-            value = obs["valueString"]
-
-        observations.append({
-            "time": time,
-            "code": code,
-            "value": value,
-            "status": status
-        })
 
+    resolved = {
+        f"Observation/{e['resource']['id']}": e["resource"]
+        for e in entries if e["resource"]["resourceType"] == "Observation"
+    }
+    missing = [ref.split("/")[1] for ref in dict.fromkeys(obs_refs) if ref not in resolved]
+    if missing:
+        resolved.update(fetch_observations_by_id(missing))
+
+    observations = [summarize_observation(resolved[ref]) for ref in obs_refs if ref in resolved]
     return report_time, observations
 
+def get_render_pool():
+    global render_pool
+    with renders_lock:
+        if render_pool is None:
+            render_pool = ProcessPoolExecutor(max_workers=PDF_RENDER_WORKERS)
+        return render_pool
+
+def render_report(patient_id, report_id, version):
+    """PDF bytes for one report version, rendered at most once.
+
+    Served from the disk cache when present. Otherwise the first caller
+    renders it in the process pool and concurrent callers wait for that
+    render instead of starting their own.
+    """
+    key = f"{report_id}-v{version}"
+    data = pdf_cache.get(key)
+    if data is not None:
+        PDF_CACHE_LOOKUPS.labels("hit").inc()
+        return data
+    PDF_CACHE_LOOKUPS.labels("miss").inc()
+
+    with renders_lock:
+        future = renders.get(key)
+        leader = future is None
+        if leader:
+            future = renders[key] = Future()
+    if not leader:
+        return future.result()
+
+    try:
+        started = time.perf_counter()
+        report_time, observations = fetch_report_observations(report_id)
+        data = get_render_pool().submit(render_report_pdf, patient_id, report_time, observations).result()
+        PDF_RENDER_SECONDS.observe(time.perf_counter() - started)
+        pdf_cache.put(key, data)
+        future.set_result(data)
+        return data
+    except Exception as e:
+        future.set_exception(e)
+        raise
+    finally:
+        with renders_lock:
+            renders.pop(key, None)
+
+def prerender_report(patient_id, report_id, version):
+    try:
+        render_report(patient_id, report_id, version)
+        print(f"[PDF] Pre-rendered report {report_id} v{version}")
+    except Exception as e:
+        print(f"[PDF] Pre-render of report {report_id} failed: {e}")
+
+@app.before_request
+def start_timer():
+    g.started = time.perf_counter()
+
+@app.after_request
+def record_latency(response):
+    if "started" in g:
+        endpoint = request.url_rule.rule if request.url_rule else "unmatched"
+        REQUEST_SECONDS.labels(endpoint, str(response.status_code)).observe(time.perf_counter() - g.started)
+    return response
+
+@app.route("/metrics")
+def metrics():
+    return Response(REGISTRY.render(), content_type=CONTENT_TYPE)
+
 @app.route("/")
 def index():
     return render_template("index.html")
 
 @app.route("/api/patients")
 def get_patients():
-    response = requests.get(f"{FHIR_URL}/Patient?_count=100")
+    return jsonify(cache.get_or_load(("patients", None), fetch_patients))
+
+def fetch_patients():
+    response = fhir.get(f"{FHIR_URL}/Patient?_count=100")
     bundle = response.json()
     patients = []
 
@@ -158,167 +457,142 @@ def get_patients():
                 "name": f"{patient.get('name', [{'family':'Unknown'}])[0].get('given', [''])[0]} {patient.get('name', [{'family':'Unknown'}])[0]['family']}"
             })
 
-    return jsonify(patients)
+    return patients
+
+def load_cached(endpoint, patient_id):
+    return cache.get_or_load((endpoint, patient_id), lambda: DASHBOARD_LOADERS[endpoint](patient_id))
 
 @app.route("/api/heart")
 def heart_api():
+    # Default: the last HEART_WINDOW readings. `count` or `minutes` pick a
+    # longer window from the patient's ring buffer.
     patient_id = request.args.get("patient", "test-patient")
-    data = get_latest_pressure_data(patient_id)
-    return jsonify(data)
+    if any(arg in request.args for arg in ("from", "to", "points")):
+        return heart_history_response(patient_id)
+    count = request.args.get("count", type=int)
+    minutes = request.args.get("minutes", type=float)
+    if minutes is not None:
+        return jsonify(refresh_pressure_buffer(patient_id).since(time.time() - minutes * 60))
+    if count is not None and count != HEART_WINDOW:
+        return jsonify(get_latest_pressure_data(patient_id, min(max(count, 1), PRESSURE_BUFFER_CAPACITY)))
+    return jsonify(load_cached("heart", patient_id))
+
+def issue_page_response(endpoint, code, default_message):
+    # The first default-sized page is what dashboards poll, so only that is cached
+    patient_id = request.args.get("patient", "test-patient")
+    limit = min(max(request.args.get("limit", ISSUE_PAGE_SIZE, type=int), 1), ISSUE_MAX_PAGE_SIZE)
+    before = request.args.get("before")
+    since = request.args.get("since")
+    try:
+        parse_issue_cursor(before)
+        if since:
+            parse_time(since)
+    except ValueError:
+        return jsonify({"error": "before and since must be cursors or ISO 8601 times"}), 400
+    if limit == ISSUE_PAGE_SIZE and not before and not since:
+        issues, cursor = load_cached(endpoint, patient_id)
+    else:
+        issues, cursor = get_device_issue_page(patient_id, code, default_message, limit, before, since)
+
+    response = jsonify(issues)
+    if cursor:
+        query = {"patient": patient_id, "limit": limit, "before": cursor}
+        if since:
+            query["since"] = since
+        response.headers["Link"] = f'<{request.path}?{urlencode(query)}>; rel="next"'
+    return response
+
+def heart_history_response(patient_id):
+    # /api/heart?from=&to=&points=: a long range decimated for the chart
+    try:
+        if request.args.get("to"):
+            end = parse_time(request.args["to"])
+        else:
+            # "Now", rounded up to the cache TTL so repeated default requests share an entry
+            end = math.ceil(time.time() / CACHE_TTL) * CACHE_TTL
+        start = parse_time(request.args["from"]) if request.args.get("from") else end - HEART_RANGE_DEFAULT
+    except (TypeError, ValueError):
+        return jsonify({"error": "from and to must be ISO 8601 times"}), 400
+    if start >= end:
+        return jsonify({"error": "from must be before to"}), 400
+    method = request.args.get("method", "lttb")
+    if method not in HEART_RANGE_METHODS:
+        return jsonify({"error": f"method must be one of {', '.join(HEART_RANGE_METHODS)}"}), 400
+    points = min(max(request.args.get("points", HEART_RANGE_POINTS, type=int), 3), HEART_RANGE_MAX_POINTS)
+    start, end = format_time(start), format_time(end)
+    key = ("heart_range", patient_id, start, end, points, method)
+    return jsonify(cache.get_or_load(key, lambda: get_pressure_history(patient_id, start, end, points, method)))
 
 @app.route("/api/errors")
 def errors_api():
-    patient_id = request.args.get("patient", "test-patient")
-    issues = get_latest_device_error(patient_id)
-    return jsonify(issues)
+    return issue_page_response("errors", ERROR_CODE, "Unknown error")
 
 @app.route("/api/warning")
 def warnings_api():
-    patient_id = request.args.get("patient", "test-patient")
-    issues = get_latest_device_warning(patient_id)
-    return jsonify(issues)
+    return issue_page_response("warnings", WARNING_CODE, "Unknown warning")
 
 @app.route("/api/reports")
 def reports_api():
     patient_id = request.args.get("patient", "test-patient")
-    reports = get_latest_reports(patient_id)
-    return jsonify(reports)
-
-from reportlab.lib.pagesizes import letter
-from reportlab.platypus import SimpleDocTemplate, Paragraph, Spacer, Table, TableStyle
-from reportlab.lib.styles import getSampleStyleSheet, ParagraphStyle
-from reportlab.lib import colors
-from flask import send_file
-import io
-from datetime import datetime
+    return jsonify(load_cached("reports", patient_id))
 
-from datetime import datetime, timedelta
+@app.route("/api/dashboard")
+def dashboard_api():
+    # All dashboard sections in one response; the FHIR searches run side by side
+    patient_id = request.args.get("patient", "test-patient")
+    futures = {endpoint: dashboard_pool.submit(load_cached, endpoint, patient_id) for endpoint in DASHBOARD_LOADERS}
+    dashboard = {endpoint: future.result() for endpoint, future in futures.items()}
+    dashboard["errors"] = dashboard["errors"][0]
+    dashboard["warnings"] = dashboard["warnings"][0]
+    return jsonify(dashboard)
+
+@app.route("/api/events", methods=["POST"])
+def events_api():
+    # Called by the ingest server when new data for a patient is stored
+    events = request.get_json(force=True).get("events", [])
+    now = time.time()
+    for event in events:
+        patient_id = event.get("patient")
+        if event.get("trace"):
+            event["trace"]["notified"] = format_instant(now)
+            log_stage(event["trace"].get("correlation_id"), notified=now)
+        if event.get("type") == "patient":
+            cache.invalidate(("patients", None))
+        for endpoint in EVENT_CACHE_KEYS.get(event.get("type"), []):
+            cache.invalidate((endpoint, patient_id))
+        if event.get("type") == "report" and event.get("report_id"):
+            report_id, version = str(event["report_id"]), str(event.get("version", "1"))
+            if FHIR_ID.fullmatch(report_id) and FHIR_ID.fullmatch(version):
+                prerender_pool.submit(prerender_report, patient_id, report_id, version)
+            else:
+                print(f"[PDF] Ignoring report event with invalid id {report_id!r} v{version!r}")
+        broker.publish(patient_id, event)
+    return "", 204
+
+@app.route("/api/trace", methods=["POST"])
+def trace_api():
+    # Dashboards report when traced readings and issues appeared on screen
+    for item in request.get_json(force=True).get("displayed", [])[:TRACE_MAX_BATCH]:
+        log_stage(item.get("correlation_id"), displayed=item.get("at"), via=item.get("via"))
+    return "", 204
+
+@app.route("/api/stream")
+def stream_api():
+    # Server-Sent Events with only what changed for this patient
+    patient_id = request.args.get("patient", "test-patient")
+    return Response(stream_with_context(broker.stream(patient_id)), mimetype="text/event-stream",
+                    headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
 
 @app.route("/api/report/pdf")
 def generate_pdf_report():
     patient_id = request.args.get("patient", "test-patient")
-    report_time, observations = fetch_observations_for_latest_report(patient_id)
-
-    # Parse times and statuses for calculation
-    times = []
-    pause_intervals = []  # store paused periods as (start, end) tuples
-    pause_start = None
-
-    for obs in observations:
-        try:
-            t = datetime.fromisoformat(obs["time"].replace("Z", "+00:00"))
-        except Exception:
-            continue
-        times.append(t)
-
-        status = obs.get("status", "").lower()
-        if status == "paused" and pause_start is None:
-            pause_start = t
-        elif status != "paused" and pause_start is not None:
-            pause_intervals.append((pause_start, t))
-            pause_start = None
-
-    # If last status was paused and no end time, assume pause ended at last observation time
-    if pause_start is not None and times:
-        pause_intervals.append((pause_start, max(times)))
-
-    if times:
-        therapy_start = min(times)
-        therapy_end = max(times)
-        duration = therapy_end - therapy_start
+    ref = latest_report_ref(patient_id)
+    if ref is None:
+        data = render_report_pdf(patient_id, None, [])
     else:
-        therapy_start = therapy_end = None
-        duration = timedelta(0)
-
-    # Sum pause durations
-    pause_duration = timedelta(0)
-    for start, end in pause_intervals:
-        pause_duration += (end - start)
-
-    # Format for display
-    def fmt_dt(dt):
-        return dt.strftime("%d %b %Y, %H:%M:%S") if dt else "N/A"
-    def fmt_td(td):
-        # Format timedelta as H:MM:SS
-        total_seconds = int(td.total_seconds())
-        hours, remainder = divmod(total_seconds, 3600)
-        minutes, seconds = divmod(remainder, 60)
-        return f"{hours}:{minutes:02d}:{seconds:02d}"
-
-    buffer = io.BytesIO()
-    doc = SimpleDocTemplate(buffer, pagesize=letter, topMargin=50, bottomMargin=50)
-
-    styles = getSampleStyleSheet()
-    elements = []
-
-    # Title
-    title_style = ParagraphStyle(
-        'title',
-        parent=styles['Heading1'],
-        fontSize=20,
-        textColor=colors.white,
-        backColor=colors.darkblue,
-        alignment=1,  # center
-        spaceAfter=20,
-        leading=26
-    )
-    elements.append(Paragraph(f"📄 Patient Diagnostic Report", title_style))
-
-    # Meta info: patient ID, report time
-    elements.append(Paragraph(f"<b>Patient ID:</b> {patient_id}", styles["Normal"]))
-    elements.append(Paragraph(f"<b>Report Time:</b> {report_time}", styles["Normal"]))
-    elements.append(Spacer(1, 12))
-
-    # New therapy info section
-    therapy_info = f"""
-        <b>Therapy Start:</b> {fmt_dt(therapy_start)}<br/>
-        <b>Therapy End:</b> {fmt_dt(therapy_end)}<br/>
-        <b>Duration:</b> {fmt_td(duration)}<br/>
-        <b>Pause Duration:</b> {fmt_td(pause_duration)}
-    """
-    elements.append(Paragraph(therapy_info, styles["Normal"]))
-    elements.append(Spacer(1, 12))
-
-    # Table with observations (with formatted times)
-    data = [["Time", "Code", "Value", "Status"]]
-    for obs in observations:
-        try:
-            dt = datetime.fromisoformat(obs["time"].replace("Z", "+00:00"))
-            readable_time = dt.strftime("%d %b %Y, %H:%M:%S")
-        except Exception:
-            readable_time = obs["time"]
-
-        data.append([
-            readable_time,
-            obs["code"],
-            str(obs["value"]),
-            obs["status"]
-        ])
-
-    if observations:
-        table = Table(data, repeatRows=1, hAlign='LEFT')
-        table.setStyle(TableStyle([
-            ('BACKGROUND', (0, 0), (-1, 0), colors.HexColor("#007bff")),
-            ('TEXTCOLOR', (0, 0), (-1, 0), colors.white),
-            ('ALIGN', (0, 0), (-1, -1), 'CENTER'),
-            ('FONTNAME', (0, 0), (-1, 0), 'Helvetica-Bold'),
-            ('FONTSIZE', (0, 0), (-1, -1), 10),
-            ('BOTTOMPADDING', (0, 0), (-1, 0), 8),
-            ('GRID', (0, 0), (-1, -1), 0.25, colors.grey),
-        ]))
-        elements.append(table)
-    else:
-        elements.append(Paragraph("No observations found for the latest report.", styles["Normal"]))
-
-    elements.append(Spacer(1, 20))
-    footer = datetime.now().strftime("Generated on %Y-%m-%d at %H:%M:%S")
-    footer_style = ParagraphStyle("footer", fontSize=8, alignment=2, textColor=colors.grey)
-    elements.append(Paragraph(footer, footer_style))
-
-    doc.build(elements)
-    buffer.seek(0)
+        data = render_report(patient_id, *ref)
 
-    return send_file(buffer, as_attachment=True,
+    return send_file(io.BytesIO(data), as_attachment=True,
                      download_name=f"report_{patient_id}.pdf",
                      mimetype='application/pdf')
 
@@ -0,0 +1,54 @@
+import asyncio
+from collections import deque
+
+import requests
+
+OBSERVER_URL = "http://127.0.0.1:5000"
+NOTIFY_INTERVAL = 0.5
+NOTIFY_MAX_PENDING = 10000
+
+
+class ObserverNotifier:
+    """Sends new-data events for each patient to the observer.
+
+    Events carry the new data itself (a reading, an issue, a report) so the
+    observer can push it straight to dashboards. They are collected for
+    `interval` seconds and posted together to the observer's /api/events, so
+    a busy ingest server sends at most one request per interval. Delivery is
+    best effort: at most `max_pending` events are held while the observer is
+    unreachable, and dashboards resync on reconnect. Set `url` to None to
+    disable.
+    """
+
+    def __init__(self, url=OBSERVER_URL, interval=NOTIFY_INTERVAL, timeout=2, max_pending=NOTIFY_MAX_PENDING):
+        self.url = url
+        self.interval = interval
+        self.timeout = timeout
+        self.pending = deque(maxlen=max_pending)
+        self.failing = False
+
+    def notify(self, patient_id, event_type, **details):
+        if self.url:
+            self.pending.append({"patient": patient_id, "type": event_type, **details})
+
+    async def run(self):
+        if not self.url:
+            return
+        while True:
+            await asyncio.sleep(self.interval)
+            if not self.pending:
+                continue
+            events = list(self.pending)
+            self.pending.clear()
+            try:
+                await asyncio.to_thread(self._post, events)
+            except Exception as e:
+                if not self.failing:
+                    print(f"[OBSERVER] Could not notify observer at {self.url}: {e}")
+                self.failing = True
+            else:
+                self.failing = False
+
+    def _post(self, events):
+        response = requests.post(f"{self.url}/api/events", json={"events": events}, timeout=self.timeout)
+        response.raise_for_status()
@@ -0,0 +1,69 @@
+import os
+import re
+import threading
+from collections import OrderedDict
+
+PDF_CACHE_DIR = "pdf_cache"
+PDF_CACHE_MAX_BYTES = 200 * 1024 * 1024
+# FHIR id syntax; report ids and versions must match it before they name a file
+FHIR_ID = re.compile(r"[A-Za-z0-9\-.]{1,64}")
+CACHE_KEY = re.compile(r"[A-Za-z0-9\-.]{1,64}-v[A-Za-z0-9\-.]{1,64}")
+
+
+class PdfCache:
+    """Rendered report PDFs on disk, evicted least recently used first once
+    the directory grows past `max_bytes`.
+
+    Keys name an immutable report version, "<id>-v<versionId>", both in
+    FHIR id syntax; anything else raises ValueError, so a key can never
+    point outside `directory`.
+    """
+
+    def __init__(self, directory=PDF_CACHE_DIR, max_bytes=PDF_CACHE_MAX_BYTES):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.lock = threading.Lock()
+        self.sizes = OrderedDict()
+        self.total = 0
+        os.makedirs(directory, exist_ok=True)
+
+        files = [entry for entry in os.scandir(directory)
+                 if entry.name.endswith(".pdf") and CACHE_KEY.fullmatch(entry.name[:-4])]
+        for entry in sorted(files, key=lambda e: e.stat().st_mtime):
+            self.sizes[entry.name[:-4]] = entry.stat().st_size
+            self.total += entry.stat().st_size
+
+    def path(self, key):
+        if not CACHE_KEY.fullmatch(key):
+            raise ValueError(f"Invalid PDF cache key: {key!r}")
+        return os.path.join(self.directory, f"{key}.pdf")
+
+    def get(self, key):
+        with self.lock:
+            if key not in self.sizes:
+                return None
+            self.sizes.move_to_end(key)
+        try:
+            with open(self.path(key), "rb") as f:
+                return f.read()
+        except FileNotFoundError:
+            with self.lock:
+                self.total -= self.sizes.pop(key, 0)
+            return None
+
+    def put(self, key, data):
+        tmp_path = f"{self.path(key)}.{threading.get_ident()}.tmp"
+        with open(tmp_path, "wb") as f:
+            f.write(data)
+        os.replace(tmp_path, self.path(key))
+
+        with self.lock:
+            self.total += len(data) - self.sizes.pop(key, 0)
+            self.sizes[key] = len(data)
+            while self.total > self.max_bytes and len(self.sizes) > 1:
+                old_key, size = self.sizes.popitem(last=False)
+                self.total -= size
+                try:
+                    os.remove(self.path(old_key))
+                except FileNotFoundError:
+                    pass
@@ -0,0 +1,139 @@
+import threading
+from array import array
+from collections import OrderedDict
+from datetime import datetime, timezone
+
+PRESSURE_BUFFER_CAPACITY = 3600
+PRESSURE_BUFFER_PATIENTS = 500
+PRESSURE_BUFFER_TRACES = 100
+
+# Fixed, so rings can be appended to from any thread; anything else is "unknown"
+STATUSES = ("unknown", "running", "paused", "ended")
+STATUS_CODES = {status: code for code, status in enumerate(STATUSES)}
+
+
+def parse_time(value):
+    return datetime.fromisoformat(value.replace("Z", "+00:00")).timestamp()
+
+
+def format_time(timestamp):
+    return datetime.fromtimestamp(timestamp, timezone.utc).isoformat(timespec="milliseconds")
+
+
+class PressureRing:
+    """The most recent `capacity` readings of one patient, oldest first.
+
+    Times, values and device statuses live in fixed-size arrays, so a
+    patient costs about 17 bytes per reading whatever the window.
+    `high_water` is the newest `meta.lastUpdated` merged so far; the next
+    refresh asks FHIR for resources stored shortly before it, and
+    `recent_ids` ({Observation id: lastUpdated timestamp}) holds the ones
+    merged in that overlap so they are not merged twice. Latency traces
+    are kept for the newest `PRESSURE_BUFFER_TRACES` readings only.
+    """
+
+    __slots__ = ("capacity", "times", "values", "statuses", "start", "size", "high_water", "recent_ids", "traces", "lock")
+
+    def __init__(self, capacity=PRESSURE_BUFFER_CAPACITY):
+        self.capacity = capacity
+        self.times = array("d", bytes(8 * capacity))
+        self.values = array("d", bytes(8 * capacity))
+        self.statuses = array("B", bytes(capacity))
+        self.start = 0
+        self.size = 0
+        self.high_water = None
+        self.recent_ids = {}
+        self.traces = {}
+        self.lock = threading.Lock()
+
+    def __len__(self):
+        return self.size
+
+    def append(self, timestamp, value, status):
+        i = (self.start + self.size) % self.capacity
+        self.times[i] = timestamp
+        self.values[i] = value
+        self.statuses[i] = STATUS_CODES.get(status, 0)
+        if self.size < self.capacity:
+            self.size += 1
+        else:
+            self.start = (self.start + 1) % self.capacity
+
+    def clear(self):
+        self.start = 0
+        self.size = 0
+        self.high_water = None
+        self.recent_ids = {}
+        self.traces = {}
+
+    def merge(self, readings):
+        """Add (timestamp, value, status) readings, keeping time order.
+
+        Readings usually arrive after everything already held and are just
+        appended. A late-committed reading older than the tail re-sorts
+        only the readings newer than it.
+        """
+        readings = sorted(readings)
+        if not readings:
+            return
+        newer = []
+        while self.size and self.times[(self.start + self.size - 1) % self.capacity] > readings[0][0]:
+            self.size -= 1
+            i = (self.start + self.size) % self.capacity
+            newer.append((self.times[i], self.values[i], STATUSES[self.statuses[i]]))
+        if newer:
+            readings = sorted(readings + newer)
+        for timestamp, value, status in readings:
+            self.append(timestamp, value, status)
+
+    def remember(self, ids, cutoff):
+        """Record {Observation id: lastUpdated timestamp} of merged readings
+        and forget the ones stored before `cutoff`, which no refresh returns."""
+        self.recent_ids.update(ids)
+        for obs_id in [i for i, updated in self.recent_ids.items() if updated < cutoff]:
+            del self.recent_ids[obs_id]
+
+    def add_traces(self, traces):
+        """Remember {timestamp: trace} for readings merged into the ring."""
+        self.traces.update(traces)
+        if len(self.traces) > PRESSURE_BUFFER_TRACES:
+            for timestamp in sorted(self.traces)[:-PRESSURE_BUFFER_TRACES]:
+                del self.traces[timestamp]
+
+    def latest(self, count):
+        """The newest `count` readings, oldest first, as dashboard dicts."""
+        count = min(count, self.size)
+        return [self._reading(self.size - count + k) for k in range(count)]
+
+    def since(self, timestamp):
+        return [self._reading(k) for k in range(self.size) if self.times[(self.start + k) % self.capacity] > timestamp]
+
+    def _reading(self, k):
+        i = (self.start + k) % self.capacity
+        reading = {"value": self.values[i], "time": format_time(self.times[i]), "status": STATUSES[self.statuses[i]]}
+        trace = self.traces.get(self.times[i])
+        if trace is not None:
+            reading["trace"] = trace
+        return reading
+
+
+class PressureBuffers:
+    """One `PressureRing` per patient, for at most `max_patients` patients
+    (least recently used dropped first)."""
+
+    def __init__(self, capacity=PRESSURE_BUFFER_CAPACITY, max_patients=PRESSURE_BUFFER_PATIENTS):
+        self.capacity = capacity
+        self.max_patients = max_patients
+        self.rings = OrderedDict()
+        self.lock = threading.Lock()
+
+    def get(self, patient_id):
+        with self.lock:
+            ring = self.rings.get(patient_id)
+            if ring is None:
+                ring = self.rings[patient_id] = PressureRing(self.capacity)
+                while len(self.rings) > self.max_patients:
+                    self.rings.popitem(last=False)
+            else:
+                self.rings.move_to_end(patient_id)
+            return ring
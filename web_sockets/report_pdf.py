@@ -0,0 +1,133 @@
+import io
+from datetime import datetime, timedelta
+
+from reportlab.lib.pagesizes import letter
+from reportlab.platypus import SimpleDocTemplate, Paragraph, Spacer, Table, TableStyle
+from reportlab.lib.styles import getSampleStyleSheet, ParagraphStyle
+from reportlab.lib import colors
+
+
+def render_report_pdf(patient_id, report_time, observations):
+    """Render a DiagnosticReport summary to PDF bytes.
+
+    Kept free of Flask and FHIR access so it can run in a worker process.
+    """
+    # Parse times and statuses for calculation
+    times = []
+    pause_intervals = []  # store paused periods as (start, end) tuples
+    pause_start = None
+
+    for obs in observations:
+        try:
+            t = datetime.fromisoformat(obs["time"].replace("Z", "+00:00"))
+        except Exception:
+            continue
+        times.append(t)
+
+        status = obs.get("status", "").lower()
+        if status == "paused" and pause_start is None:
+            pause_start = t
+        elif status != "paused" and pause_start is not None:
+            pause_intervals.append((pause_start, t))
+            pause_start = None
+
+    # If last status was paused and no end time, assume pause ended at last observation time
+    if pause_start is not None and times:
+        pause_intervals.append((pause_start, max(times)))
+
+    if times:
+        therapy_start = min(times)
+        therapy_end = max(times)
+        duration = therapy_end - therapy_start
+    else:
+        therapy_start = therapy_end = None
+        duration = timedelta(0)
+
+    # Sum pause durations
+    pause_duration = timedelta(0)
+    for start, end in pause_intervals:
+        pause_duration += (end - start)
+
+    # Format for display
+    def fmt_dt(dt):
+        return dt.strftime("%d %b %Y, %H:%M:%S") if dt else "N/A"
+    def fmt_td(td):
+        # Format timedelta as H:MM:SS
+        total_seconds = int(td.total_seconds())
+        hours, remainder = divmod(total_seconds, 3600)
+        minutes, seconds = divmod(remainder, 60)
+        return f"{hours}:{minutes:02d}:{seconds:02d}"
+
+    buffer = io.BytesIO()
+    doc = SimpleDocTemplate(buffer, pagesize=letter, topMargin=50, bottomMargin=50)
+
+    styles = getSampleStyleSheet()
+    elements = []
+
+    # Title
+    title_style = ParagraphStyle(
+        'title',
+        parent=styles['Heading1'],
+        fontSize=20,
+        textColor=colors.white,
+        backColor=colors.darkblue,
+        alignment=1,  # center
+        spaceAfter=20,
+        leading=26
+    )
+    elements.append(Paragraph(f"📄 Patient Diagnostic Report", title_style))
+
+    # Meta info: patient ID, report time
+    elements.append(Paragraph(f"<b>Patient ID:</b> {patient_id}", styles["Normal"]))
+    elements.append(Paragraph(f"<b>Report Time:</b> {report_time}", styles["Normal"]))
+    elements.append(Spacer(1, 12))
+
+    # New therapy info section
+    therapy_info = f"""
+        <b>Therapy Start:</b> {fmt_dt(therapy_start)}<br/>
+        <b>Therapy End:</b> {fmt_dt(therapy_end)}<br/>
+        <b>Duration:</b> {fmt_td(duration)}<br/>
+        <b>Pause Duration:</b> {fmt_td(pause_duration)}
+    """
+    elements.append(Paragraph(therapy_info, styles["Normal"]))
+    elements.append(Spacer(1, 12))
+
+    # Table with observations (with formatted times)
+    data = [["Time", "Code", "Value", "Status"]]
+    for obs in observations:
+        try:
+            dt = datetime.fromisoformat(obs["time"].replace("Z", "+00:00"))
+            readable_time = dt.strftime("%d %b %Y, %H:%M:%S")
+        except Exception:
+            readable_time = obs["time"]
+
+        data.append([
+            readable_time,
+            obs["code"],
+            str(obs["value"]),
+            obs["status"]
+        ])
+
+    if observations:
+        table = Table(data, repeatRows=1, hAlign='LEFT')
+        table.setStyle(TableStyle([
+            ('BACKGROUND', (0, 0), (-1, 0), colors.HexColor("#007bff")),
+            ('TEXTCOLOR', (0, 0), (-1, 0), colors.white),
+            ('ALIGN', (0, 0), (-1, -1), 'CENTER'),
+            ('FONTNAME', (0, 0), (-1, 0), 'Helvetica-Bold'),
+            ('FONTSIZE', (0, 0), (-1, -1), 10),
+            ('BOTTOMPADDING', (0, 0), (-1, 0), 8),
+            ('GRID', (0, 0), (-1, -1), 0.25, colors.grey),
+        ]))
+        elements.append(table)
+    else:
+        elements.append(Paragraph("No observations found for the latest report.", styles["Normal"]))
+
+    elements.append(Spacer(1, 20))
+    footer = datetime.now().strftime("Generated on %Y-%m-%d at %H:%M:%S")
+    footer_style = ParagraphStyle("footer", fontSize=8, alignment=2, textColor=colors.grey)
+    elements.append(Paragraph(footer, footer_style))
+
+    doc.build(elements)
+
+    return buffer.getvalue()
@@ -0,0 +1,137 @@
+import json
+import os
+import time
+
+BUFFER_DIR = "device_buffer"
+BUFFER_MAX_BYTES = 50 * 1024 * 1024
+BUFFER_MAX_AGE = 24 * 3600
+SEGMENT_BYTES = 256 * 1024
+COUNTER_FILE = "last_segment"
+
+
+class SegmentBuffer:
+    """On-disk store of messages a device could not send, oldest first.
+
+    Messages (JSON strings) are appended as lines to numbered segment files
+    in `directory`. A segment is closed once it reaches `segment_bytes`, and
+    closed segments are uploaded and removed one at a time. The buffer holds
+    at most `max_bytes`: beyond that, and for segments whose newest message
+    is older than `max_age` seconds, whole segments are dropped, oldest
+    first. Segments are numbered from a counter saved in the directory
+    (`COUNTER_FILE`), so numbers keep growing across restarts and do not
+    depend on the device clock.
+    """
+
+    def __init__(self, directory=BUFFER_DIR, max_bytes=BUFFER_MAX_BYTES,
+                 max_age=BUFFER_MAX_AGE, segment_bytes=SEGMENT_BYTES):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.max_age = max_age
+        self.segment_bytes = segment_bytes
+        os.makedirs(directory, exist_ok=True)
+        self.sizes = {}
+        for name in os.listdir(directory):
+            if name.endswith(".seg"):
+                self.sizes[int(name[:-4])] = os.path.getsize(os.path.join(directory, name))
+        self.last = max(self._read_counter(), max(self.sizes, default=0))
+        self.current = None
+        self.file = None
+        self.dropped = 0
+
+    def __len__(self):
+        return len(self.sizes)
+
+    def path(self, number):
+        return os.path.join(self.directory, f"{number:016d}.seg")
+
+    def append(self, message):
+        if self.file is None:
+            self.last += 1
+            self._write_counter()
+            self.current = self.last
+            self.file = open(self.path(self.current), "a", encoding="utf-8")
+            self.sizes[self.current] = 0
+        line = message + "\n"
+        self.file.write(line)
+        self.file.flush()
+        self.sizes[self.current] += len(line.encode())
+        if self.sizes[self.current] >= self.segment_bytes:
+            self.seal()
+        self._enforce_limits()
+
+    def seal(self):
+        """Close the segment being written so it can be uploaded."""
+        if self.file is not None:
+            os.fsync(self.file.fileno())
+            self.file.close()
+            self.file = None
+            self.current = None
+
+    def oldest(self):
+        """(number, list of JSON lines) of the oldest closed segment, or None.
+
+        Lines that are not valid JSON, such as a last line cut off by a
+        crash mid-append, are skipped so they cannot spoil the rest.
+        """
+        self._enforce_limits()
+        closed = [n for n in self.sizes if n != self.current]
+        if not closed:
+            return None
+        number = min(closed)
+        lines = []
+        with open(self.path(number), encoding="utf-8", errors="replace") as f:
+            for line in f:
+                line = line.rstrip("\n")
+                if not line.strip():
+                    continue
+                try:
+                    json.loads(line)
+                except ValueError:
+                    print(f"[BUFFER] Skipping unreadable line in segment {number}: {line[:80]!r}")
+                    continue
+                lines.append(line)
+        return number, lines
+
+    def set_aside(self, number):
+        """Keep a segment the server refused as `<number>.seg.rejected`
+        instead of deleting it, and stop uploading it."""
+        self.sizes.pop(number, None)
+        try:
+            os.replace(self.path(number), self.path(number) + ".rejected")
+        except FileNotFoundError:
+            pass
+
+    def remove(self, number):
+        self.sizes.pop(number, None)
+        try:
+            os.remove(self.path(number))
+        except FileNotFoundError:
+            pass
+
+    def _read_counter(self):
+        try:
+            with open(os.path.join(self.directory, COUNTER_FILE), encoding="utf-8") as f:
+                return int(f.read().strip() or 0)
+        except (FileNotFoundError, ValueError):
+            return 0
+
+    def _write_counter(self):
+        # Replaced atomically, so a crash leaves the old or the new number
+        path = os.path.join(self.directory, COUNTER_FILE)
+        with open(path + ".tmp", "w", encoding="utf-8") as f:
+            f.write(str(self.last))
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(path + ".tmp", path)
+
+    def _enforce_limits(self):
+        cutoff = time.time() - self.max_age
+        for number in sorted(self.sizes):
+            if number == self.current:
+                break
+            too_big = sum(self.sizes.values()) > self.max_bytes
+            if not too_big and os.path.getmtime(self.path(number)) >= cutoff:
+                break
+            print(f"[BUFFER] Dropping segment {number} ({'over size limit' if too_big else 'too old'})")
+            self.dropped += 1
+            self.remove(number)
@@ -1,37 +1,85 @@
 import asyncio
+import os
+import sys
 from datetime import datetime, timezone
+import random
+import time
 import uuid
+import zlib
 import websockets
 import json
-import requests
-from typing import Optional
 
-FHIR_URL = "http://localhost:8080/fhir"
-HEADERS = {
-    "Content-Type": "application/fhir+json; charset=UTF-8",
-    "Accept": "application/fhir+json"
-}
-
-registered_id = []
-
-observations = []
-device_errors = []
-device_warnings = []
-pressure_values = [] 
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from common import fhir_resources
+from common.fhir_client import FhirClient
+from common.metrics import REGISTRY, CONTENT_TYPE
+from common.tracing import format_instant, log_stage, parse_instant, trace_fields
+from therapy_session import SessionTable, RecentMessageIds
+from device_registry import DeviceRegistry, REGISTRY_PATH
+from fhir_writer import FhirWriter, BundleBatcher, FhirError, is_retryable, FHIR_CONCURRENCY, FHIR_QUEUE_SIZE, BATCH_SIZE, BATCH_MAX_DELAY
+from write_ahead_log import WriteAheadLog, WAL_PATH, WAL_COMMIT_INTERVAL
+from observer_notifier import ObserverNotifier, OBSERVER_URL, NOTIFY_INTERVAL
+
+FHIR_URL = os.environ.get("FHIR_URL", "http://localhost:8080/fhir")
+WS_PORT = int(os.environ.get("WS_PORT", 6789))
+METRICS_PORT = int(os.environ.get("METRICS_PORT", 9100))
+METRICS_READ_TIMEOUT = 5
+
+fhir = FhirClient(FHIR_URL, pool_size=FHIR_CONCURRENCY)
+writer = FhirWriter(concurrency=FHIR_CONCURRENCY, queue_size=FHIR_QUEUE_SIZE)
+batcher = BundleBatcher(writer, fhir, batch_size=BATCH_SIZE, max_delay=BATCH_MAX_DELAY)
+pending_writes: dict[str, set[asyncio.Task]] = {}
+
+wal = WriteAheadLog(WAL_PATH, commit_interval=WAL_COMMIT_INTERVAL)
+DRAIN_BATCH = 500
+DRAIN_MAX_IN_FLIGHT = 2000
+drain_slots = asyncio.Semaphore(DRAIN_MAX_IN_FLIGHT)
+RETRY_BASE_DELAY = 0.5
+RETRY_MAX_DELAY = 30
+WAL_STATS_INTERVAL = 10
+FHIR_STATS_INTERVAL = 60
+
+MESSAGE_ID_SYSTEM = "urn:ietf:rfc:3986"
+# Report identifiers are derived from the "ended" message id in this namespace
+REPORT_ID_NAMESPACE = uuid.UUID("6f1c2d1e-8a4b-4c3e-9f0a-2b7d5e6c8a91")
+
+BACKFILL_MAX_BYTES = 16 * 1024 * 1024
+BACKFILL_MAX_WAL_DEPTH = 50000
+BACKFILL_RETRY_AFTER = 5
+BACKFILL_CONCURRENCY = 2
+backfill_slots = asyncio.Semaphore(BACKFILL_CONCURRENCY)
+backfill_acked: dict[str, int] = {}
+
+notifier = ObserverNotifier(os.environ.get("OBSERVER_URL", OBSERVER_URL) or None, interval=NOTIFY_INTERVAL)
+
+registry = DeviceRegistry(REGISTRY_PATH)
+registrations: dict[str, asyncio.Task] = {}
+WARM_START_PAGE_SIZE = 1000
+
+sessions = SessionTable()
+SEEN_MESSAGE_IDS = 256
+recent_messages = RecentMessageIds(SEEN_MESSAGE_IDS)
+connected_devices = set()
 
-therapy_start_time: Optional[datetime] = None
-therapy_end_time: Optional[datetime] = None
-pause_periods: list[tuple[datetime, datetime]] = []
-current_pause_start: Optional[datetime] = None
+MESSAGES_RECEIVED = REGISTRY.counter("ingest_messages_received_total", "Device messages received", ["type"])
+BACKFILL_MESSAGES = REGISTRY.counter("ingest_backfill_messages_total", "Buffered device messages accepted in backfill batches")
+BACKFILL_BATCHES = REGISTRY.counter("ingest_backfill_batches_total", "Backfill batches by outcome", ["result"])
+REPORT_SECONDS = REGISTRY.histogram("ingest_report_duration_seconds",
+                                    "Time to flush a finished session and store its DiagnosticReport",
+                                    buckets=(0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120))
+REGISTRY.callback("ingest_devices_connected", "Connected device websockets", lambda: len(connected_devices))
+REGISTRY.callback("ingest_wal_depth", "Records in the write-ahead log not yet stored in FHIR", lambda: wal.depth)
+REGISTRY.callback("ingest_fhir_queue_depth", "FHIR requests waiting for a writer", lambda: writer.stats()["queued"])
+REGISTRY.callback("ingest_fhir_in_flight", "FHIR requests being sent", lambda: writer.in_flight)
+REGISTRY.callback("ingest_bundle_pending", "Resources waiting for the next transaction Bundle", lambda: len(batcher.pending))
+REGISTRY.callback("ingest_observer_events_pending", "Events waiting to be sent to the observer", lambda: len(notifier.pending))
 
 def get_precise_time():
     return datetime.utcnow().replace(tzinfo=timezone.utc).isoformat(timespec='milliseconds')
 
-def ensure_resources(patient_id):
-    patient_url = f"{FHIR_URL}/Patient/{patient_id}"
-    device_url = f"{FHIR_URL}/Device/{patient_id}"
-
-    patient = {
+def build_patient(patient_id):
+    return {
         "resourceType": "Patient",
         "id": patient_id,
         "name": [{
@@ -40,129 +88,100 @@ def ensure_resources(patient_id):
         }]
     }
 
-    print(f"\nCreating/Updating Patient:\n{json.dumps(patient, indent=2)}")
-    response = requests.put(patient_url, json=patient, headers=HEADERS)
-    print(f"[{patient_id}] Patient PUT → {response.status_code}")
-    if response.status_code >= 400:
-        print(f"[{patient_id}] Patient PUT error:\n{response.text}")
-
-    device_check = requests.get(device_url, headers=HEADERS)
-    if device_check.status_code == 404:
-        device = {
-            "resourceType": "Device",
-            "id": patient_id,
-            "status": "active",
-            "manufacturer": "Simulated Device Inc.",
-            "deviceName": [{
-                "name": f"Test Device {patient_id}",
-                "type": "manufacturer-name"
-            }],
-            "patient": {
-                "reference": f"Patient/{patient_id}"
-            }
-        }
-
-        print(f"\nCreating Device:\n{json.dumps(device, indent=2)}")
-        response = requests.put(device_url, json=device, headers=HEADERS)
-        print(f"[{patient_id}] Created Device → {response.status_code}")
-        if response.status_code >= 400:
-            print(f"[{patient_id}] Device PUT error:\n{response.text}")
-    else:
-        print(f"[{patient_id}] Device already exists or error → {device_check.status_code}")
-
-def build_observation(data):
-    device_id = data["device_id"]
-    value = data["value"]
-    patient_id = device_id
-    now = datetime.now(timezone.utc).isoformat(timespec='milliseconds')
-    observation_id = str(uuid.uuid4())
-
-    observation = {
-        "resourceType": "Observation",
-        "id": observation_id,
-        "status": "final",
-        "category": [{
-            "coding": [{
-                "system": "http://terminology.hl7.org/CodeSystem/observation-category",
-                "code": "vital-signs",
-                "display": "Vital Signs"
-            }]
+def build_device(patient_id):
+    return {
+        "resourceType": "Device",
+        "id": patient_id,
+        "status": "active",
+        "manufacturer": "Simulated Device Inc.",
+        "deviceName": [{
+            "name": f"Test Device {patient_id}",
+            "type": "manufacturer-name"
         }],
-        "code": {
-            "coding": [{
-                "system": "http://loinc.org",
-                "code": "31209-0",
-                "display": "Pressure in wound therapy device"
-            }],
-            "text": "Wound pressure"
-        },
-        "subject": {
+        "patient": {
             "reference": f"Patient/{patient_id}"
-        },
-        "effectiveDateTime": now,
-        "valueQuantity": {
-            "value": value,
-            "unit": "mmHg",
-            "system": "http://unitsofmeasure.org",
-            "code": "mm[Hg]"
         }
     }
 
-    pressure_values.append(value)
+async def ensure_resources(patient_id):
+    # Patient and Device go into the shared transaction Bundle, so a burst of
+    # new devices costs a few transactions rather than 3 requests each.
+    print(f"[{patient_id}] Creating/Updating Patient and Device")
+    patient = await batcher.add(build_patient(patient_id), method="PUT", url=f"Patient/{patient_id}")
+    device = await batcher.add(build_device(patient_id), method="PUT", url=f"Device/{patient_id}")
+    await asyncio.gather(patient, device)
+    print(f"[{patient_id}] Registered Patient and Device")
+
+def fetch_registered_devices():
+    """Page through every Device on the server and return their ids."""
+    device_ids = []
+    url = f"Device?_count={WARM_START_PAGE_SIZE}&_elements=id"
+    while url:
+        response = fhir.get(url)
+        if response.status_code >= 400:
+            raise FhirError(response.status_code, response.text)
+        bundle = response.json()
+        device_ids.extend(entry["resource"]["id"] for entry in bundle.get("entry", []))
+        url = next((link["url"] for link in bundle.get("link", []) if link.get("relation") == "next"), None)
+    return device_ids
 
-    return observation
+async def warm_start_registry():
+    try:
+        device_ids = await writer.run(fetch_registered_devices)
+    except Exception as e:
+        print(f"[REGISTRY] Warm start from FHIR failed, using local registry only: {e}")
+        return
+    added = registry.update(device_ids)
+    print(f"[REGISTRY] {len(device_ids)} devices on FHIR server, {added} new")
 
-def build_error(data):
+def build_observation(data, received_at):
     device_id = data["device_id"]
-    message = data["message"]
-
-    if data["severity"] == "warning":
-        code = "69758-7"
-        display = "Device warning message"
-    elif data["severity"] == "error":
-        code = "70325-2"
-        display = "Device connectivity status"
-
-    now = datetime.now(timezone.utc).isoformat(timespec='milliseconds')
-    
-    error = {
-        "resourceType": "Observation",
-        "id": str(uuid.uuid4()),
-        "status": "final",
-        "category": [{
-            "coding": [{
-                "system": "http://terminology.hl7.org/CodeSystem/observation-category",
-                "code": "device",
-                "display": "Device"
-            }]
-        }],
-        "code": {
-            "coding": [{
-                "system": "http://loinc.org",
-                "code": code,
-                "display": display
-            }],
-            "text": f"Device {data["severity"]}"
-        },
-        "subject": {
-            "reference": f"Patient/{device_id}"
-        },
-        "effectiveDateTime": now,
-        "valueString": message
-    }
-    return error
+    now = received_at.isoformat(timespec='milliseconds')
+    return fhir_resources.WOUND_PRESSURE.build(f"Patient/{device_id}", data["value"], now)
 
-def create_diagnostic_report(data):
-    global therapy_start_time, therapy_end_time, pause_periods, current_pause_start
+ISSUE_TEMPLATES = {
+    "warning": fhir_resources.DEVICE_WARNING,
+    "error": fhir_resources.DEVICE_ERROR,
+}
 
+def build_error(data, received_at):
     device_id = data["device_id"]
+    now = received_at.isoformat(timespec='milliseconds')
+    return ISSUE_TEMPLATES[data["severity"]].build(f"Patient/{device_id}", data["message"], now)
+
+def validate_message(data):
+    """Why `data` cannot be stored as an Observation, or None if it can."""
+    if not isinstance(data, dict):
+        return "message must be a JSON object"
+    if not isinstance(data.get("device_id"), str) or not data["device_id"]:
+        return "device_id must be a non-empty string"
+    for field in ("msg_id", "correlation_id", "mode", "status", "sent_at"):
+        if field in data and not isinstance(data[field], str):
+            return f"{field} must be a string"
+    if data.get("error", False):
+        if data.get("severity") not in ISSUE_TEMPLATES:
+            return f"severity must be one of {', '.join(ISSUE_TEMPLATES)}"
+        if not isinstance(data.get("message"), str):
+            return "message must be a string"
+    elif not isinstance(data.get("value"), (int, float)) or isinstance(data["value"], bool):
+        return "value must be a number"
+    return None
+
+def create_diagnostic_report(session, ended_msg_id):
+    device_id = session.device_id
+    observations = session.observations
+    device_errors = session.device_errors
+    device_warnings = session.device_warnings
 
     if not observations and not device_errors:
         print("[INFO] No observations to include in report.")
-        return
+        return None
 
     report_id = str(uuid.uuid4())
     now_str = get_precise_time()
+    # The same "ended" message always yields the same identifier, so a
+    # retried or replayed report is created once
+    identifier = f"urn:uuid:{uuid.uuid5(REPORT_ID_NAMESPACE, ended_msg_id)}"
 
     all_results = (
         [{"reference": f"Observation/{oid}"} for oid in observations] +
@@ -170,18 +189,13 @@ def create_diagnostic_report(data):
         [{"reference": f"Observation/{oid}"} for oid in device_warnings] 
     )
 
-    if therapy_start_time and therapy_end_time:
-        duration_sec = (therapy_end_time - therapy_start_time).total_seconds()
-    else:
-        duration_sec = 0
-
-    pause_total = sum(
-        (end - start).total_seconds() for start, end in pause_periods
-    )
+    duration_sec = session.duration_seconds()
+    pause_total = session.pause_seconds()
 
     report = {
         "resourceType": "DiagnosticReport",
         "id": report_id,
+        "identifier": [{"system": MESSAGE_ID_SYSTEM, "value": identifier}],
         "status": "final",
         "code": {
             "coding": [{
@@ -201,115 +215,361 @@ def create_diagnostic_report(data):
             f"Report contains {len(observations)} observations and "
             f"{len(device_errors)} device errors and {len(device_warnings)} warnings.\n"
             f"Total duration: {duration_sec:.1f} seconds.\n"
-            f"Total pause time: {pause_total:.1f} seconds."
+            f"Total pause time: {pause_total:.1f} seconds.\n"
+            f"{session.pressure_stats.summary()}"
         )}
 
-    response = requests.post(f"{FHIR_URL}/DiagnosticReport", json=report)
-    print(f"[REPORT] DiagnosticReport submitted ({len(observations)} observations) -> {response.status_code}")
-    if response.status_code != 201:
+    return report
+
+def post_diagnostic_report(report):
+    # Conditional create: HAPI answers 200 with the existing report if this
+    # one was already stored, so the POST is safe to retry
+    identifier = report["identifier"][0]
+    response = fhir.post("DiagnosticReport", resource=report, idempotent=True,
+                         headers={"If-None-Exist": f"identifier={identifier['system']}|{identifier['value']}"})
+    print(f"[REPORT] DiagnosticReport submitted ({len(report['result'])} results) -> {response.status_code}")
+    if response.status_code not in (200, 201):
         print("Response content:")
         print(response.text) 
-    observations.clear()
-    device_errors.clear()
-    pressure_values.clear()
-    
-    therapy_start_time = None
-    therapy_end_time = None
-    pause_periods.clear()
-    current_pause_start = None
+    if response.status_code >= 400:
+        raise FhirError(response.status_code, response.text)
+    return response
+
+def record_observation_id(session, data, obs_id):
+    print(f"→ FHIR Observation/{obs_id}")
+    if data.get("error", False):
+        if data["severity"] == "warning":
+            session.device_warnings.append(obs_id)
+        elif data["severity"] == "error":
+            session.device_errors.append(obs_id)
+    else:
+        session.observations.append(obs_id)
 
-connected_devices = set()
+def sent_instant(data):
+    # The device's send time, normalized so HAPI accepts it as an instant
+    sent = parse_instant(data.get("sent_at"))
+    return format_instant(sent) if sent is not None else None
+
+def notify_observation(patient_id, data, obs):
+    trace = {"correlation_id": data["correlation_id"], "sent": sent_instant(data), "received": obs["effectiveDateTime"]}
+    if data.get("error", False):
+        notifier.notify(patient_id, data["severity"], message=obs["valueString"], time=obs["effectiveDateTime"], trace=trace)
+    else:
+        notifier.notify(patient_id, "reading", value=obs["valueQuantity"]["value"],
+                        time=obs["effectiveDateTime"], status=data.get("status", "unknown"), trace=trace)
+
+async def with_retry(description, fn, *args):
+    """Call `fn` until it succeeds, backing off while FHIR is unavailable."""
+    delay = RETRY_BASE_DELAY
+    while True:
+        try:
+            return await fn(*args)
+        except Exception as e:
+            if not is_retryable(e):
+                raise
+            wait = random.uniform(delay / 2, delay)
+            print(f"[RETRY] {description} failed ({e}), retrying in {wait:.1f}s")
+            await asyncio.sleep(wait)
+            delay = min(delay * 2, RETRY_MAX_DELAY)
+
+async def write_observation(obs):
+    identifier = obs["identifier"][0]
+    future = await batcher.add(obs, if_none_exist=f"identifier={identifier['system']}|{identifier['value']}")
+    return await future
+
+async def ensure_registered(device_id):
+    if device_id in registry:
+        return
+    task = registrations.get(device_id)
+    if task is None:
+        task = asyncio.ensure_future(with_retry(f"Registration of {device_id}", ensure_resources, device_id))
+        registrations[device_id] = task
+
+        def done(t):
+            registrations.pop(device_id, None)
+            if not t.cancelled() and t.exception() is None:
+                registry.add(device_id)
+                notifier.notify(device_id, "patient")
+        task.add_done_callback(done)
+    await asyncio.shield(task)
+
+async def finish_therapy(session, pending, ended_msg_id):
+    started = time.perf_counter()
+    await batcher.flush()
+    if pending:
+        await asyncio.gather(*pending, return_exceptions=True)
+
+    report = create_diagnostic_report(session, ended_msg_id)
+    if report is not None:
+        response = await with_retry("DiagnosticReport", writer.run, post_diagnostic_report, report)
+        details = {}
+        parts = response.headers.get("Location", "").split("/")
+        if "DiagnosticReport" in parts:
+            idx = parts.index("DiagnosticReport")
+            details["report_id"] = parts[idx + 1]
+            if "_history" in parts:
+                details["version"] = parts[parts.index("_history") + 1]
+        notifier.notify(session.device_id, "report", issued=report["issued"], text=report["conclusion"], **details)
+        REPORT_SECONDS.observe(time.perf_counter() - started)
+
+async def forward_record(seq, session, data, obs, ended_pending):
+    device_id = session.device_id
+    try:
+        await ensure_registered(device_id)
+        obs_id = await with_retry(f"Observation from {device_id}", write_observation, obs)
+        log_stage(data["correlation_id"], stored=time.time())
+        record_observation_id(session, data, obs_id)
+        notify_observation(device_id, data, obs)
+        if ended_pending is not None:
+            print(f"[INFO] Therapy ended. Generating report for {device_id}.")
+            await finish_therapy(session, ended_pending, data["msg_id"])
+    except Exception as e:
+        print(f"[WAL] Dropping record {seq} from {device_id}: {e}")
+    wal.ack(seq)
+
+def accept_record(seq, observed_at, data):
+    """Apply one logged message to its session and start forwarding it to FHIR.
+
+    Runs in log order, so session state always sees a device's messages in
+    the order they arrived, even when the FHIR writes finish out of order.
+    Raises ValueError for a record that can never become an Observation.
+    """
+    problem = validate_message(data)
+    if problem:
+        raise ValueError(problem)
+    device_id = data.get("device_id")
+    mode = data.get("mode", "unknown")
+    status = data.get("status", "unknown")
+
+    now = datetime.fromtimestamp(observed_at, timezone.utc)
+    session = sessions.get(device_id)
+    session.update_status(status, now)
+
+    if data.get("error", False):
+        obs = build_error(data, now)
+    else:
+        obs = build_observation(data, now)
+        session.pressure_stats.add(data["value"], observed_at)
+
+    # Replayed records count as seen, so a device resending one after a
+    # restart is not logged again
+    recent_messages.add(device_id, data["msg_id"])
+    # Records logged before tracing existed have no correlation id
+    data.setdefault("correlation_id", data["msg_id"])
+    correlation, trace = trace_fields(data["correlation_id"], sent_instant(data), obs["effectiveDateTime"])
+    # The message id stays first: conditional creates match on it
+    obs["identifier"] = [{"system": MESSAGE_ID_SYSTEM, "value": f"urn:uuid:{data['msg_id']}"}, correlation]
+    obs["extension"] = [trace]
+    obs["component"] = fhir_resources.device_state_components(mode, status)
+
+    ended_pending = None
+    if status == "ended":
+        sessions.close(device_id)
+        ended_pending = pending_writes.pop(device_id, set())
+
+    task = asyncio.ensure_future(forward_record(seq, session, data, obs, ended_pending))
+    if ended_pending is None:
+        pending = pending_writes.setdefault(device_id, set())
+        pending.add(task)
+        task.add_done_callback(pending.discard)
+    return task
+
+async def drain_wal():
+    after_seq = 0
+    while True:
+        rows = await wal.read_batch(after_seq, DRAIN_BATCH)
+        if not rows:
+            await wal.wait_for_data()
+            continue
+        for seq, observed_at, data in rows:
+            # Bounded so an outage leaves the backlog on disk, not in memory.
+            await drain_slots.acquire()
+            after_seq = seq
+            try:
+                task = accept_record(seq, observed_at, data)
+            except Exception as e:
+                # Acked so it is not replayed on every restart; the payload
+                # stays in the log output.
+                print(f"[WAL] Dropping invalid record {seq}: {e}: {json.dumps(data)}")
+                drain_slots.release()
+                wal.ack(seq)
+                continue
+            task.add_done_callback(lambda _: drain_slots.release())
+
+async def report_wal_stats():
+    while True:
+        await asyncio.sleep(WAL_STATS_INTERVAL)
+        stats = await wal.stats()
+        if stats["depth"]:
+            print(f"[WAL] depth={stats['depth']} lag={stats['lag_seconds']:.1f}s")
+
+async def report_fhir_stats():
+    while True:
+        await asyncio.sleep(FHIR_STATS_INTERVAL)
+        for call, stats in fhir.stats().items():
+            print(f"[FHIR] {call}: {stats['calls']} calls, {stats['errors']} errors, {stats['retries']} retries, "
+                  f"mean {stats['mean_ms']:.1f} ms, max {stats['max_ms']:.1f} ms")
+
+def message_type(data):
+    if data.get("error", False):
+        return data.get("severity", "error")
+    if data.get("status", "running") != "running":
+        return "status"
+    return "reading"
+
+def decode_backfill(frame):
+    decompressor = zlib.decompressobj()
+    data = decompressor.decompress(frame, BACKFILL_MAX_BYTES)
+    if decompressor.unconsumed_tail:
+        raise ValueError(f"larger than {BACKFILL_MAX_BYTES} bytes")
+    batch = json.loads(data)
+    number, messages = int(batch["batch"]), batch["messages"]
+    if not all(isinstance(message, dict) for message in messages):
+        raise ValueError("messages must be objects")
+    return number, messages
+
+async def accept_backfill(frame):
+    """Log a zlib-compressed batch of messages a device buffered while offline.
+
+    Returns the reply for the device: an ack once every message is durable
+    in the WAL, or `retry_after` while the log is backed up, so devices
+    coming back online cannot crowd out live messages. Messages keep the
+    time the device recorded them.
+    """
+    if wal.depth > BACKFILL_MAX_WAL_DEPTH:
+        BACKFILL_BATCHES.labels("deferred").inc()
+        return {"retry_after": BACKFILL_RETRY_AFTER}
+    async with backfill_slots:
+        try:
+            # Off the event loop, so live messages keep flowing meanwhile
+            number, messages = await asyncio.to_thread(decode_backfill, frame)
+        except (ValueError, KeyError, TypeError, zlib.error) as e:
+            BACKFILL_BATCHES.labels("rejected").inc()
+            return {"error": f"Invalid backfill batch: {e}"}
+
+        device_id = messages[0].get("device_id") if messages else None
+        # A device resends only the segment whose ack it lost, so only the
+        # last acked number is a duplicate. Lower numbers are new, e.g. from
+        # a device whose buffer directory was reset.
+        if number == backfill_acked.get(device_id):
+            BACKFILL_BATCHES.labels("duplicate").inc()
+            return {"ack": number, "accepted": 0}
+
+        now = time.time()
+        records = []
+        rejected = repeats = 0
+        for data in messages:
+            problem = validate_message(data)
+            if problem:
+                print(f"[BACKFILL] Skipping invalid message from {device_id}: {problem}")
+                rejected += 1
+                continue
+            if "msg_id" in data and recent_messages.seen(data["device_id"], data["msg_id"]):
+                repeats += 1
+                continue
+            data.setdefault("msg_id", str(uuid.uuid4()))
+            data.setdefault("correlation_id", data["msg_id"])
+            recent_messages.add(data["device_id"], data["msg_id"])
+            records.append((parse_instant(data.get("sent_at")) or now, data))
+        try:
+            # Received now, so the WAL lag does not count the time offline
+            await asyncio.gather(*(wal.append(now, data, observed_at) for observed_at, data in records))
+        except Exception:
+            # Not acked, so the device resends the batch; it must not count as seen
+            for _, data in records:
+                recent_messages.discard(data["device_id"], data["msg_id"])
+            raise
+        backfill_acked[device_id] = number
+
+    BACKFILL_BATCHES.labels("accepted").inc()
+    BACKFILL_MESSAGES.inc(len(records))
+    print(f"[BACKFILL] Logged {len(records)} buffered messages from {device_id} (batch {number})")
+    return {"ack": number, "accepted": len(records), "rejected": rejected, "repeats": repeats}
+
+async def read_request_line(reader):
+    request_line = await reader.readline()
+    while await reader.readline() not in (b"\r\n", b"\n", b""):
+        pass
+    return request_line
+
+async def serve_metrics(reader, stream):
+    # Just enough HTTP for a Prometheus scrape of GET /metrics
+    try:
+        # A client that never finishes its request must not hold the socket open
+        request_line = await asyncio.wait_for(read_request_line(reader), METRICS_READ_TIMEOUT)
+        parts = request_line.split()
+        if len(parts) >= 2 and parts[1].split(b"?")[0] == b"/metrics":
+            status, content_type, body = "200 OK", CONTENT_TYPE, REGISTRY.render().encode()
+        else:
+            status, content_type, body = "404 Not Found", "text/plain", b"Not found\n"
+        stream.write(f"HTTP/1.1 {status}\r\nContent-Type: {content_type}\r\n"
+                     f"Content-Length: {len(body)}\r\nConnection: close\r\n\r\n".encode() + body)
+        await stream.drain()
+    except (ConnectionError, asyncio.TimeoutError, ValueError):
+        # ValueError: a header line longer than the stream's limit
+        pass
+    finally:
+        stream.close()
+
+async def send_reply(ws, reply):
+    try:
+        await ws.send(json.dumps(reply))
+    except websockets.ConnectionClosed:
+        # Still read what the device sent before closing
+        pass
 
 async def register(ws):
 
     connected_devices.add(ws)
     try:
         async for message in ws:
-            data = json.loads(message)
-            device_id = data.get("device_id")
-            mode = data.get("mode", "unknown")
-            status = data.get("status", "unknown")
-
-            now = datetime.now(timezone.utc)
-            global therapy_start_time, therapy_end_time, current_pause_start
-
-            if status == "running" and therapy_start_time is None:
-                therapy_start_time = now
-                print(f"[INFO] Therapy started at {therapy_start_time.isoformat()}")
-
-            elif status == "paused" and current_pause_start is None:
-                current_pause_start = now
-                print(f"[INFO] Therapy paused at {current_pause_start.isoformat()}")
-
-            elif status == "running" and current_pause_start is not None:
-                pause_periods.append((current_pause_start, now))
-                print(f"[INFO] Therapy resumed at {now.isoformat()} — pause duration: {(now - current_pause_start)}")
-                current_pause_start = None
-
-            elif status == "ended":
-                therapy_end_time = now
-                if current_pause_start is not None:
-                    pause_periods.append((current_pause_start, therapy_end_time))
-                    current_pause_start = None
-                print(f"[INFO] Therapy ended at {therapy_end_time.isoformat()}")
+            if isinstance(message, bytes):
+                # A batch the device buffered while it could not reach us
+                await ws.send(json.dumps(await accept_backfill(message)))
+                continue
+            received_at = time.time()
+            try:
+                data = json.loads(message)
+            except ValueError as e:
+                data, problem = None, f"invalid JSON: {e}"
+            else:
+                problem = validate_message(data)
+            if problem:
+                # Never logged, so one bad message cannot hold up the drain
+                print(f"[INGEST] Rejected message: {problem}")
+                MESSAGES_RECEIVED.labels("invalid").inc()
+                rejection = {"error": f"Invalid message: {problem}"}
+                if isinstance(data, dict) and isinstance(data.get("msg_id"), str):
+                    rejection["msg_id"] = data["msg_id"]
+                await send_reply(ws, rejection)
+                continue
+            device_id = data["device_id"]
+            if "msg_id" in data and recent_messages.seen(device_id, data["msg_id"]):
+                print(f"[INGEST] Dropping repeat of message {data['msg_id']} from {device_id}")
+                MESSAGES_RECEIVED.labels("repeat").inc()
+                # Acked again: the device resent it because the first ack was lost
+                await send_reply(ws, {"ack": data["msg_id"]})
+                continue
+            data.setdefault("msg_id", str(uuid.uuid4()))
+            data.setdefault("correlation_id", data["msg_id"])
+            # Marked before the append, so a resend racing the original on a
+            # new connection is caught too
+            recent_messages.add(device_id, data["msg_id"])
+            MESSAGES_RECEIVED.labels(message_type(data)).inc()
+            log_stage(data["correlation_id"], sent=parse_instant(data.get("sent_at")), received=received_at)
 
             print(f"Received from device {device_id}: {data}")
 
-            if device_id not in registered_id:
-                ensure_resources(device_id)
-                registered_id.append(device_id)
-
-            if data.get("error", False):
-                obs = build_error(data)
-            else:
-                obs = build_observation(data)
-
-            obs["component"] = [
-            {
-                "code": {
-                    "coding": [{
-                        "system": "http://example.org/device-mode",
-                        "code": "mode"
-                    }],
-                    "text": "Device mode"
-                },
-                "valueString": mode
-            },
-            {
-                "code": {
-                    "coding": [{
-                        "system": "http://example.org/device-status",
-                        "code": "status"
-                    }],
-                    "text": "Device status"
-                },
-                "valueString": status
-            }]
-
-            response = requests.post(f"{FHIR_URL}/Observation", json=obs, headers=HEADERS)
-            print(f"→ FHIR status: {response.status_code}")
-            if response.status_code >= 400:
-                print(response.text)
-            if response.status_code == 201:
-                location = response.headers.get("Location")
-                if location:
-                    parts = location.split('/')
-                    if "Observation" in parts:
-                        idx = parts.index("Observation")
-                        obs_id = parts[idx + 1]
-                        if data.get("error", False):
-                            if data["severity"] == "warning":
-                                device_warnings.append(obs_id)
-                            elif data["severity"] == "error":
-                                device_errors.append(obs_id)
-                        else:
-                            observations.append(obs_id)
-                else:
-                    print("Warning: No Location header in response")
-
-            if status == "ended":
-                print(f"[INFO] Therapy ended. Generating report for {device_id}.")
-                create_diagnostic_report(data)
+            # Durable once this returns; drain_wal forwards it to FHIR, so the
+            # socket never waits on HAPI.
+            try:
+                await wal.append(received_at, data)
+            except Exception:
+                recent_messages.discard(device_id, data["msg_id"])
+                raise
+            log_stage(data["correlation_id"], logged=time.time())
+            # The device keeps the message until this arrives
+            await send_reply(ws, {"ack": data["msg_id"]})
 
     finally:
         connected_devices.remove(ws)
@@ -319,8 +579,23 @@ async def handler(ws):
     await register(ws)
 
 async def main():
-    async with websockets.serve(handler, '0.0.0.0', 6789):
-        print("Server running at ws://0.0.0.0:6789")
+    await wal.start()
+    await writer.start()
+    print(f"[REGISTRY] {registry.load()} devices loaded from {registry.path}")
+    background = [
+        asyncio.create_task(drain_wal()),
+        asyncio.create_task(report_wal_stats()),
+        asyncio.create_task(report_fhir_stats()),
+        asyncio.create_task(notifier.run()),
+    ]
+    if METRICS_PORT:
+        await asyncio.start_server(serve_metrics, '0.0.0.0', METRICS_PORT)
+        print(f"Metrics at http://0.0.0.0:{METRICS_PORT}/metrics")
+    async with websockets.serve(handler, '0.0.0.0', WS_PORT):
+        print(f"Server running at ws://0.0.0.0:{WS_PORT} (FHIR concurrency {writer.concurrency})")
+        # Only after listening, so devices can connect while HAPI is slow or
+        # down; ensure_registered covers devices the scan has not reached.
+        background.append(asyncio.create_task(warm_start_registry()))
         await asyncio.Future()
 
 if __name__ == '__main__':
@@ -0,0 +1,108 @@
+from datetime import datetime
+from typing import Optional
+
+from common.session_stats import PressureStats
+
+
+class TherapySession:
+    """State of one device's therapy, from its first message until "ended"."""
+
+    __slots__ = (
+        "device_id",
+        "start_time",
+        "end_time",
+        "current_pause_start",
+        "paused_seconds",
+        "observations",
+        "device_errors",
+        "device_warnings",
+        "pressure_stats",
+    )
+
+    def __init__(self, device_id: str):
+        self.device_id = device_id
+        self.start_time: Optional[datetime] = None
+        self.end_time: Optional[datetime] = None
+        self.current_pause_start: Optional[datetime] = None
+        self.paused_seconds = 0.0
+        self.observations: list[str] = []
+        self.device_errors: list[str] = []
+        self.device_warnings: list[str] = []
+        self.pressure_stats = PressureStats()
+
+    def update_status(self, status: str, now: datetime):
+        if status == "running" and self.start_time is None:
+            self.start_time = now
+            print(f"[{self.device_id}] Therapy started at {now.isoformat()}")
+
+        elif status == "paused" and self.current_pause_start is None:
+            self.current_pause_start = now
+            print(f"[{self.device_id}] Therapy paused at {now.isoformat()}")
+
+        elif status == "running" and self.current_pause_start is not None:
+            self.paused_seconds += (now - self.current_pause_start).total_seconds()
+            print(f"[{self.device_id}] Therapy resumed at {now.isoformat()} — pause duration: {(now - self.current_pause_start)}")
+            self.current_pause_start = None
+
+        elif status == "ended":
+            self.end_time = now
+            if self.current_pause_start is not None:
+                self.paused_seconds += (now - self.current_pause_start).total_seconds()
+                self.current_pause_start = None
+            print(f"[{self.device_id}] Therapy ended at {now.isoformat()}")
+
+    def duration_seconds(self) -> float:
+        if self.start_time and self.end_time:
+            return (self.end_time - self.start_time).total_seconds()
+        return 0
+
+    def pause_seconds(self) -> float:
+        return self.paused_seconds
+
+
+class SessionTable:
+    """Open therapy sessions keyed by device id."""
+
+    def __init__(self):
+        self.sessions: dict[str, TherapySession] = {}
+
+    def get(self, device_id: str) -> TherapySession:
+        session = self.sessions.get(device_id)
+        if session is None:
+            session = self.sessions[device_id] = TherapySession(device_id)
+        return session
+
+    def close(self, device_id: str) -> Optional[TherapySession]:
+        return self.sessions.pop(device_id, None)
+
+    def __len__(self):
+        return len(self.sessions)
+
+    def __contains__(self, device_id):
+        return device_id in self.sessions
+
+
+class RecentMessageIds:
+    """The last `per_device` message ids seen from each device.
+
+    A device resends a message whose send failed when its connection
+    dropped, and the server may already have it. Repeats arrive right
+    after the original, so a short window per device is enough to drop
+    them before they are logged and counted twice.
+    """
+
+    def __init__(self, per_device: int):
+        self.per_device = per_device
+        self.ids: dict[str, dict[str, None]] = {}
+
+    def seen(self, device_id: str, msg_id: str) -> bool:
+        return msg_id in self.ids.get(device_id, ())
+
+    def add(self, device_id: str, msg_id: str):
+        recent = self.ids.setdefault(device_id, {})
+        recent[msg_id] = None
+        if len(recent) > self.per_device:
+            del recent[next(iter(recent))]
+
+    def discard(self, device_id: str, msg_id: str):
+        self.ids.get(device_id, {}).pop(msg_id, None)
@@ -1,11 +1,17 @@
 import json
-import uuid
+import os
+import sys
 import random
-import time
 import asyncio
 import websockets
-import requests
-from datetime import datetime, timezone
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from common import fhir_resources
+from common.fhir_client import FhirClient
+from fhir_writer import FhirWriter, BundleBatcher, FHIR_CONCURRENCY, BATCH_SIZE, BATCH_MAX_DELAY
+from broadcaster import Broadcaster, CLIENT_QUEUE_SIZE, SLOW_CLIENT_POLICY, CLIENT_SEND_TIMEOUT
+from device_scheduler import FixedRateScheduler, DEVICE_PERIOD, DEADLINE_TOLERANCE
 
 # Configuration
 FHIR_URL = "http://localhost:8888/fhir"
@@ -14,41 +20,52 @@ DEVICE_TO_PATIENT = {
     "neg-pressure-device-1": "patient-1",
     "neg-pressure-device-2": "patient-2"
 }
+# `python translator_socket.py <count>` simulates that many devices instead
+if len(sys.argv) > 1:
+    DEVICE_TO_PATIENT = {f"neg-pressure-device-{i}": f"patient-{i}" for i in range(1, int(sys.argv[1]) + 1)}
 DEVICE_IDS = list(DEVICE_TO_PATIENT.keys())
 WS_PORT = 6789
-HEADERS = {
-    "Content-Type": "application/fhir+json; charset=UTF-8",
-    "Accept": "application/fhir+json"
-}
+STATS_INTERVAL = 30
+MAX_PENDING_WRITES = 5000
+
+fhir = FhirClient(FHIR_URL, pool_size=FHIR_CONCURRENCY)
+writer = FhirWriter(concurrency=FHIR_CONCURRENCY)
+batcher = BundleBatcher(writer, fhir, batch_size=BATCH_SIZE, max_delay=BATCH_MAX_DELAY)
+write_slots = asyncio.Semaphore(MAX_PENDING_WRITES)
 
-# Track WebSocket clients
-device_clients = set()
+# WebSocket clients, each with its own bounded outbound queue
+broadcaster = Broadcaster(queue_size=CLIENT_QUEUE_SIZE, policy=SLOW_CLIENT_POLICY, send_timeout=CLIENT_SEND_TIMEOUT)
 
 async def register(ws):
-    device_clients.add(ws)
-    try:
-        await ws.wait_closed()
-    finally:
-        device_clients.remove(ws)
+    await broadcaster.serve(ws)
 
-async def notify_all(message: str):
-    if device_clients:
-        await asyncio.gather(*(client.send(message) for client in device_clients))
+def notify_subscribers(did: str, message: str):
+    broadcaster.broadcast(message, (f"device:{did}", f"patient:{DEVICE_TO_PATIENT[did]}"))
+
+async def report_stats():
+    while True:
+        await asyncio.sleep(STATS_INTERVAL)
+        stats = broadcaster.stats()
+        if stats["clients"] or stats["disconnected_slow"]:
+            print(f"[WS] {stats['clients']} clients, {stats['queued']} queued, {stats['dropped']} dropped, "
+                  f"{stats['disconnected_slow']} slow disconnects, max lag {stats['max_lag_seconds'] * 1000:.0f} ms")
+        stats = scheduler.stats()
+        print(f"[SCHED] {len(DEVICE_IDS)} devices, {stats['ticks']} ticks, {stats['missed']} missed deadlines, "
+              f"{stats['skipped']} skipped, max lateness {stats['max_lateness_seconds'] * 1000:.0f} ms")
 
 # Ensure FHIR Patient & Device
 
-def ensure_resources():
-    # Create Patients
+async def ensure_resources():
+    # PUTs go through the transaction batcher, so thousands of devices cost
+    # a few Bundles instead of two requests each
+    writes = []
     for pid in set(DEVICE_TO_PATIENT.values()):
         patient = {
             "resourceType": "Patient",
             "id": pid,
             "name": [{"given": ["Test"], "family": "User"}]
         }
-        r = requests.put(
-            f"{FHIR_URL}/Patient/{pid}", json=patient, headers=HEADERS
-        )
-        print(f"Ensure Patient {pid} → {r.status_code}")
+        writes.append(await batcher.add(patient, method="PUT", url=f"Patient/{pid}"))
 
     # Create Devices
     for did, pid in DEVICE_TO_PATIENT.items():
@@ -63,88 +80,66 @@ def ensure_resources():
             }]},
             "owner": {"reference": f"Patient/{pid}"},
             "manufacturer": "Acme Medical",
-            "deviceName": [{"name": f"Pump {did[-1]}", "type": "user-friendly-name"}]
+            "deviceName": [{"name": f"Pump {did.rsplit('-', 1)[-1]}", "type": "user-friendly-name"}]
         }
-        r = requests.put(
-            f"{FHIR_URL}/Device/{did}", json=device, headers=HEADERS
-        )
-        print(f"Ensure Device {did} → {r.status_code}")
+        writes.append(await batcher.add(device, method="PUT", url=f"Device/{did}"))
+
+    await batcher.flush()
+    results = await asyncio.gather(*writes, return_exceptions=True)
+    failed = [r for r in results if isinstance(r, BaseException)]
+    print(f"Ensured {len(results) - len(failed)} Patients/Devices, {len(failed)} failed")
+    if failed:
+        print(f"First failure: {failed[0]}")
 
 # Build a normal Observation resource
 def build_observation(did: str, pressure: float) -> dict:
     pid = DEVICE_TO_PATIENT[did]
-    return {
-        "resourceType": "Observation",
-        "id": str(uuid.uuid4()),
-        "status": "final",
-        "category": [{"coding": [{
-            "system": "http://terminology.hl7.org/CodeSystem/observation-category",
-            "code": "vital-signs"
-        }]}],
-        "code": {"coding": [{
-            "system": "http://loinc.org",
-            "code": "14147-5",
-            "display": "Negative Pressure"
-        }], "text": "Negative Pressure"},
-        "subject": {"reference": f"Patient/{pid}"},
-        "device": {"reference": f"Device/{did}"},
-        "effectiveDateTime": datetime.now(timezone.utc).isoformat(timespec='milliseconds'),
-        "valueQuantity": {
-            "value": pressure,
-            "unit": "cmH2O",
-            "system": "http://unitsofmeasure.org",
-            "code": "cmH2O"
-        }
-    }
+    return fhir_resources.NEGATIVE_PRESSURE.build(f"Patient/{pid}", pressure, device=f"Device/{did}")
 
 # Build an error Observation resource
 def build_error_observation(did: str) -> dict:
     pid = DEVICE_TO_PATIENT[did]
-    return {
-        "resourceType": "Observation",
-        "id": str(uuid.uuid4()),
-        "status": "final",
-        "category": [{"coding": [{
-            "system": "http://terminology.hl7.org/CodeSystem/observation-category",
-            "code": "vital-signs"
-        }]}],
-        "code": {"coding": [{
-            "system": "http://example.org/fhir/CodeSystem/device-error",
-            "code": "DEVICE_ERROR",
-            "display": "Device Error"
-        }], "text": "Device Error"},
-        "subject": {"reference": f"Patient/{pid}"},
-        "device": {"reference": f"Device/{did}"},
-        "effectiveDateTime": datetime.now(timezone.utc).isoformat(timespec='milliseconds'),
-        "valueString": "Suction failure"
-    }
+    return fhir_resources.SUCTION_ERROR.build(f"Patient/{pid}", "Suction failure", device=f"Device/{did}")
+
+def log_observation(did, future):
+    if future.cancelled():
+        return
+    if future.exception() is not None:
+        print(f"[{did}] Observation failed: {future.exception()}")
+    else:
+        print(f"[{did}] Observation/{future.result()}")
+
+def observation_written(did, future):
+    write_slots.release()
+    log_observation(did, future)
+
+async def device_tick(did):
+    # 10% chance to simulate device error
+    if random.random() < 0.1:
+        obs = build_error_observation(did)
+        payload = {"device": did, "time": obs["effectiveDateTime"], "error": True, "message": "Suction failure"}
+        print(f"[{did}] **Simulated DEVICE ERROR** at {obs['effectiveDateTime']}")
+    else:
+        val = -random.uniform(50, 100)
+        obs = build_observation(did, val)
+        payload = {"device": did, "time": obs["effectiveDateTime"], "value": val}
+
+    # Queue for the next transaction Bundle to HAPI; at most
+    # MAX_PENDING_WRITES are outstanding, after that ticks wait (and show
+    # up as missed deadlines)
+    await write_slots.acquire()
+    future = await batcher.add(obs)
+    future.add_done_callback(lambda f, did=did: observation_written(did, f))
+
+    # Push via WebSocket
+    notify_subscribers(did, json.dumps(payload))
+
+scheduler = FixedRateScheduler(device_tick, period=DEVICE_PERIOD, tolerance=DEADLINE_TOLERANCE)
 
 async def producer():
-    ensure_resources()
-    time.sleep(2)
-    while True:
-        for did in DEVICE_IDS:
-            # 90% chance to simulate device error
-            if random.random() < 0.1:
-                obs = build_error_observation(did)
-                payload = {"device": did, "time": obs["effectiveDateTime"], "error": True, "message": "Suction failure"}
-                print(f"[{did}] **Simulated DEVICE ERROR** at {obs['effectiveDateTime']}")
-            else:
-                val = -random.uniform(50, 100)
-                obs = build_observation(did, val)
-                payload = {"device": did, "time": obs["effectiveDateTime"], "value": val}
-
-            # POST to HAPI
-            r = requests.post(
-                f"{FHIR_URL}/Observation", json=obs, headers=HEADERS
-            )
-            print(f"[{did}] Observation → {r.status_code}")
-            if r.status_code >= 400:
-                print(r.text)
-
-            # Push via WebSocket
-            await notify_all(json.dumps(payload))
-        await asyncio.sleep(5)
+    await writer.start()
+    await ensure_resources()
+    await scheduler.run(DEVICE_IDS)
 
 async def handler(ws):
     print("→ New WS client connected")
@@ -154,7 +149,11 @@ async def main():
     # Start WebSocket server and data producer
     async with websockets.serve(handler, '127.0.0.1', WS_PORT):
         print(f"WebSocket server running at ws://127.0.0.1:{WS_PORT}")
-        await producer()
+        stats_task = asyncio.create_task(report_stats())
+        try:
+            await producer()
+        finally:
+            stats_task.cancel()
 
 if __name__ == '__main__':
     asyncio.run(main())
\ No newline at end of file
@@ -0,0 +1,146 @@
+import asyncio
+import json
+import sqlite3
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+WAL_PATH = "ingest_wal.sqlite3"
+WAL_COMMIT_INTERVAL = 0.02
+
+
+class WriteAheadLog:
+    """Append-only SQLite log of accepted device messages.
+
+    Appends are group-committed: everything appended within
+    `commit_interval` goes into one transaction, so many messages share a
+    single fsync. Records stay in the log until they are acked, and a
+    restarted server replays whatever was left.
+
+    `received_at` is when the server received a record, and the lag is
+    measured from it. `observed_at` is when the device took the reading, if
+    that was earlier (backfilled messages); reads return it instead of
+    `received_at` when it is set.
+    """
+
+    def __init__(self, path=WAL_PATH, commit_interval=WAL_COMMIT_INTERVAL):
+        self.path = path
+        self.commit_interval = commit_interval
+        # All SQLite access happens on this single thread.
+        self.executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="wal")
+        self.db = None
+        self.buffer = []
+        self.acks = []
+        self.committer = None
+        self.has_data = None
+        self.depth = 0
+        self.appended = 0
+        self.acked = 0
+
+    async def start(self):
+        self.has_data = asyncio.Event()
+        self.depth = await self._run(self._open)
+        if self.depth:
+            print(f"[WAL] Replaying {self.depth} unacked records from {self.path}")
+            self.has_data.set()
+        self.committer = asyncio.create_task(self._commit_loop())
+
+    async def append(self, received_at, record, observed_at=None):
+        """Add a record and wait until it is durable. Returns its sequence number."""
+        future = asyncio.get_running_loop().create_future()
+        self.buffer.append((received_at, observed_at, json.dumps(record), future))
+        return await future
+
+    async def read_batch(self, after_seq, limit):
+        return await self._run(self._read_batch, after_seq, limit)
+
+    async def wait_for_data(self):
+        await self.has_data.wait()
+        self.has_data.clear()
+
+    def ack(self, seq):
+        # Deletes ride along with the next group commit. An ack lost in a
+        # crash only means the record is replayed once more.
+        self.acks.append(seq)
+        self.depth -= 1
+        self.acked += 1
+
+    async def stats(self):
+        oldest = await self._run(self._oldest_received_at)
+        return {
+            "depth": self.depth,
+            "lag_seconds": time.time() - oldest if oldest is not None else 0.0,
+            "appended": self.appended,
+            "acked": self.acked,
+        }
+
+    async def _run(self, fn, *args):
+        return await asyncio.get_running_loop().run_in_executor(self.executor, fn, *args)
+
+    async def _commit_loop(self):
+        while True:
+            await asyncio.sleep(self.commit_interval)
+            if not self.buffer and not self.acks:
+                continue
+            batch, self.buffer = self.buffer, []
+            acks, self.acks = self.acks, []
+            try:
+                seqs = await self._run(self._commit, [row[:3] for row in batch], acks)
+            except Exception as e:
+                print(f"[WAL] Commit of {len(batch)} records failed: {e}")
+                self.acks.extend(acks)
+                for *_, future in batch:
+                    if not future.cancelled():
+                        future.set_exception(e)
+                continue
+
+            if not batch:
+                continue
+            self.depth += len(batch)
+            self.appended += len(batch)
+            for (*_, future), seq in zip(batch, seqs):
+                if not future.cancelled():
+                    future.set_result(seq)
+            self.has_data.set()
+
+    def _open(self):
+        self.db = sqlite3.connect(self.path, check_same_thread=False, isolation_level=None)
+        self.db.execute("PRAGMA journal_mode=WAL")
+        self.db.execute("PRAGMA synchronous=FULL")
+        self.db.execute(
+            "CREATE TABLE IF NOT EXISTS records ("
+            "seq INTEGER PRIMARY KEY AUTOINCREMENT, "
+            "received_at REAL NOT NULL, "
+            "payload TEXT NOT NULL, "
+            "observed_at REAL)"
+        )
+        columns = [row[1] for row in self.db.execute("PRAGMA table_info(records)")]
+        if "observed_at" not in columns:
+            # A log left by an older server
+            self.db.execute("ALTER TABLE records ADD COLUMN observed_at REAL")
+        return self.db.execute("SELECT COUNT(*) FROM records").fetchone()[0]
+
+    def _commit(self, rows, acks):
+        seqs = []
+        self.db.execute("BEGIN")
+        try:
+            for received_at, observed_at, payload in rows:
+                cursor = self.db.execute("INSERT INTO records (received_at, observed_at, payload) VALUES (?, ?, ?)",
+                                         (received_at, observed_at, payload))
+                seqs.append(cursor.lastrowid)
+            self.db.executemany("DELETE FROM records WHERE seq = ?", [(seq,) for seq in acks])
+            self.db.execute("COMMIT")
+        except Exception:
+            self.db.execute("ROLLBACK")
+            raise
+        return seqs
+
+    def _read_batch(self, after_seq, limit):
+        rows = self.db.execute(
+            "SELECT seq, COALESCE(observed_at, received_at), payload FROM records WHERE seq > ? ORDER BY seq LIMIT ?",
+            (after_seq, limit),
+        ).fetchall()
+        return [(seq, observed_at, json.loads(payload)) for seq, observed_at, payload in rows]
+
+    def _oldest_received_at(self):
+        row = self.db.execute("SELECT received_at FROM records ORDER BY seq LIMIT 1").fetchone()
+        return row[0] if row else None